@@ -21,6 +21,12 @@
 {{- end -}}
 
 {{- define "zfs-feature-discovery.config" -}}
+{{- if .hostHelper }}
+host_root: "/host"
+zfs_command: {{ .zfs.hostBin | quote }}
+zpool_command: {{ .zpool.hostBin | quote }}
+hostid_command: {{ .hostid.hostBin | quote }}
+{{- else }}
 {{- if .zfs.command }}
 zfs_command: {{ .zfs.command | quote }}
 {{- end }}
@@ -30,6 +36,7 @@ zpool_command: {{ .zpool.command | quote }}
 {{- if .hostid.command }}
 hostid_command: {{ .hostid.command | quote }}
 {{- end }}
+{{- end }}
 zpools: {{- include "zfs-feature-discovery.config.zpools" . | nindent 2 }}
 {{- if not (empty .zpool.props) }}
 zpool_props: {{- toYaml .zpool.props | nindent 2 }}
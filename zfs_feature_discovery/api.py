@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from zfs_feature_discovery.features import FeatureManager, RefreshResult
+from zfs_feature_discovery.loops import LoopLagMonitor
+
+log = logging.getLogger(__name__)
+
+MAX_REQUEST_SIZE = 16 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+# Routes whose content changes between refreshes, so they are not cached
+LIVE_ROUTES = frozenset(["/v1/metrics"])
+
+
+def properties_json(result: RefreshResult) -> dict[str, Any]:
+    return {
+        "zfs_version": {
+            "main": result.zfs_version.main,
+            "kernel": result.zfs_version.kernel,
+        },
+        "hostid": result.hostid,
+        "zpools": {
+            pool: (
+                {p.name: {"value": p.value, "source": p.source} for p in props.values()}
+                if props is not None
+                else None
+            )
+            for pool, props in result.zpool_props.items()
+        },
+        "datasets": {
+            pool: {
+                ds: {
+                    p.name: {"value": p.value, "source": p.source}
+                    for p in props.values()
+                }
+                for ds, props in ds_props.items()
+            }
+            for pool, ds_props in result.dataset_props.items()
+        },
+    }
+
+
+class QueryApi:
+    """
+    Read-only HTTP API serving the latest collected properties and labels from
+    memory, over a Unix socket and/or a TCP port.
+
+    Responses carry an ETag. Clients can long-poll by sending it back in
+    `If-None-Match` along with a `wait=<seconds>` query parameter: the request is
+    held until the content changes, or answered with 304 on timeout.
+    """
+
+    def __init__(
+        self,
+        fm: FeatureManager,
+        *,
+        socket_path: Optional[Path] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        max_wait: float = 300,
+        lag_monitor: Optional[LoopLagMonitor] = None,
+    ) -> None:
+        self.fm = fm
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.max_wait = max_wait
+        self.lag_monitor = lag_monitor
+
+        self._routes: dict[str, Callable[[], Optional[Any]]] = {
+            "/v1/labels": lambda: self.fm.labels if self.fm.last_result else None,
+            "/v1/properties": lambda: (
+                properties_json(self.fm.last_result) if self.fm.last_result else None
+            ),
+            "/v1/status": lambda: {
+                "generation": self.fm.generation,
+                "changed_labels_total": self.fm.changed_labels_total,
+            },
+            "/v1/metrics": lambda: {
+                "loop_lag": self.lag_monitor.stats() if self.lag_monitor else None,
+            },
+        }
+        # route -> (generation, body, etag), so bodies are only serialized once per
+        # refresh no matter how many clients poll
+        self._bodies: dict[str, tuple[int, bytes, str]] = {}
+        self._servers: list[asyncio.Server] = []
+        self._handlers: set[asyncio.Task[None]] = set()
+
+    def render(self, route: str) -> Optional[tuple[bytes, str]]:
+        generation = self.fm.generation
+        cached = self._bodies.get(route)
+        if cached and cached[0] == generation and route not in LIVE_ROUTES:
+            return cached[1], cached[2]
+
+        data = self._routes[route]()
+        if data is None:
+            return None
+
+        body = json.dumps(data, sort_keys=True).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._bodies[route] = (generation, body, etag)
+        return body, etag
+
+    async def respond(
+        self, route: str, if_none_match: Optional[str], wait: float
+    ) -> tuple[int, bytes, Optional[str]]:
+        deadline = time.monotonic() + max(0, min(wait, self.max_wait))
+        while True:
+            generation = self.fm.generation
+            rendered = self.render(route)
+            if rendered is None:
+                return 503, b'{"error": "no data collected yet"}', None
+
+            body, etag = rendered
+            if etag != if_none_match:
+                return 200, body, etag
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 304, b"", etag
+
+            await self.fm.wait_for_refresh(generation, remaining)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Keep track of handlers, so pending long-polls don't hold up shutdown
+        task = asyncio.current_task()
+        assert task
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+        try:
+            try:
+                status, body, etag = await self._handle_request(reader)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                status, body, etag = 400, b"", None
+
+            headers = [
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+                "Content-Type: application/json",
+                f"Content-Length: {len(body)}",
+                "Connection: close",
+            ]
+            if etag:
+                headers.append(f"ETag: {etag}")
+
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # Also reached on cancellation, so clients are not left hanging
+            writer.close()
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[int, bytes, Optional[str]]:
+        request = await reader.readuntil(b"\r\n\r\n")
+        if len(request) > MAX_REQUEST_SIZE:
+            raise ValueError("Request too large")
+
+        request_line, *header_lines = request.decode("latin-1").split("\r\n")
+        method, target, _ = request_line.split(" ", 2)
+
+        headers = {}
+        for line in header_lines:
+            if not line:
+                continue
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        if method not in ("GET", "HEAD"):
+            return 405, b"", None
+
+        url = urlsplit(target)
+        if url.path not in self._routes:
+            return 404, b"", None
+
+        query = parse_qs(url.query)
+        wait = float(query.get("wait", ["0"])[0])
+        # A NaN deadline never passes, so the request would spin forever
+        if not math.isfinite(wait) or wait < 0:
+            return 400, b"", None
+
+        status, body, etag = await self.respond(
+            url.path, headers.get("if-none-match"), wait
+        )
+        return status, body if method == "GET" else b"", etag
+
+    async def start(self) -> None:
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+            server = await asyncio.start_unix_server(
+                self.handle, path=self.socket_path, limit=MAX_REQUEST_SIZE
+            )
+            self._servers.append(server)
+            log.info(f"Serving query API on {self.socket_path}")
+
+        if self.port is not None:
+            server = await asyncio.start_server(
+                self.handle, host=self.host, port=self.port, limit=MAX_REQUEST_SIZE
+            )
+            self._servers.append(server)
+            log.info(f"Serving query API on {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+
+        for task in list(self._handlers):
+            task.cancel()
+
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    async def __aenter__(self) -> "QueryApi":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_: Any) -> bool:
+        await self.close()
+        return False
@@ -0,0 +1,5 @@
+"""
+Refresh benchmarks against synthetic `zfs`/`zpool` output at scale
+
+Run with `python -m zfs_feature_discovery.benchmark --help`
+"""
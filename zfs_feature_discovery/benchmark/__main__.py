@@ -0,0 +1,75 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Optional, Sequence
+
+from zfs_feature_discovery.benchmark.runner import (
+    DEFAULT_BASELINE_PATH,
+    DEFAULT_DATASETS,
+    DEFAULT_POOLS,
+    DEFAULT_TOLERANCE,
+    format_report,
+    load_baseline,
+    results_to_json,
+    run_isolated,
+    run_scenario,
+    save_baseline,
+    scenario_matrix,
+)
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m zfs_feature_discovery.benchmark",
+        description="Benchmark FeatureManager.refresh against fake zfs commands",
+    )
+    parser.add_argument(
+        "--datasets", type=int, nargs="+", default=list(DEFAULT_DATASETS)
+    )
+    parser.add_argument("--pools", type=int, nargs="+", default=list(DEFAULT_POOLS))
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing",
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json", type=Path, help="Write raw results as JSON")
+    parser.add_argument(
+        "--no-isolate",
+        action="store_true",
+        help="Run all scenarios in this process. Peak RSS becomes cumulative.",
+    )
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    opts = parse_args(args)
+    run = run_scenario if opts.no_isolate else run_isolated
+
+    results = []
+    for scenario in scenario_matrix(opts.datasets, opts.pools):
+        print(f"Running {scenario.name}", file=sys.stderr)
+        results.append(run(scenario, opts.iterations, opts.warmup))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(results_to_json(results), f, indent=2)
+
+    if opts.update_baseline:
+        save_baseline(opts.baseline, results)
+        baseline = {}
+    else:
+        baseline = load_baseline(opts.baseline)
+
+    report, regressed = format_report(results, baseline, opts.tolerance)
+    print(report)
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Compare the per-command latency of entering the host filesystem through a wrapper
+script on every call, as the Helm chart's `host-*` wrappers do, with a host
+helper process entering it once
+
+Entering needs to be able to chroot, usually as root. The fake host is the current
+root filesystem, so no host is needed.
+
+Run with `python -m zfs_feature_discovery.benchmark.host --help`
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Literal, Optional, Sequence
+
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+HostMode = Literal["direct", "wrapper", "session"]
+HOST_MODES: tuple[HostMode, ...] = ("direct", "wrapper", "session")
+
+# Same logic as `hostBinWrapperScript` in the Helm chart
+WRAPPER_SCRIPT = """\
+#!/bin/sh
+if [ -f "{root}/$1" ]; then
+  exec chroot "{root}" "$@"
+else
+  exec chroot "{root}" /bin/sh -c '"$@"' sh "$@"
+fi
+"""
+
+
+@dataclass
+class HostResult:
+    mode: str
+    commands: int
+    p50_ms: float
+    p90_ms: float
+
+
+def fake_wrapper(path: Path, root: Path) -> Path:
+    path.write_text(WRAPPER_SCRIPT.format(root=root))
+    path.chmod(0o755)
+    return path
+
+
+def harness_for(
+    mode: HostMode, command: str, work_dir: Path, root: Path
+) -> CommandHarness:
+    if mode == "wrapper":
+        wrapper = fake_wrapper(work_dir / "host-wrapper", root)
+        return CommandHarness(str(wrapper), command)
+    if mode == "session":
+        return CommandHarness(command, host=HostNamespace(root=root))
+
+    return CommandHarness(command)
+
+
+async def command_latencies(harness: CommandHarness, count: int) -> list[float]:
+    """
+    Seconds to spawn each command and wait for it to exit, one at a time
+    """
+
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await harness.check_output()
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+async def benchmark_mode(
+    mode: HostMode, command: str, count: int, work_dir: Path, root: Path
+) -> HostResult:
+    harness = harness_for(mode, command, work_dir, root)
+    try:
+        # Warm up the page cache
+        await command_latencies(harness, 1)
+        latencies = sorted(await command_latencies(harness, count))
+    finally:
+        if harness.host:
+            await harness.host.close()
+
+    return HostResult(
+        mode=mode,
+        commands=count,
+        p50_ms=round(latencies[len(latencies) // 2] * 1000, 3),
+        p90_ms=round(latencies[int(len(latencies) * 0.9)] * 1000, 3),
+    )
+
+
+def run_host_benchmark(
+    modes: Sequence[HostMode],
+    count: int,
+    command: str = "/bin/true",
+    root: Path = Path("/"),
+) -> list[HostResult]:
+    logging.getLogger("zfs_feature_discovery").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="zfs-feature-discovery-host-") as tmp:
+        return [
+            asyncio.run(benchmark_mode(mode, command, count, Path(tmp), root))
+            for mode in modes
+        ]
+
+
+def format_report(results: Sequence[HostResult]) -> str:
+    keys = ["commands", "p50_ms", "p90_ms"]
+    lines = [f"{'mode':>8}  " + "  ".join(f"{k:>10}" for k in keys)]
+    for result in results:
+        data = asdict(result)
+        lines.append(f"{result.mode:>8}  " + "  ".join(f"{data[k]:>10}" for k in keys))
+
+    return "\n".join(lines)
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m zfs_feature_discovery.benchmark.host",
+        description="Compare per-command latency of host filesystem entry modes",
+    )
+    parser.add_argument(
+        "--modes", nargs="+", choices=HOST_MODES, default=list(HOST_MODES)
+    )
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument(
+        "--command", default="/bin/true", help="Command to run, as a host path"
+    )
+    parser.add_argument("--json", type=Path, help="Write results as JSON")
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    opts = parse_args(args)
+
+    results = run_host_benchmark(opts.modes, opts.commands, opts.command)
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+    print(format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Compare event loop implementations on subprocess spawning, pipe reads and refresh
+latency
+
+Run with `python -m zfs_feature_discovery.benchmark.loops --help`
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Sequence
+
+from zfs_feature_discovery.benchmark.runner import (
+    Scenario,
+    ScenarioResult,
+    benchmark_refresh,
+)
+from zfs_feature_discovery.benchmark.synthetic import dataset_names, zfs_get_output
+from zfs_feature_discovery.loops import EventLoopName, loop_factory, uvloop_available
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+
+@dataclass
+class LoopResult:
+    loop: str
+    spawns_per_s: float
+    read_mb_per_s: float
+    refresh_p50_ms: float
+
+
+async def spawn_throughput(count: int, concurrency: int) -> float:
+    """
+    Commands spawned, waited for and reaped per second
+    """
+
+    harness = CommandHarness("/bin/true")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def spawn() -> None:
+        async with semaphore:
+            async with harness.run() as proc:
+                await proc.wait()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(spawn() for _ in range(count)))
+    return count / (time.perf_counter() - start)
+
+
+async def read_throughput(path: Path, repeats: int) -> float:
+    """
+    MB per second of command output read and split into lines
+    """
+
+    harness = CommandHarness("/bin/cat", *([str(path)] * repeats))
+
+    start = time.perf_counter()
+    size = 0
+    async with harness.run() as proc:
+        async for lines in proc.line_batches():
+            size += sum(map(len, lines)) + len(lines)
+        await proc.wait()
+
+    return size / 1e6 / (time.perf_counter() - start)
+
+
+async def benchmark_loop(
+    name: str, opts: argparse.Namespace, work_dir: Path
+) -> LoopResult:
+    spawns = await spawn_throughput(opts.spawns, opts.concurrency)
+
+    data_path = work_dir / "zfs-get"
+    data_path.write_text(zfs_get_output("tank", dataset_names(opts.read_datasets)))
+    read_mb = await read_throughput(data_path, opts.read_repeats)
+
+    refresh_dir = work_dir / "refresh"
+    refresh_dir.mkdir()
+    scenario = Scenario(pools=opts.pools, datasets=opts.datasets)
+    latencies, _ = await benchmark_refresh(
+        scenario, refresh_dir, opts.iterations, opts.warmup
+    )
+    refresh = ScenarioResult(scenario, latencies=latencies)
+
+    return LoopResult(
+        loop=name,
+        spawns_per_s=round(spawns, 1),
+        read_mb_per_s=round(read_mb, 1),
+        refresh_p50_ms=round(refresh.percentile(50) * 1000, 3),
+    )
+
+
+def run_loop_benchmark(name: EventLoopName, opts: argparse.Namespace) -> LoopResult:
+    logging.getLogger("zfs_feature_discovery").setLevel(logging.WARNING)
+
+    with (
+        tempfile.TemporaryDirectory(prefix="zfs-feature-discovery-loops-") as tmp,
+        asyncio.Runner(loop_factory=loop_factory(name)) as runner,
+    ):
+        return runner.run(benchmark_loop(name, opts, Path(tmp)))
+
+
+def format_report(results: Sequence[LoopResult]) -> str:
+    keys = ["spawns_per_s", "read_mb_per_s", "refresh_p50_ms"]
+    lines = [f"{'loop':>10}  " + "  ".join(f"{k:>16}" for k in keys)]
+    for result in results:
+        data = asdict(result)
+        lines.append(f"{result.loop:>10}  " + "  ".join(f"{data[k]:>16}" for k in keys))
+
+    return "\n".join(lines)
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m zfs_feature_discovery.benchmark.loops",
+        description="Compare event loops on subprocess spawning and refreshes",
+    )
+    parser.add_argument(
+        "--loops",
+        nargs="+",
+        choices=["asyncio", "uvloop"],
+        default=["asyncio", "uvloop"] if uvloop_available() else ["asyncio"],
+    )
+    parser.add_argument("--spawns", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--read-datasets",
+        type=int,
+        default=10000,
+        help="Datasets in the `zfs get` output read by the read benchmark",
+    )
+    parser.add_argument("--read-repeats", type=int, default=5)
+    parser.add_argument("--datasets", type=int, default=1000)
+    parser.add_argument("--pools", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="Write results as JSON")
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    opts = parse_args(args)
+
+    results = []
+    for name in opts.loops:
+        print(f"Benchmarking {name}", file=sys.stderr)
+        results.append(run_loop_benchmark(name, opts))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+    print(format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
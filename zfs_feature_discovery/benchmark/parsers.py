@@ -0,0 +1,147 @@
+"""
+Compare parsing `zfs get` output in text (`-Hp`) and JSON (`-jp`) formats
+
+Run with `python -m zfs_feature_discovery.benchmark.parsers --help`
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Sequence
+
+from zfs_feature_discovery.benchmark.synthetic import FakeCommands, dataset_names
+from zfs_feature_discovery.zfs_props import OutputFormat
+from zfs_feature_discovery.zpool import ZpoolManager
+
+POOL = "tank"
+
+
+@dataclass
+class ParserResult:
+    output_format: str
+    datasets: int
+    output_mb: float
+    p50_ms: float
+    props_per_s: float
+    # Peak Python memory while reading and parsing, measured in a separate run
+    peak_mb: float
+
+
+async def parse_once(zpool: ZpoolManager) -> tuple[float, int]:
+    start = time.perf_counter()
+    props = await zpool.dataset_properties()
+    elapsed = time.perf_counter() - start
+
+    return elapsed, sum(map(len, props.values()))
+
+
+async def benchmark_format(
+    output_format: OutputFormat,
+    fake: FakeCommands,
+    datasets: list[str],
+    iterations: int,
+) -> ParserResult:
+    zpool = ZpoolManager(
+        POOL,
+        datasets=datasets,
+        zpool_command=fake.zpool,
+        zfs_command=fake.zfs,
+        output_format=output_format,
+    )
+
+    # Warm up the page cache
+    await parse_once(zpool)
+
+    latencies = []
+    for _ in range(iterations):
+        elapsed, props = await parse_once(zpool)
+        latencies.append(elapsed)
+
+    tracemalloc.start()
+    try:
+        await parse_once(zpool)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    suffix = ".json" if output_format == "json" else ""
+    size = (fake.data_dir / f"zfs.{POOL}{suffix}").stat().st_size
+    p50 = sorted(latencies)[len(latencies) // 2]
+
+    return ParserResult(
+        output_format=output_format,
+        datasets=len(datasets),
+        output_mb=round(size / 1e6, 1),
+        p50_ms=round(p50 * 1000, 3),
+        props_per_s=round(props / p50),
+        peak_mb=round(peak / 1e6, 1),
+    )
+
+
+def run_parser_benchmark(
+    dataset_count: int, formats: Sequence[OutputFormat], iterations: int
+) -> list[ParserResult]:
+    logging.getLogger("zfs_feature_discovery").setLevel(logging.WARNING)
+    datasets = dataset_names(dataset_count)
+
+    with tempfile.TemporaryDirectory(prefix="zfs-feature-discovery-parsers-") as tmp:
+        fake = FakeCommands(Path(tmp))
+        fake.setup({POOL: datasets}, with_json=True)
+
+        return [
+            asyncio.run(benchmark_format(fmt, fake, datasets, iterations))
+            for fmt in formats
+        ]
+
+
+def format_report(results: Sequence[ParserResult]) -> str:
+    keys = ["datasets", "output_mb", "p50_ms", "props_per_s", "peak_mb"]
+    lines = [f"{'format':>8}  " + "  ".join(f"{k:>12}" for k in keys)]
+    for result in results:
+        data = asdict(result)
+        lines.append(
+            f"{result.output_format:>8}  " + "  ".join(f"{data[k]:>12}" for k in keys)
+        )
+
+    return "\n".join(lines)
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m zfs_feature_discovery.benchmark.parsers",
+        description="Compare parsing zfs get output in text and JSON formats",
+    )
+    parser.add_argument("--datasets", type=int, nargs="+", default=[10000])
+    parser.add_argument(
+        "--formats", nargs="+", choices=["text", "json"], default=["text", "json"]
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--json", type=Path, help="Write results as JSON")
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    opts = parse_args(args)
+
+    results = []
+    for count in opts.datasets:
+        print(f"Benchmarking {count} datasets", file=sys.stderr)
+        results.extend(run_parser_benchmark(count, opts.formats, opts.iterations))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+    print(format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
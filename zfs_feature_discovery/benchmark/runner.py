@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from zfs_feature_discovery.benchmark.synthetic import (
+    FakeCommands,
+    pool_names,
+    split_datasets,
+)
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager, RefreshResult
+from zfs_feature_discovery.labels import normalize_key, normalize_labels
+from zfs_feature_discovery.zpool import ZpoolManager
+
+DEFAULT_BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_DATASETS = (1, 100, 1000, 10000)
+DEFAULT_POOLS = (1, 10, 50)
+# Relative slowdown (or memory increase) over the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.25
+# Metrics compared against the baseline, which should record all of them
+REGRESSION_KEYS = ("p50_ms", "p99_ms", "peak_rss_mb", "render_ns_per_label")
+
+
+@dataclass(frozen=True)
+class Scenario:
+    pools: int
+    datasets: int
+
+    @property
+    def name(self) -> str:
+        return f"pools={self.pools},datasets={self.datasets}"
+
+    def config(self, fake: FakeCommands, feature_dir: Path) -> Config:
+        datasets = split_datasets(pool_names(self.pools), self.datasets)
+        fake.setup(datasets)
+
+        return Config.model_validate(
+            {
+                "zfs_command": fake.zfs,
+                "zpool_command": fake.zpool,
+                "hostid_command": fake.hostid,
+                "zpools": datasets,
+                "feature_dir": feature_dir,
+            }
+        )
+
+
+@dataclass
+class ScenarioResult:
+    scenario: Scenario
+    # seconds per refresh
+    latencies: list[float] = field(default_factory=list)
+    peak_rss_kb: int = 0
+    # cost of normalizing a single label when rendering
+    render_ns_per_label: float = 0
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[idx]
+
+    @property
+    def throughput(self) -> float:
+        """
+        Datasets refreshed per second
+        """
+
+        mean = sum(self.latencies) / len(self.latencies)
+        return self.scenario.datasets / mean if mean else 0
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p90_ms": round(self.percentile(90) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "datasets_per_s": round(self.throughput, 1),
+            "peak_rss_mb": round(self.peak_rss_kb / 1024, 1),
+            "render_ns_per_label": round(self.render_ns_per_label, 1),
+        }
+
+
+def scenario_matrix(
+    datasets: Iterable[int] = DEFAULT_DATASETS, pools: Iterable[int] = DEFAULT_POOLS
+) -> list[Scenario]:
+    return [Scenario(pools=p, datasets=d) for d in datasets for p in pools]
+
+
+def benchmark_render(
+    fm: FeatureManager, config: Config, result: RefreshResult, iterations: int
+) -> float:
+    """
+    Measure the cost of normalizing the labels generated from a refresh result, in
+    nanoseconds per label (best of `iterations`)
+    """
+
+    raw_labels: list[tuple[str, str]] = []
+    for pool, ds_props in result.dataset_props.items():
+        zpool = ZpoolManager(
+            pool,
+            datasets=config.zpools[pool],
+            zpool_command=config.zpool_command,
+            zfs_command=config.zfs_command,
+        )
+        for ds, props in ds_props.items():
+            raw_labels.extend(fm.gen_zfs_dataset_labels(zpool, ds, props))
+
+    if not raw_labels:
+        return 0
+
+    best: float = float("inf")
+    for _ in range(max(1, iterations)):
+        # Start cold, as keys are cached
+        normalize_key.cache_clear()
+        start = time.perf_counter_ns()
+        normalize_labels(raw_labels, fm.label_value_overflow)
+        best = min(best, time.perf_counter_ns() - start)
+
+    return best / len(raw_labels)
+
+
+async def benchmark_refresh(
+    scenario: Scenario, work_dir: Path, iterations: int, warmup: int
+) -> tuple[list[float], float]:
+    """
+    Returns the latency of each refresh, and the render cost per label
+    """
+
+    feature_dir = work_dir / "features"
+    feature_dir.mkdir()
+
+    config = scenario.config(FakeCommands(work_dir / "bin"), feature_dir)
+    latencies = []
+    async with FeatureManager.from_config(config) as fm:
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            await fm.refresh()
+            elapsed = time.perf_counter() - start
+
+            if i >= warmup:
+                latencies.append(elapsed)
+
+        # Only the labeled properties of datasets are kept after a refresh, so
+        # collect them all again
+        result = await fm.collect()
+        render_ns = benchmark_render(fm, config, result, iterations)
+
+    return latencies, render_ns
+
+
+def run_scenario(scenario: Scenario, iterations: int, warmup: int) -> ScenarioResult:
+    # Keep per-dataset logging out of the measurements
+    logging.getLogger("zfs_feature_discovery").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="zfs-feature-discovery-bench-") as tmp:
+        latencies, render_ns = asyncio.run(
+            benchmark_refresh(scenario, Path(tmp), iterations, warmup)
+        )
+
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return ScenarioResult(
+        scenario,
+        latencies=latencies,
+        peak_rss_kb=peak_rss_kb,
+        render_ns_per_label=render_ns,
+    )
+
+
+def run_isolated(scenario: Scenario, iterations: int, warmup: int) -> ScenarioResult:
+    """
+    Run a scenario in a fresh interpreter, so peak RSS only accounts for it
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_scenario, (scenario, iterations, warmup))
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, float]]:
+    try:
+        with open(path) as f:
+            data: dict[str, dict[str, float]] = json.load(f)["scenarios"]
+            return data
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path: Path, results: Iterable[ScenarioResult]) -> None:
+    data = {"scenarios": {r.scenario.name: r.summary() for r in results}}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(
+    summary: dict[str, float],
+    baseline: Optional[dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> list[str]:
+    if not baseline:
+        return []
+
+    regressions = []
+    for key in REGRESSION_KEYS:
+        if key not in baseline:
+            continue
+
+        if summary[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key} {summary[key]} > baseline {baseline[key]}")
+
+    return regressions
+
+
+def format_report(
+    results: Iterable[ScenarioResult],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> tuple[str, bool]:
+    lines = []
+    any_regression = False
+
+    keys = [
+        "p50_ms",
+        "p90_ms",
+        "p99_ms",
+        "datasets_per_s",
+        "peak_rss_mb",
+        "render_ns_per_label",
+    ]
+    lines.append(f"{'scenario':>24}  " + "  ".join(f"{k:>19}" for k in keys))
+
+    for result in results:
+        summary = result.summary()
+        lines.append(
+            f"{result.scenario.name:>24}  "
+            + "  ".join(f"{summary[k]:>19}" for k in keys)
+        )
+
+        regressions = find_regressions(
+            summary, baseline.get(result.scenario.name), tolerance
+        )
+        for regression in regressions:
+            any_regression = True
+            lines.append(f"{'':>24}  REGRESSION: {regression}")
+
+    return "\n".join(lines), any_regression
+
+
+def results_to_json(results: Iterable[ScenarioResult]) -> list[dict[str, Any]]:
+    return [
+        {"scenario": asdict(r.scenario), **r.summary(), "latencies": r.latencies}
+        for r in results
+    ]
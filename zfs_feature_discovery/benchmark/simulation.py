@@ -0,0 +1,537 @@
+"""
+Simulation of a fleet of nodes, each running its own `FeatureManager` against
+in-process fake ZFS backends, on a shared virtual clock
+
+Run with `python -m zfs_feature_discovery.benchmark.simulation --help`
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import selectors
+import sys
+import tempfile
+from asyncio import subprocess
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterator,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+    cast,
+)
+
+from zfs_feature_discovery.benchmark.synthetic import (
+    HOSTID_OUTPUT,
+    ZFS_VERSION_OUTPUT,
+    pool_names,
+    split_datasets,
+    zfs_get_output,
+    zpool_get_output,
+)
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+if TYPE_CHECKING:
+    from _typeshed import FileDescriptorLike
+
+T = TypeVar("T")
+
+# How nodes start their refresh loops: all at once (as after a rollout of the
+# DaemonSet), or at a random offset within the first interval
+Splay = Literal["none", "random"]
+
+# Properties that change by themselves on a live system
+VOLATILE_PROPS = frozenset(
+    [
+        "allocated",
+        "available",
+        "capacity",
+        "fragmentation",
+        "free",
+        "logicalreferenced",
+        "logicalused",
+        "referenced",
+        "used",
+        "usedbydataset",
+        "written",
+    ]
+)
+
+
+class VirtualClockSelector(selectors.BaseSelector):
+    """
+    Selector that, instead of blocking until the next timer is due, advances the
+    loop's virtual clock to it. It only blocks for real while the executor is busy
+    (file I/O), as completions are signalled through the loop's self-pipe.
+    """
+
+    def __init__(self, loop: "VirtualTimeEventLoop") -> None:
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def register(
+        self, fileobj: "FileDescriptorLike", events: int, data: Any = None
+    ) -> selectors.SelectorKey:
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj: "FileDescriptorLike") -> selectors.SelectorKey:
+        return self._selector.unregister(fileobj)
+
+    def modify(
+        self, fileobj: "FileDescriptorLike", events: int, data: Any = None
+    ) -> selectors.SelectorKey:
+        return self._selector.modify(fileobj, events, data)
+
+    def get_map(self) -> Mapping["FileDescriptorLike", selectors.SelectorKey]:
+        return self._selector.get_map()
+
+    def close(self) -> None:
+        self._selector.close()
+
+    def select(
+        self, timeout: Optional[float] = None
+    ) -> list[tuple[selectors.SelectorKey, int]]:
+        if self._loop.executor_busy or timeout is None:
+            return self._selector.select(timeout)
+
+        events = self._selector.select(0)
+        if not events and timeout > 0:
+            self._loop.advance(timeout)
+
+        return events
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock only moves forward when every task is waiting on a timer,
+    so hours of refreshes run in seconds
+    """
+
+    def __init__(self) -> None:
+        self._virtual_time = 0.0
+        self._executor_jobs = 0
+        super().__init__(VirtualClockSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float) -> None:
+        self._virtual_time += seconds
+
+    @property
+    def executor_busy(self) -> bool:
+        return self._executor_jobs > 0
+
+    def _executor_job_done(self, _: "asyncio.Future[Any]") -> None:
+        self._executor_jobs -= 1
+
+    def run_in_executor(  # type: ignore[override]
+        self, executor: Any, func: Callable[..., T], *args: Any
+    ) -> "asyncio.Future[T]":
+        fut = super().run_in_executor(executor, func, *args)
+        # Only counted as done once the result is back on the loop, so the clock
+        # can't advance in between
+        self._executor_jobs += 1
+        fut.add_done_callback(self._executor_job_done)
+        return fut
+
+
+class FakeProcess:
+    """
+    Stand-in for `asyncio.subprocess.Process`, producing its output and exiting
+    after `latency` seconds
+    """
+
+    def __init__(
+        self,
+        pid: int,
+        output: bytes,
+        latency: float,
+        on_exit: Callable[[], None],
+        exit_code: int = 0,
+    ) -> None:
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
+
+        self._exited = asyncio.Event()
+        self._on_exit = on_exit
+        asyncio.get_running_loop().call_later(latency, self._exit, output, exit_code)
+
+    def kill(self) -> None:
+        self._exit(b"", -9)
+
+    def _exit(self, output: bytes, exit_code: int) -> None:
+        if self.returncode is not None:
+            return
+
+        self.stdout.feed_data(output)
+        self.stdout.feed_eof()
+        self.stderr.feed_eof()
+        self.returncode = exit_code
+        self._exited.set()
+        self._on_exit()
+
+    async def wait(self) -> int:
+        await self._exited.wait()
+        assert self.returncode is not None
+        return self.returncode
+
+
+def _parse_rows(output: str) -> list[list[str]]:
+    return [line.split("\t") for line in output.splitlines()]
+
+
+def _format_rows(rows: list[list[str]]) -> bytes:
+    return "".join("\t".join(row) + "\n" for row in rows).encode()
+
+
+class FakeNode:
+    """
+    ZFS state of a simulated node. Volatile properties get new values at random, at
+    an average of `changes_per_minute`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        datasets: dict[str, list[str]],
+        *,
+        changes_per_minute: float,
+        rng: random.Random,
+    ) -> None:
+        self.name = name
+        self.changes_per_minute = changes_per_minute
+        self._rng = rng
+
+        self.zpool_rows = {
+            pool: _parse_rows(zpool_get_output(pool, seed=rng.getrandbits(32)))
+            for pool in datasets
+        }
+        self.zfs_rows = {
+            pool: _parse_rows(zfs_get_output(pool, ds, seed=rng.getrandbits(32)))
+            for pool, ds in datasets.items()
+        }
+        self._volatile = [
+            row
+            for rows in [*self.zpool_rows.values(), *self.zfs_rows.values()]
+            for row in rows
+            if row[1] in VOLATILE_PROPS
+        ]
+        self._last_change = 0.0
+
+    def apply_changes(self, now: float) -> None:
+        expected = (now - self._last_change) / 60 * self.changes_per_minute
+        self._last_change = now
+
+        count = int(expected)
+        if self._rng.random() < expected - count:
+            count += 1
+
+        for _ in range(min(count, len(self._volatile))):
+            row = self._rng.choice(self._volatile)
+            row[2] = str(self._rng.randint(0, 2**40))
+
+    def output(self, cmd: Sequence[str]) -> bytes:
+        kind = Path(cmd[0]).name
+        if kind == "hostid":
+            return HOSTID_OUTPUT.encode()
+        if kind == "zfs" and cmd[1] == "version":
+            return ZFS_VERSION_OUTPUT.encode()
+        if kind == "zfs":
+            pool = cmd[-1].split("/", 1)[0]
+            return _format_rows(self.zfs_rows[pool])
+        if kind == "zpool":
+            return _format_rows(self.zpool_rows[cmd[-1]])
+
+        raise ValueError(f"Unknown command: {cmd}")
+
+
+@dataclass(frozen=True)
+class SimulationSettings:
+    nodes: int = 100
+    pools: int = 1
+    # per node
+    datasets: int = 20
+    interval: float = 60
+    splay: Splay = "none"
+    duration: float = 600
+    # seconds each command takes to answer
+    latency: float = 0.05
+    changes_per_minute: float = 1
+    # extra dataset properties to label, e.g. "used,available"
+    dataset_props: str = ""
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"interval={self.interval:g},splay={self.splay}"
+
+
+@dataclass
+class SimulationResult:
+    settings: SimulationSettings
+    # event -> virtual minute -> count
+    per_minute: dict[str, Counter[int]] = field(
+        default_factory=lambda: {
+            "forks": Counter(),
+            "writes": Counter(),
+            "label_changes": Counter(),
+        }
+    )
+    peak_running_commands: int = 0
+
+    def record(self, event: str, now: float, count: int = 1) -> None:
+        self.per_minute[event][int(now // 60)] += count
+
+    def summary(self) -> dict[str, float]:
+        minutes = max(1, round(self.settings.duration / 60))
+        summary: dict[str, float] = {}
+        for event, counts in self.per_minute.items():
+            summary[f"{event}_per_min"] = round(sum(counts.values()) / minutes, 1)
+            summary[f"{event}_peak_min"] = max(counts.values(), default=0)
+
+        summary["peak_running_commands"] = self.peak_running_commands
+        return summary
+
+
+class Fleet:
+    """
+    Fake backends for all nodes, dispatching commands by path: each node uses
+    `/sim/<node>/zfs`, `/sim/<node>/zpool` and `/sim/<node>/hostid`
+    """
+
+    def __init__(self, settings: SimulationSettings, result: SimulationResult) -> None:
+        self.settings = settings
+        self.result = result
+        self.nodes: dict[str, FakeNode] = {}
+
+        self._rng = random.Random(settings.seed)
+        self._running = 0
+        # Above the kernel's maximum, so they can't be mistaken for real processes
+        self._next_pid = 2**30
+
+    def add_node(self, name: str, datasets: dict[str, list[str]]) -> FakeNode:
+        node = FakeNode(
+            name,
+            datasets,
+            changes_per_minute=self.settings.changes_per_minute,
+            rng=random.Random(self._rng.getrandbits(32)),
+        )
+        self.nodes[name] = node
+        return node
+
+    def _command_exited(self) -> None:
+        self._running -= 1
+
+    def spawn(self, cmd: Sequence[str]) -> FakeProcess:
+        now = asyncio.get_running_loop().time()
+        node = self.nodes[Path(cmd[0]).parent.name]
+        node.apply_changes(now)
+
+        self.result.record("forks", now)
+        self._running += 1
+        self.result.peak_running_commands = max(
+            self.result.peak_running_commands, self._running
+        )
+
+        latency = self.settings.latency * self._rng.uniform(0.5, 1.5)
+        self._next_pid += 1
+        return FakeProcess(
+            self._next_pid, node.output(cmd), latency, self._command_exited
+        )
+
+    @contextmanager
+    def installed(self) -> Iterator[None]:
+        """
+        Route all commands to the fake backends
+        """
+
+        original = CommandHarness._run
+
+        async def _run(_: CommandHarness, cmd: Sequence[str]) -> subprocess.Process:
+            return cast(subprocess.Process, self.spawn(cmd))
+
+        CommandHarness._run = _run  # type: ignore[method-assign, assignment]
+        try:
+            yield
+        finally:
+            CommandHarness._run = original  # type: ignore[method-assign]
+
+
+async def run_node(
+    fm: FeatureManager, settings: SimulationSettings, result: SimulationResult
+) -> None:
+    loop = asyncio.get_running_loop()
+    start = datetime.now(tz=UTC)
+
+    async def refresh() -> None:
+        writes, changes = fm.files_written, fm.changed_labels_total
+        # Feature files expire on the virtual clock too
+        async with fm.with_reference_time(start + timedelta(seconds=loop.time())):
+            await fm.refresh()
+        result.record("writes", loop.time(), fm.files_written - writes)
+        result.record("label_changes", loop.time(), fm.changed_labels_total - changes)
+
+    # Same loop as the daemon mode of the CLI
+    while loop.time() < settings.duration:
+        await asyncio.gather(asyncio.sleep(settings.interval), refresh())
+
+
+async def simulate(settings: SimulationSettings, work_dir: Path) -> SimulationResult:
+    result = SimulationResult(settings)
+    fleet = Fleet(settings, result)
+    rng = random.Random(settings.seed)
+
+    managers = []
+    for i in range(settings.nodes):
+        name = f"node{i}"
+        datasets = split_datasets(pool_names(settings.pools), settings.datasets)
+        fleet.add_node(name, datasets)
+
+        feature_dir = work_dir / name
+        feature_dir.mkdir()
+        config = Config.model_validate(
+            {
+                "zfs_command": f"/sim/{name}/zfs",
+                "zpool_command": f"/sim/{name}/zpool",
+                "hostid_command": f"/sim/{name}/hostid",
+                "zpools": datasets,
+                "zfs_dataset_props": settings.dataset_props,
+                "feature_dir": feature_dir,
+            }
+        )
+        managers.append(FeatureManager.from_config(config))
+
+    async def start(fm: FeatureManager) -> None:
+        if settings.splay == "random":
+            await asyncio.sleep(rng.uniform(0, settings.interval))
+        await run_node(fm, settings, result)
+
+    with fleet.installed():
+        await asyncio.gather(*map(start, managers))
+
+    return result
+
+
+def run_simulation(settings: SimulationSettings) -> SimulationResult:
+    # Keep per-node logging out of the way
+    logging.getLogger("zfs_feature_discovery").setLevel(logging.WARNING)
+
+    with (
+        tempfile.TemporaryDirectory(prefix="zfs-feature-discovery-sim-") as tmp,
+        asyncio.Runner(loop_factory=VirtualTimeEventLoop) as runner,
+    ):
+        return runner.run(simulate(settings, Path(tmp)))
+
+
+def format_report(results: Sequence[SimulationResult]) -> str:
+    keys = [
+        "forks_per_min",
+        "forks_peak_min",
+        "writes_per_min",
+        "writes_peak_min",
+        "label_changes_per_min",
+        "label_changes_peak_min",
+        "peak_running_commands",
+    ]
+    lines = [f"{'settings':>26}  " + "  ".join(f"{k:>22}" for k in keys)]
+    for result in results:
+        summary = result.summary()
+        lines.append(
+            f"{result.settings.name:>26}  "
+            + "  ".join(f"{summary[k]:>22}" for k in keys)
+        )
+
+    return "\n".join(lines)
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    defaults = SimulationSettings()
+    parser = argparse.ArgumentParser(
+        prog="python -m zfs_feature_discovery.benchmark.simulation",
+        description="Simulate a fleet of nodes refreshing on a virtual clock",
+    )
+    parser.add_argument("--nodes", type=int, default=defaults.nodes)
+    parser.add_argument("--pools", type=int, default=defaults.pools)
+    parser.add_argument(
+        "--datasets", type=int, default=defaults.datasets, help="Datasets per node"
+    )
+    parser.add_argument(
+        "--interval", type=float, nargs="+", default=[defaults.interval]
+    )
+    parser.add_argument(
+        "--splay", choices=["none", "random"], nargs="+", default=["none", "random"]
+    )
+    parser.add_argument(
+        "--minutes", type=float, default=defaults.duration / 60, help="Virtual time"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=defaults.latency,
+        help="Seconds each command takes",
+    )
+    parser.add_argument(
+        "--changes-per-minute",
+        type=float,
+        default=defaults.changes_per_minute,
+        help="Volatile property changes per node per minute",
+    )
+    parser.add_argument(
+        "--dataset-props",
+        default=defaults.dataset_props,
+        help="Extra dataset properties to label, e.g. used,available",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--json", type=Path, help="Write results as JSON")
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    opts = parse_args(args)
+
+    results = []
+    for interval in opts.interval:
+        for splay in opts.splay:
+            settings = SimulationSettings(
+                nodes=opts.nodes,
+                pools=opts.pools,
+                datasets=opts.datasets,
+                interval=interval,
+                splay=splay,
+                duration=opts.minutes * 60,
+                latency=opts.latency,
+                changes_per_minute=opts.changes_per_minute,
+                dataset_props=opts.dataset_props,
+                seed=opts.seed,
+            )
+            print(f"Simulating {settings.name}", file=sys.stderr)
+            results.append(run_simulation(settings))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(
+                [{**asdict(r.settings), **r.summary()} for r in results], f, indent=2
+            )
+
+    print(format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""
+Synthetic `zfs`/`zpool`/`hostid` output and fake executables serving it
+"""
+
+import json
+import random
+import stat
+from pathlib import Path
+from typing import Any, Iterable
+
+ZFS_VERSION_OUTPUT = "zfs-2.2.2-1\nzfs-kmod-2.2.2-1\n"
+HOSTID_OUTPUT = "00fac711\n"
+
+# (name, value, source) modelled after real `zfs get -Hp all` output. Values of
+# None are generated per dataset.
+ZFS_DATASET_TEMPLATE: list[tuple[str, str | None, str]] = [
+    ("type", "filesystem", "-"),
+    ("creation", None, "-"),
+    ("used", None, "-"),
+    ("available", None, "-"),
+    ("referenced", None, "-"),
+    ("compressratio", "1.84", "-"),
+    ("mounted", "yes", "-"),
+    ("quota", "0", "default"),
+    ("reservation", "0", "default"),
+    ("recordsize", "131072", "default"),
+    ("mountpoint", "none", "local"),
+    ("sharenfs", None, "local"),
+    ("checksum", "on", "default"),
+    ("compression", "zstd", "inherited from {pool}"),
+    ("atime", "on", "default"),
+    ("devices", "on", "default"),
+    ("exec", "on", "default"),
+    ("setuid", "on", "default"),
+    ("readonly", "off", "default"),
+    ("zoned", "off", "default"),
+    ("snapdir", "hidden", "default"),
+    ("aclmode", "discard", "default"),
+    ("aclinherit", "restricted", "default"),
+    ("createtxg", None, "-"),
+    ("canmount", "on", "default"),
+    ("xattr", "sa", "inherited from {pool}"),
+    ("copies", "1", "default"),
+    ("version", "5", "-"),
+    ("utf8only", "on", "-"),
+    ("normalization", "formD", "-"),
+    ("casesensitivity", "sensitive", "-"),
+    ("vscan", "off", "default"),
+    ("nbmand", "off", "default"),
+    ("sharesmb", "off", "default"),
+    ("refquota", "0", "default"),
+    ("refreservation", "0", "default"),
+    ("guid", None, "-"),
+    ("primarycache", "all", "default"),
+    ("secondarycache", "all", "default"),
+    ("usedbysnapshots", "0", "-"),
+    ("usedbydataset", None, "-"),
+    ("usedbychildren", "0", "-"),
+    ("usedbyrefreservation", "0", "-"),
+    ("logbias", "latency", "default"),
+    ("objsetid", None, "-"),
+    ("dedup", "off", "default"),
+    ("mlslabel", "none", "default"),
+    ("sync", "standard", "default"),
+    ("dnodesize", "auto", "inherited from {pool}"),
+    ("refcompressratio", "1.00", "-"),
+    ("written", None, "-"),
+    ("logicalused", None, "-"),
+    ("logicalreferenced", None, "-"),
+    ("volmode", "default", "default"),
+    ("filesystem_limit", "none", "default"),
+    ("snapshot_limit", "none", "default"),
+    ("filesystem_count", "none", "default"),
+    ("snapshot_count", "none", "default"),
+    ("snapdev", "hidden", "default"),
+    ("acltype", "posix", "inherited from {pool}"),
+    ("context", "none", "default"),
+    ("fscontext", "none", "default"),
+    ("defcontext", "none", "default"),
+    ("rootcontext", "none", "default"),
+    ("relatime", "on", "inherited from {pool}"),
+    ("redundant_metadata", "all", "default"),
+    ("overlay", "on", "default"),
+    ("encryption", "off", "default"),
+    ("keylocation", "none", "default"),
+    ("keyformat", "none", "default"),
+    ("pbkdf2iters", "0", "default"),
+    ("special_small_blocks", "0", "default"),
+]
+
+ZPOOL_TEMPLATE: list[tuple[str, str | None, str]] = [
+    ("size", None, "-"),
+    ("capacity", None, "-"),
+    ("altroot", "-", "default"),
+    ("health", "ONLINE", "-"),
+    ("guid", None, "-"),
+    ("version", "-", "default"),
+    ("bootfs", "-", "default"),
+    ("delegation", "on", "default"),
+    ("autoreplace", "off", "default"),
+    ("cachefile", "none", "local"),
+    ("failmode", "wait", "default"),
+    ("listsnapshots", "off", "default"),
+    ("autoexpand", "off", "default"),
+    ("dedupratio", "1.00", "-"),
+    ("free", None, "-"),
+    ("allocated", None, "-"),
+    ("readonly", "off", "-"),
+    ("ashift", "12", "local"),
+    ("comment", "-", "default"),
+    ("expandsize", "-", "-"),
+    ("freeing", "0", "-"),
+    ("fragmentation", None, "-"),
+    ("leaked", "0", "-"),
+    ("multihost", "off", "default"),
+    ("checkpoint", "-", "-"),
+    ("load_guid", None, "-"),
+    ("autotrim", "on", "local"),
+    ("compatibility", "openzfs-2.1-linux", "local"),
+    ("feature@async_destroy", "enabled", "local"),
+    ("feature@empty_bpobj", "active", "local"),
+    ("feature@lz4_compress", "active", "local"),
+    ("feature@encryption", "active", "local"),
+    ("feature@zstd_compress", "active", "local"),
+    ("feature@draid", "enabled", "local"),
+    ("feature@block_cloning", "disabled", "local"),
+]
+
+
+def pool_names(count: int) -> list[str]:
+    return [f"pool{i}" for i in range(count)]
+
+
+def dataset_names(count: int) -> list[str]:
+    # Some nesting, as most real trees have it
+    return [f"group{i // 100}/ds{i}" for i in range(count)]
+
+
+def split_datasets(pools: list[str], count: int) -> dict[str, list[str]]:
+    """
+    Distribute `count` datasets evenly between pools
+    """
+
+    names = dataset_names(count)
+    return {pool: names[i :: len(pools)] for i, pool in enumerate(pools)}
+
+
+# Long enough to need normalizing, with characters not allowed in label values
+SHARENFS_EXPORT = "rw=@10.0.0.0/8,no_root_squash,sec=sys,crossmnt,async,insecure"
+
+
+def _gen_value(rng: random.Random, name: str) -> str:
+    if name == "sharenfs":
+        return SHARENFS_EXPORT if rng.random() < 0.1 else "off"
+    if name in ("capacity", "fragmentation"):
+        return str(rng.randint(0, 100))
+    if "guid" in name:
+        return str(rng.getrandbits(63))
+    if name == "creation":
+        return str(rng.randint(1_600_000_000, 1_700_000_000))
+    if name in ("createtxg", "objsetid"):
+        return str(rng.randint(1, 1_000_000))
+
+    return str(rng.randint(0, 2**40))
+
+
+def _gen_rows(
+    rng: random.Random,
+    name: str,
+    pool: str,
+    template: Iterable[tuple[str, str | None, str]],
+) -> Iterable[str]:
+    for prop_name, value, source in template:
+        if value is None:
+            value = _gen_value(rng, prop_name)
+
+        yield f"{name}\t{prop_name}\t{value}\t{source.format(pool=pool)}\n"
+
+
+def zpool_get_output(pool: str, seed: int = 0) -> str:
+    rng = random.Random(f"{seed}-{pool}")
+    return "".join(_gen_rows(rng, pool, pool, ZPOOL_TEMPLATE))
+
+
+def zfs_get_output(pool: str, datasets: Iterable[str], seed: int = 0) -> str:
+    rng = random.Random(f"{seed}-{pool}")
+    return "".join(
+        row
+        for ds in datasets
+        for row in _gen_rows(rng, f"{pool}/{ds}", pool, ZFS_DATASET_TEMPLATE)
+    )
+
+
+def _json_source(source: str) -> dict[str, str]:
+    if source == "-":
+        return {"type": "NONE", "data": "-"}
+    if source.startswith("inherited from "):
+        return {"type": "INHERITED", "data": source.removeprefix("inherited from ")}
+
+    return {"type": source.upper(), "data": "-"}
+
+
+def _json_output_version(command: str) -> dict[str, Any]:
+    return {"command": command, "vers_major": 0, "vers_minor": 1}
+
+
+def _gen_json(
+    rng: random.Random,
+    name: str,
+    pool: str,
+    template: Iterable[tuple[str, str | None, str]],
+) -> dict[str, Any]:
+    properties = {}
+    for prop_name, value, source in template:
+        if value is None:
+            value = _gen_value(rng, prop_name)
+
+        properties[prop_name] = {
+            "value": value,
+            "source": _json_source(source.format(pool=pool)),
+        }
+
+    return {"name": name, "pool": pool, "properties": properties}
+
+
+def zpool_get_json_output(pool: str, seed: int = 0) -> str:
+    """
+    The same content as `zpool_get_output`, as `zpool get -jp` prints it
+    """
+
+    rng = random.Random(f"{seed}-{pool}")
+    return json.dumps(
+        {
+            "output_version": {
+                "command": "zpool get",
+                "vers_major": 0,
+                "vers_minor": 1,
+            },
+            "pools": {pool: _gen_json(rng, pool, pool, ZPOOL_TEMPLATE)},
+        }
+    )
+
+
+def zfs_get_json_output(pool: str, datasets: Iterable[str], seed: int = 0) -> str:
+    """
+    The same content as `zfs_get_output`, as `zfs get -jp` prints it
+    """
+
+    rng = random.Random(f"{seed}-{pool}")
+    return json.dumps(
+        {
+            "output_version": _json_output_version("zfs get"),
+            "datasets": {
+                f"{pool}/{ds}": _gen_json(
+                    rng, f"{pool}/{ds}", pool, ZFS_DATASET_TEMPLATE
+                )
+                for ds in datasets
+            },
+        }
+    )
+
+
+# JSON output is only served if it was generated by `FakeCommands.setup`
+FAKE_ZFS_SCRIPT = """#!/bin/sh
+# Fake zfs: `zfs version` or `zfs get ... <pool>/<dataset>...`
+case "$1" in
+version) exec cat "{data_dir}/zfs-version" ;;
+get)
+    eval "last=\\${{$#}}"
+    case " $* " in *" -jp "*) suffix=.json ;; esac
+    exec cat "{data_dir}/zfs.${{last%%/*}}$suffix"
+    ;;
+esac
+exit 1
+"""
+
+FAKE_ZPOOL_SCRIPT = """#!/bin/sh
+# Fake zpool: `zpool get ... <pool>`
+eval "last=\\${{$#}}"
+case " $* " in *" -jp "*) suffix=.json ;; esac
+exec cat "{data_dir}/zpool.$last$suffix"
+"""
+
+FAKE_HOSTID_SCRIPT = """#!/bin/sh
+exec cat "{data_dir}/hostid"
+"""
+
+
+class FakeCommands:
+    """
+    Fake `zfs`, `zpool` and `hostid` executables in a directory, serving
+    pre-generated output for a set of pools and datasets
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.data_dir = path / "data"
+
+        self.zfs = path / "zfs"
+        self.zpool = path / "zpool"
+        self.hostid = path / "hostid"
+
+    def _write_script(self, path: Path, template: str) -> None:
+        path.write_text(template.format(data_dir=self.data_dir))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def setup(
+        self, datasets: dict[str, list[str]], seed: int = 0, with_json: bool = False
+    ) -> None:
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+
+        self._write_script(self.zfs, FAKE_ZFS_SCRIPT)
+        self._write_script(self.zpool, FAKE_ZPOOL_SCRIPT)
+        self._write_script(self.hostid, FAKE_HOSTID_SCRIPT)
+
+        (self.data_dir / "zfs-version").write_text(ZFS_VERSION_OUTPUT)
+        (self.data_dir / "hostid").write_text(HOSTID_OUTPUT)
+
+        for pool, pool_datasets in datasets.items():
+            (self.data_dir / f"zpool.{pool}").write_text(zpool_get_output(pool, seed))
+            (self.data_dir / f"zfs.{pool}").write_text(
+                zfs_get_output(pool, pool_datasets, seed)
+            )
+
+            if with_json:
+                (self.data_dir / f"zpool.{pool}.json").write_text(
+                    zpool_get_json_output(pool, seed)
+                )
+                (self.data_dir / f"zfs.{pool}.json").write_text(
+                    zfs_get_json_output(pool, pool_datasets, seed)
+                )
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Mapping, Optional, cast
+
+import aiofiles
+import aiofiles.os
+from aiofiles.tempfile import NamedTemporaryFile
+
+from zfs_feature_discovery.features import RefreshResult
+from zfs_feature_discovery.zfs_globals import ZfsVersion
+from zfs_feature_discovery.zfs_props import Source, ZfsProperty
+
+if TYPE_CHECKING:
+    from zfs_feature_discovery.config import Config
+
+log = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+
+
+def _normalize(value: Any) -> Any:
+    # Sets don't have a stable iteration order between processes, so sort them to
+    # get the same hash for the same config every time
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sorted((_normalize(v) for v in value), key=json.dumps)
+
+    return value
+
+
+def config_hash(config: "Config") -> str:
+    data = config.model_dump(
+        mode="json",
+        exclude={"cache_path", "cache_max_age", "state_path", "shutdown_timeout"},
+    )
+    encoded = json.dumps(_normalize(data), sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+async def write_json(path: Path, data: Any) -> None:
+    """
+    Replace a file with JSON data atomically, through a temporary file in the same
+    directory
+    """
+
+    async with NamedTemporaryFile(
+        dir=path.parent, prefix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_fname = cast(str, tmp_file.name)
+        try:
+            await tmp_file.write(json.dumps(data).encode())
+            await tmp_file.flush()
+            await aiofiles.os.rename(tmp_fname, path)
+        finally:
+            try:
+                await aiofiles.os.unlink(tmp_fname)
+            except OSError:
+                pass
+
+
+def _dump_props(props: Mapping[str, ZfsProperty]) -> list[list[Optional[str]]]:
+    return [list(prop) for prop in props.values()]
+
+
+def _load_props(data: list[list[Any]]) -> dict[str, ZfsProperty]:
+    props = {}
+    for dataset, name, value, source in data:
+        if not all(isinstance(v, str) for v in (dataset, name, value)):
+            raise ValueError(f"Invalid property: {name}")
+
+        props[name] = ZfsProperty(
+            dataset=dataset, name=name, value=value, source=cast(Source, source)
+        )
+
+    return props
+
+
+def dump_result(result: RefreshResult) -> dict[str, Any]:
+    return {
+        "zfs_version": {
+            "main": result.zfs_version.main,
+            "kernel": result.zfs_version.kernel,
+        },
+        "hostid": result.hostid,
+        "zpool_props": {
+            pool: _dump_props(props) if props is not None else None
+            for pool, props in result.zpool_props.items()
+        },
+        "dataset_props": {
+            pool: {ds: _dump_props(props) for ds, props in ds_props.items()}
+            for pool, ds_props in result.dataset_props.items()
+        },
+    }
+
+
+def load_result(data: dict[str, Any]) -> RefreshResult:
+    return RefreshResult(
+        zfs_version=ZfsVersion(**data["zfs_version"]),
+        hostid=data["hostid"],
+        zpool_props={
+            pool: _load_props(props) if props is not None else None
+            for pool, props in data["zpool_props"].items()
+        },
+        dataset_props={
+            pool: {ds: _load_props(props) for ds, props in ds_props.items()}
+            for pool, ds_props in data["dataset_props"].items()
+        },
+    )
+
+
+class ResultCache:
+    """
+    On-disk cache of the last collected results, so that back-to-back oneshot
+    runs can skip running any commands.
+
+    Entries are only used if they were stored with the same key (usually a hash
+    of the config), and are not older than `max_age` seconds.
+    """
+
+    @classmethod
+    def from_config(cls, config: "Config") -> Optional["ResultCache"]:
+        if not config.cache_path:
+            return None
+
+        return cls(
+            path=config.cache_path,
+            key=config_hash(config),
+            max_age=config.cache_max_age,
+        )
+
+    def __init__(self, path: Path, *, key: str, max_age: float) -> None:
+        self.path = path
+        self.key = key
+        self.max_age = max_age
+
+    async def load(self) -> Optional[RefreshResult]:
+        try:
+            async with aiofiles.open(self.path) as f:
+                data = json.loads(await f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.warning(f"Failed to read cache file {self.path}, ignoring")
+            return None
+
+        if data.get("version") != CACHE_FORMAT_VERSION or data.get("key") != self.key:
+            log.debug("Cache file does not match current config, ignoring")
+            return None
+
+        age = time.time() - data.get("timestamp", 0)
+        if not 0 <= age <= self.max_age:
+            log.debug(f"Cache file is stale ({age:.1f}s old), ignoring")
+            return None
+
+        try:
+            return load_result(data["result"])
+        except (KeyError, TypeError, ValueError):
+            log.warning(f"Invalid cache file {self.path}, ignoring")
+            return None
+
+    async def store(self, result: RefreshResult) -> None:
+        data = {
+            "version": CACHE_FORMAT_VERSION,
+            "key": self.key,
+            "timestamp": time.time(),
+            "result": dump_result(result),
+        }
+
+        try:
+            await write_json(self.path, data)
+        except OSError:
+            log.exception(f"Failed writing cache file {self.path}")
+            return
+
+        log.debug(f"Wrote cache file {self.path}")
@@ -1,52 +1,73 @@
 import asyncio
 import logging
+import signal
 import time
-from functools import wraps
+from contextlib import AsyncExitStack
+from functools import cache, wraps
 from pathlib import Path
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Coroutine,
     Literal,
     Optional,
     ParamSpec,
+    Sequence,
     Type,
     TypeVar,
+    cast,
 )
 
 import aiofiles
-import yaml
-from argdantic import ArgParser  # type: ignore
-from pydantic_settings import BaseSettings
 
-from zfs_feature_discovery.config import Config, SettingsSource
+from zfs_feature_discovery import tracing
 from zfs_feature_discovery.features import FeatureManager
-from zfs_feature_discovery.zpool import ZpoolManager
+from zfs_feature_discovery.loops import EventLoopName, LoopLagMonitor, loop_factory
+from zfs_feature_discovery.profiling import ProfileMode, RefreshProfiler
 
-log = logging.getLogger(__name__)
+if TYPE_CHECKING:
+    from argdantic import ArgParser
+    from pydantic_settings import BaseSettings
+
+    from zfs_feature_discovery.config import Config, SettingsSource
 
-main = ArgParser()
+log = logging.getLogger(__name__)
 
 T = TypeVar("T")
 P = ParamSpec("P")
 
 
 def async_cmd(func: Callable[P, Coroutine[Any, Any, T]]) -> Callable[P, T]:
+    """
+    Run an async command. Its `event_loop` argument, if any, selects the event loop
+    implementation, which has to happen before the coroutine starts.
+    """
+
     @wraps(func)
     def wrapped(*args: P.args, **kwargs: P.kwargs) -> T:
-        return asyncio.run(func(*args, **kwargs))
+        event_loop = cast(EventLoopName, kwargs.get("event_loop") or "asyncio")
+        with asyncio.Runner(loop_factory=loop_factory(event_loop)) as runner:
+            return runner.run(func(*args, **kwargs))
 
     return wrapped
 
 
-def default_config() -> Config:
+def default_config() -> "Config":
+    from zfs_feature_discovery.config import Config
+
     return Config()
 
 
-async def load_config(config_path: Path | None) -> Config:
+async def load_config(config_path: Path | None) -> "Config":
     if not config_path:
         return default_config()
 
+    # Only pay for the YAML parser when a config file is actually used
+    import yaml
+
+    from zfs_feature_discovery.config import Config
+
     async with aiofiles.open(config_path) as f:
         content = await f.read()
 
@@ -54,50 +75,169 @@ async def load_config(config_path: Path | None) -> Config:
     return Config.model_validate(data)
 
 
-def settings_source(cls: Type[BaseSettings], **kwargs: Any) -> SettingsSource:
+def settings_source(cls: Type["BaseSettings"], **kwargs: Any) -> "SettingsSource":
+    from zfs_feature_discovery.config import SettingsSource
+
     return SettingsSource(
         cls, env_prefix="ZFS_FEATURE_DISCOVERY_", env_nested_delimiter="_", **kwargs
     )
 
 
+async def refresh_until_stopped(
+    refresh: Coroutine[Any, Any, Any], stop: asyncio.Event, timeout: float
+) -> None:
+    """
+    Run a refresh. Once `stop` is set, give it `timeout` seconds to finish before
+    cancelling it.
+    """
+
+    task = asyncio.create_task(refresh, name="refresh")
+    stopping = asyncio.create_task(stop.wait(), name="stop")
+    try:
+        await asyncio.wait([task, stopping], return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            log.info(f"Stopping, waiting up to {timeout}s for the refresh to finish")
+            await asyncio.wait([task], timeout=timeout)
+    finally:
+        stopping.cancel()
+        if not task.done():
+            log.warning("Cancelling unfinished refresh")
+            task.cancel()
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        # Only the refresh was cancelled, not us
+        if not task.cancelled():
+            raise
+
+
 async def run(
     oneshot: bool = False,
+    force: bool = False,
     sleep_interval: float = 60,
     config_path: Path | None = None,
     log_level: Optional[Literal["ERROR", "WARNING", "INFO", "DEBUG", "TRACE"]] = None,
+    trace_path: Path | None = None,
+    profile: bool = False,
+    profile_cycles: int = 1,
+    profile_dir: Path = Path("/tmp/zfs-feature-discovery"),
+    profile_mode: ProfileMode = "cprofile",
+    event_loop: EventLoopName = "asyncio",
 ) -> None:
     logging.basicConfig(level=log_level or "INFO")
+    log.debug(f"Running on {type(asyncio.get_running_loop())} ({event_loop})")
 
     config = await load_config(config_path=config_path)
     logging.debug(f"Config: {config}")
 
-    async with FeatureManager.from_config(config) as fm:
-        for pool, datasets in config.zpools.items():
-            logging.info(f"Monitoring zpool {pool} with datasets: {datasets}")
-            zpool = ZpoolManager(
-                pool_name=pool,
-                datasets=datasets,
-                zpool_command=config.zpool_command,
-                zfs_command=config.zfs_command,
-            )
-            fm.register_zpool(zpool)
+    async with AsyncExitStack() as stack:
+        if trace_path:
+            # A path of "-" traces to stderr
+            stack.enter_context(tracing.trace_to(trace_path))
+
+        fm = await stack.enter_async_context(FeatureManager.from_config(config))
+
+        profiler = RefreshProfiler(
+            profile_dir, cycles=profile_cycles, mode=profile_mode
+        )
+        if profile:
+            profiler.arm()
 
         if oneshot:
-            await fm.refresh()
+            from zfs_feature_discovery.cache import ResultCache
+
+            await profiler.profile(
+                fm.refresh(cache=ResultCache.from_config(config), force=force)
+            )
         else:
-            while True:
+            lag_monitor = None
+            if config.loop_lag_interval:
+                lag_monitor = LoopLagMonitor(
+                    config.loop_lag_interval, warn_threshold=config.loop_lag_warning
+                )
+                await stack.enter_async_context(lag_monitor)
+
+            if config.api_socket or config.api_port is not None:
+                from zfs_feature_discovery.api import QueryApi
+
+                api = QueryApi(
+                    fm,
+                    socket_path=config.api_socket,
+                    host=config.api_host,
+                    port=config.api_port,
+                    lag_monitor=lag_monitor,
+                )
+                await stack.enter_async_context(api)
+
+            if config.health_interval and "health" in config.zpool_props:
+                from zfs_feature_discovery.health import HealthWatchdog
+
+                watchdog = HealthWatchdog(
+                    fm,
+                    zpool_command=config.zpool_command,
+                    interval=config.health_interval,
+                    host=fm.host,
+                )
+                await stack.enter_async_context(watchdog)
+
+            # Allow profiling a running daemon with `kill -USR1`
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGUSR1, profiler.arm)
+            stack.callback(loop.remove_signal_handler, signal.SIGUSR1)
+
+            # Stop between refreshes, or wind down the current one, when terminated
+            stop = asyncio.Event()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, stop.set)
+                stack.callback(loop.remove_signal_handler, signum)
+
+            from zfs_feature_discovery.state import StateStore
+
+            state = StateStore.from_config(config)
+            if state:
+                fm.restore(await state.load())
+
+            while not stop.is_set():
                 log.info(f"Refreshing features at {time.time()}")
-                wait = asyncio.create_task(asyncio.sleep(sleep_interval))
+                start = loop.time()
 
                 try:
-                    await asyncio.gather(wait, fm.refresh())
+                    await refresh_until_stopped(
+                        profiler.profile(fm.refresh()), stop, config.shutdown_timeout
+                    )
                 except Exception:
                     logging.exception("Failed to refresh features")
 
-                await wait
+                if state:
+                    await state.store(fm.file_states())
+
+                try:
+                    async with asyncio.timeout_at(start + sleep_interval):
+                        await stop.wait()
+                except TimeoutError:
+                    pass
+
+            log.info("Stopped")
+
+
+@cache
+def build_parser() -> "ArgParser[Any]":
+    """
+    Build the argument parser on first use, as argdantic and pydantic-settings
+    dominate the import time of this module
+    """
+
+    from argdantic import ArgParser
+
+    parser: "ArgParser[Any]" = ArgParser()
+    parser.command(sources=[settings_source])(async_cmd(run))
+    return parser
+
 
+def main(args: Optional[Sequence[str]] = None) -> Any:
+    return build_parser()(cast(Any, args))
 
-main.command(sources=[settings_source])(async_cmd(run))
 
 if __name__ == "__main__":
     main()
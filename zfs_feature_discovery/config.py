@@ -8,13 +8,21 @@ from typing import (
     Collection,
     Dict,
     FrozenSet,
+    Literal,
     NewType,
+    Optional,
     Tuple,
     Type,
     cast,
 )
 
-from pydantic import BaseModel, BeforeValidator, Field, field_validator
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    Field,
+    field_validator,
+    model_validator,
+)
 from pydantic.fields import FieldInfo
 from pydantic_settings import (
     BaseSettings,
@@ -22,7 +30,10 @@ from pydantic_settings import (
     PydanticBaseSettingsSource,
     SettingsConfigDict,
 )
-from typing_extensions import get_args, get_origin
+from typing_extensions import Self, get_args, get_origin
+
+from zfs_feature_discovery.derived import ByteUnit
+from zfs_feature_discovery.labels import OverflowMode
 
 ZPOOL_DEFAULT_PROPS = frozenset(
     [
@@ -62,6 +73,21 @@ ZFS_DATASET_DEFAULT_PROPS = frozenset(
 )
 
 
+# As accepted by `zfs get -s`. Properties without a source (such as `type`) are
+# "none".
+PROPERTY_SOURCES = frozenset(
+    ["local", "default", "inherited", "temporary", "received", "none"]
+)
+
+
+def check_sources(value: FrozenSet[str]) -> FrozenSet[str]:
+    unknown = value - PROPERTY_SOURCES
+    if unknown:
+        raise ValueError(f"Unknown property sources: {', '.join(sorted(unknown))}")
+
+    return value
+
+
 def check_absolute(path: Path) -> Path:
     if not path.is_absolute():
         raise ValueError(f"Path must be absolute: {path}")
@@ -153,6 +179,8 @@ class LabelConfig(BaseModel):
         default="zfs.{pool_name}.{dataset_name}.{property_name}"
     )
     global_format: str = Field(default="zfs-global.{property_name}")
+    # How to shorten values over the 63 character limit
+    value_overflow: OverflowMode = "hash"
 
     @field_validator("zpool_format")
     @classmethod
@@ -172,6 +200,27 @@ class LabelConfig(BaseModel):
         return validate_label_format(value, {"property_name"})
 
 
+class DerivedLabel(BaseModel):
+    """
+    Label computed from an already collected numeric property, such as `capacity`
+    bucketed into 10% bands. It is emitted with the same label format as regular
+    properties, using `name` as the property name.
+    """
+
+    name: str = Field(pattern=LABEL_PATH_PATTERN.pattern, min_length=1)
+    property: str
+    unit: ByteUnit = "B"
+    bucket: Optional[float] = Field(default=None, gt=0)
+    min: Optional[float] = None
+
+    @model_validator(mode="after")
+    def validate_expression(self) -> Self:
+        if (self.bucket is None) == (self.min is None):
+            raise ValueError("Exactly one of bucket or min must be set")
+
+        return self
+
+
 class Config(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="ZFS_FEATURE_DISCOVERY_", env_nested_delimiter="_"
@@ -181,15 +230,98 @@ class Config(BaseSettings):
     zpool_command: Path = Path("/usr/sbin/zpool")
     hostid_command: Path = Path("/usr/bin/hostid")
 
+    # Run commands in the host's filesystem, instead of through wrappers that enter
+    # it on every call: chrooted into `host_root`, and/or in the mount namespace at
+    # `host_mount_namespace` (such as `/proc/1/ns/mnt`). Command paths are then
+    # resolved on the host.
+    host_root: Optional[Path] = None
+    host_mount_namespace: Optional[Path] = None
+
     zpools: Dict[str, FrozenSet[str]] = Field(default_factory=dict, min_length=1)
 
     zpool_props: PropsSet = PropsSet(frozenset())
     zfs_dataset_props: PropsSet = PropsSet(frozenset())
 
+    # Only label properties from these sources (all if empty). With
+    # `*_collapse_defaults`, properties at their default value are replaced by a
+    # single `defaults` label with their count.
+    zpool_sources: PropsSet = PropsSet(frozenset())
+    zfs_dataset_sources: PropsSet = PropsSet(frozenset())
+    zpool_collapse_defaults: bool = False
+    zfs_dataset_collapse_defaults: bool = False
+
+    # Dataset labels (property or derived label names) summarized per pool: a single
+    # label with the pool's `_all` dataset holds the value shared by all datasets,
+    # replacing theirs, or "mixed" if they differ.
+    zfs_dataset_grouped_props: PropsSet = PropsSet(frozenset())
+
+    # Output format of `zfs get`/`zpool get`. JSON (OpenZFS 2.3+) handles any value
+    # unambiguously; "auto" uses it when the installed version supports it.
+    output_format: Literal["auto", "text", "json"] = "auto"
+
+    # Only request the properties that are needed from zpool/zfs instead of `all`.
+    # Any unknown property name will make the command fail.
+    property_projection: bool = False
+
+    # Properties that rarely change, fetched by separate commands at startup, every
+    # `static_props_interval` seconds (never if 0), on forced refreshes and when a
+    # pool's health changes. Other refreshes reuse them and only fetch the remaining
+    # properties, which are then requested by name, as with `property_projection`.
+    zpool_static_props: PropsSet = PropsSet(frozenset())
+    zfs_dataset_static_props: PropsSet = PropsSet(frozenset())
+    static_props_interval: float = Field(default=0, ge=0)
+
+    # Render the dataset labels of pools with at least `render_threshold` datasets in
+    # this many worker processes, keeping the event loop responsive. Disabled if 0.
+    render_processes: int = Field(default=0, ge=0)
+    render_threshold: int = Field(default=10000, ge=1)
+
+    # Rows (output lines, properties or labels) parsed or rendered between yields to
+    # the event loop, so long refreshes don't hold up anything else
+    yield_rows: int = Field(default=1000, ge=1)
+
     feature_dir: Path = Path("/etc/kubernetes/node-feature-discovery/features.d/")
 
+    # Seconds until feature files expire, after which NFD ignores them
+    ttl: int = Field(default=3600, ge=1)
+    # Unchanged feature files are only rewritten with a new expiry time once less
+    # than this many seconds are left, half the TTL if unset. Should be well above
+    # the sleep interval, or files can expire between refreshes.
+    ttl_renew_threshold: Optional[float] = Field(default=None, ge=0)
+
     label: LabelConfig = Field(default_factory=LabelConfig)
 
+    zpool_derived_labels: list[DerivedLabel] = Field(default_factory=list)
+    zfs_dataset_derived_labels: list[DerivedLabel] = Field(default_factory=list)
+
+    # Seconds between pool health checks outside of full refreshes, relabeling a
+    # pool as soon as its health changes. Disabled if 0, and in oneshot runs.
+    health_interval: float = Field(default=10, ge=0)
+
+    # Cache of collected results for oneshot runs. Disabled if no path is set.
+    cache_path: Optional[Path] = None
+    cache_max_age: float = Field(default=30, ge=0)
+
+    # Labels and expiry times of the feature files written by the daemon, so that
+    # a replacement daemon doesn't rewrite files that are still current. Disabled
+    # if no path is set.
+    state_path: Optional[Path] = None
+
+    # Seconds to let an in-flight refresh finish when stopping the daemon, before
+    # cancelling it
+    shutdown_timeout: float = Field(default=10, ge=0)
+
+    # Read-only query API serving the latest properties and labels. Disabled unless
+    # a socket path and/or port is set.
+    api_socket: Optional[Path] = None
+    api_host: str = "127.0.0.1"
+    api_port: Optional[int] = Field(default=None, ge=0, le=65535)
+
+    # Measure event loop lag every `loop_lag_interval` seconds (disabled if 0),
+    # exported by the query API, logging lag of at least `loop_lag_warning` seconds
+    loop_lag_interval: float = Field(default=0.25, ge=0)
+    loop_lag_warning: float = Field(default=1.0, gt=0)
+
     @classmethod
     def settings_customise_sources(
         cls,
@@ -220,3 +352,8 @@ class Config(BaseSettings):
     @classmethod
     def validate_zfs_dataset_props(cls, value: FrozenSet[str]) -> FrozenSet[str]:
         return prepare_props_list(ZFS_DATASET_DEFAULT_PROPS, value)
+
+    @field_validator("zpool_sources", "zfs_dataset_sources")
+    @classmethod
+    def validate_sources(cls, value: FrozenSet[str]) -> FrozenSet[str]:
+        return check_sources(value)
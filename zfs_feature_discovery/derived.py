@@ -0,0 +1,57 @@
+import math
+from typing import Literal, Optional
+
+from zfs_feature_discovery.zfs_props import ZfsProperty
+
+ByteUnit = Literal["B", "KiB", "MiB", "GiB", "TiB", "PiB"]
+
+BYTE_UNITS: dict[str, int] = {
+    "B": 1,
+    "KiB": 1024,
+    "MiB": 1024**2,
+    "GiB": 1024**3,
+    "TiB": 1024**4,
+    "PiB": 1024**5,
+}
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+
+def derive_value(
+    prop: Optional[ZfsProperty],
+    *,
+    unit: ByteUnit = "B",
+    bucket: Optional[float] = None,
+    min: Optional[float] = None,
+) -> str:
+    """
+    Compute a coarse label value from a numeric property, so it stays stable while
+    the raw value changes slightly
+
+    - with `bucket`, the lower bound of the band the value falls in: a `capacity`
+      of 37 with a bucket of 10 gives "30"
+    - with `min`, whether the value is at least `min`: "true" or "false"
+
+    The value is first converted to `unit` (for byte sizes). Missing or non-numeric
+    values produce an empty value.
+    """
+
+    if prop is None:
+        return ""
+
+    try:
+        value = float(prop.value) / BYTE_UNITS[unit]
+    except ValueError:
+        return ""
+
+    if not math.isfinite(value):
+        return ""
+
+    if bucket is not None:
+        return _format_number(math.floor(value / bucket) * bucket)
+    if min is not None:
+        return "true" if value >= min else "false"
+
+    return _format_number(value)
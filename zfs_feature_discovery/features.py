@@ -1,62 +1,277 @@
 import asyncio
 import logging
 import os
-import re
+import secrets
+import time
+from collections import defaultdict
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
 from datetime import UTC, datetime, timedelta
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 from typing import (
+    TYPE_CHECKING,
     Any,
     AsyncContextManager,
     AsyncIterable,
     AsyncIterator,
+    Awaitable,
     Iterable,
+    Literal,
     Mapping,
     Optional,
-    cast,
+    Sequence,
+    TypeVar,
 )
 
 import aiofiles
 import aiofiles.os
-from aiofiles.tempfile import NamedTemporaryFile
 
-from zfs_feature_discovery.config import Config
+from zfs_feature_discovery import tracing
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.labels import (
+    LabelDiff,
+    OverflowMode,
+    diff_labels,
+    normalize_labels,
+)
+from zfs_feature_discovery.loops import YIELD_ROWS
+from zfs_feature_discovery.plan import (
+    DerivedRule,
+    LabelTemplate,
+    RuntimePlan,
+    compile_plan,
+    sanitize,
+)
+from zfs_feature_discovery.render import (
+    DatasetItem,
+    DatasetRenderer,
+    RenderPool,
+    derive,
+    group_labels,
+    project_props,
+    select_props,
+)
 from zfs_feature_discovery.zfs_globals import ZfsGlobals, ZfsVersion
-from zfs_feature_discovery.zfs_props import ZfsProperty
+from zfs_feature_discovery.zfs_props import OutputFormat, ZfsProperty
 from zfs_feature_discovery.zpool import ZpoolManager
 
+if TYPE_CHECKING:
+    from zfs_feature_discovery.cache import ResultCache
+    from zfs_feature_discovery.config import Config, DerivedLabel
+
 log = logging.getLogger(__name__)
 
+# Individual label changes logged at INFO per refresh, the rest go to DEBUG
+MAX_LOGGED_CHANGES = 50
+
+# Label lines per write to a feature file
+WRITE_BATCH_LINES = 4096
+
+# Seconds after which temporary feature files are considered left behind by a
+# daemon that was killed, rather than still being written
+STALE_TEMP_AGE = 60
+
+# First line of every feature file, marking it as ours: cleanup never deletes files
+# without it, even if their name has our prefix
+FILE_HEADER = "# Generated by zfs-feature-discovery\n"
+# Bytes read from the start of a file when looking for the header
+HEADER_READ_SIZE = 256
+
+T = TypeVar("T")
+
+
+def legacy_name(name: str) -> str:
+    """
+    The file name a feature file was written under by versions that did not prefix
+    names, and named the global and dataset files after `zfs` instead
+    """
+
+    if name == "global":
+        return "zfs-global"
+    if name.startswith("datasets."):
+        return f"zfs.{name.removeprefix('datasets.')}"
+
+    return name
+
+
 _chmod = aiofiles.os.wrap(os.chmod)
 
 
-def sanitize(name: str) -> str:
-    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+def _create_file(path: str) -> None:
+    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+
+
+_create = aiofiles.os.wrap(_create_file)
+
+
+async def _run_to_end(aw: Awaitable[T]) -> T:
+    """
+    Await a file operation to the end even if cancelled meanwhile. It goes ahead in
+    its thread regardless, so cleaning up before it is done could race with it.
+    The cancellation is raised once it is.
+    """
+
+    task = asyncio.ensure_future(aw)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
+
+
+def property_tiers(
+    props: frozenset[str], static_props: frozenset[str], projection: bool
+) -> tuple[Optional[frozenset[str]], Optional[frozenset[str]]]:
+    """
+    Split the properties to request into the regular and static tiers. Without a
+    static tier, the regular one requests all properties (None) unless projected.
+    """
+
+    static = props & static_props
+    regular = props - static
+    # Tiering needs an explicit list of regular properties, which can't be empty
+    if static and regular:
+        return regular, static
+
+    return (props if projection else None), None
+
+
+def merge_static(
+    static: Mapping[str, ZfsProperty], props: Mapping[str, ZfsProperty]
+) -> Mapping[str, ZfsProperty]:
+    return {**static, **props} if static else props
+
+
+@dataclass
+class RefreshResult:
+    """
+    Everything collected from the system in a single refresh
+    """
+
+    zfs_version: ZfsVersion
+    hostid: Optional[str]
+    # keyed by pool name. None means the zpool command failed
+    zpool_props: dict[str, Optional[Mapping[str, ZfsProperty]]]
+    dataset_props: dict[str, Mapping[str, Mapping[str, ZfsProperty]]]
+    # Pools whose zfs command failed, so their datasets have no properties
+    failed_datasets: frozenset[str] = frozenset()
+
+    @property
+    def complete(self) -> bool:
+        return (
+            self.zfs_version.main is not None
+            and all(props is not None for props in self.zpool_props.values())
+            and not self.failed_datasets
+        )
+
+
+@dataclass
+class FeatureFileState:
+    """
+    The labels last written to a feature file, and its expiry time
+    """
+
+    expiry: datetime
+    labels: dict[str, str]
+
+
+@dataclass
+class RefreshContext:
+    """
+    State shared by the collection and rendering passes of a single refresh, so it
+    is only worked out once per cycle
+    """
+
+    now: datetime
+    expiry: str
+    # Snapshot of the registered pools, which both passes schedule work for
+    zpools: list[ZpoolManager]
+    plan: RuntimePlan
+    # Monotonic time the refresh started at
+    started: float = field(default_factory=time.monotonic)
 
 
 class FeatureManager(AsyncContextManager["FeatureManager"]):
     _zpools: dict[str, ZpoolManager]
     _now: Optional[datetime]
+    _plan: Optional[RuntimePlan]
 
     @classmethod
-    def from_config(cls, config: Config) -> "FeatureManager":
+    def from_config(cls, config: "Config") -> "FeatureManager":
+        host = HostNamespace.from_config(config)
         zfs_globals = ZfsGlobals(
             zfs_command=config.zfs_command,
             hostid_command=config.hostid_command,
+            host=host,
         )
 
-        return cls(
+        fm = cls(
             feature_dir=config.feature_dir,
+            ttl=config.ttl,
+            ttl_renew_threshold=config.ttl_renew_threshold,
             zpool_props=config.zpool_props,
             zfs_dataset_props=config.zfs_dataset_props,
             label_namespace=config.label.namespace,
             zfs_dataset_label_format=config.label.zfs_dataset_format,
             zpool_label_format=config.label.zpool_format,
             global_label_format=config.label.global_format,
+            label_value_overflow=config.label.value_overflow,
             zfs_globals=zfs_globals,
+            zpool_derived_labels=config.zpool_derived_labels,
+            zfs_dataset_derived_labels=config.zfs_dataset_derived_labels,
+            zpool_sources=config.zpool_sources,
+            zfs_dataset_sources=config.zfs_dataset_sources,
+            zpool_collapse_defaults=config.zpool_collapse_defaults,
+            zfs_dataset_collapse_defaults=config.zfs_dataset_collapse_defaults,
+            zfs_dataset_grouped_props=config.zfs_dataset_grouped_props,
+            output_format=config.output_format,
+            static_props_interval=config.static_props_interval,
+            render_pool=RenderPool.from_config(config),
+            yield_rows=config.yield_rows,
+            retain_dataset_props=(
+                config.api_socket is not None or config.api_port is not None
+            ),
+            host=host,
         )
 
+        zpool_props, zpool_static_props = property_tiers(
+            config.zpool_props | {d.property for d in config.zpool_derived_labels},
+            config.zpool_static_props,
+            config.property_projection,
+        )
+        zfs_dataset_props, zfs_dataset_static_props = property_tiers(
+            config.zfs_dataset_props
+            | {d.property for d in config.zfs_dataset_derived_labels},
+            config.zfs_dataset_static_props,
+            config.property_projection,
+        )
+
+        # Defaults are still needed to count them
+        zfs_dataset_sources = set(config.zfs_dataset_sources)
+        if zfs_dataset_sources and config.zfs_dataset_collapse_defaults:
+            zfs_dataset_sources.add("default")
+
+        for pool, datasets in config.zpools.items():
+            log.info(f"Monitoring zpool {pool} with datasets: {datasets}")
+            zpool = ZpoolManager(
+                pool_name=pool,
+                datasets=datasets,
+                zpool_command=config.zpool_command,
+                zfs_command=config.zfs_command,
+                zpool_props=zpool_props,
+                zfs_dataset_props=zfs_dataset_props,
+                zfs_dataset_sources=zfs_dataset_sources,
+                zpool_static_props=zpool_static_props,
+                zfs_dataset_static_props=zfs_dataset_static_props,
+                yield_rows=config.yield_rows,
+                host=host,
+            )
+            fm.register_zpool(zpool)
+
+        return fm
+
     def __init__(
         self,
         *,
@@ -68,8 +283,23 @@ class FeatureManager(AsyncContextManager["FeatureManager"]):
         zfs_dataset_label_format: str,
         global_label_format: str,
         zfs_globals: ZfsGlobals,
+        label_value_overflow: OverflowMode = "hash",
         feature_file_prefix: str = "zfs-",
         ttl: int = 3600,
+        ttl_renew_threshold: Optional[float] = None,
+        zpool_derived_labels: Sequence["DerivedLabel"] = (),
+        zfs_dataset_derived_labels: Sequence["DerivedLabel"] = (),
+        zpool_sources: frozenset[str] = frozenset(),
+        zfs_dataset_sources: frozenset[str] = frozenset(),
+        zpool_collapse_defaults: bool = False,
+        zfs_dataset_collapse_defaults: bool = False,
+        zfs_dataset_grouped_props: frozenset[str] = frozenset(),
+        output_format: Literal["auto", "text", "json"] = "text",
+        static_props_interval: float = 0,
+        render_pool: Optional[RenderPool] = None,
+        yield_rows: int = YIELD_ROWS,
+        retain_dataset_props: bool = True,
+        host: Optional[HostNamespace] = None,
     ) -> None:
         self.feature_dir = feature_dir
         self.feature_file_prefix = feature_file_prefix
@@ -79,14 +309,83 @@ class FeatureManager(AsyncContextManager["FeatureManager"]):
         self.zpool_label_format = zpool_label_format
         self.zfs_dataset_label_format = zfs_dataset_label_format
         self.global_label_format = global_label_format
+        self.label_value_overflow: OverflowMode = label_value_overflow
         self.ttl = ttl
+        # Unchanged feature files are only rewritten, with a new expiry time, once
+        # less than this many seconds are left before they expire
+        self.ttl_renew_threshold = (
+            ttl / 2 if ttl_renew_threshold is None else ttl_renew_threshold
+        )
+        self.zpool_derived_labels = list(zpool_derived_labels)
+        self.zfs_dataset_derived_labels = list(zfs_dataset_derived_labels)
+        self.zpool_sources = zpool_sources
+        self.zfs_dataset_sources = zfs_dataset_sources
+        self.zpool_collapse_defaults = zpool_collapse_defaults
+        self.zfs_dataset_collapse_defaults = zfs_dataset_collapse_defaults
+        self.zfs_dataset_grouped_props = zfs_dataset_grouped_props
+        # Shared by all commands, and closed on exit
+        self.host = host
+        self.static_props_interval = static_props_interval
+        # Shut down on exit
+        self.render_pool = render_pool
+        # Labels rendered between yields to the event loop
+        self.yield_rows = yield_rows
+        # Whether dataset properties are kept in `last_result` for other consumers,
+        # such as the query API. Pool properties always are.
+        self.retain_dataset_props = retain_dataset_props
 
         self._zpools = {}
         self._zfs_globals = zfs_globals
         self._now = None
+        # Per task, so that overlapping refreshes and health updates each keep theirs
+        self._context_var: ContextVar[Optional[RefreshContext]] = ContextVar(
+            "refresh_context", default=None
+        )
+        self._plan = None
+        self.output_format = output_format
+        # Resolved on the first refresh when "auto"
+        self._output_format: Optional[OutputFormat] = (
+            None if output_format == "auto" else output_format
+        )
+
+        # Static tier of tiered pools, by pool name, and when it was last fetched in
+        # full (monotonic). A pool without a time is fetched on the next refresh.
+        self._static_zpool_props: dict[str, Mapping[str, ZfsProperty]] = {}
+        self._static_dataset_props: dict[
+            str, Mapping[str, Mapping[str, ZfsProperty]]
+        ] = {}
+        self._static_collected: dict[str, float] = {}
+
+        # Latest state, for consumers other than NFD
+        self._labels: dict[str, dict[str, str]] = {}
+        # Labels and expiry time of the feature files on disk, which are not
+        # rewritten if their labels did not change and they don't expire soon
+        self._files: dict[str, FeatureFileState] = {}
+        # Temporary files being written, removed on exit if interrupted
+        self._temp_files: set[str] = set()
+        # Held while writing or deleting a feature file, by file name
+        self._file_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._cleanup_lock = asyncio.Lock()
+        # Monotonic time each feature file was last written at, by file name
+        self._written: dict[str, float] = {}
+        self.last_result: Optional[RefreshResult] = None
+        self.generation = 0
+        self._refreshed = asyncio.Condition()
+        self.last_diff: Optional[LabelDiff] = None
+        # Total of labels added, removed or changed by refreshes since startup
+        self.changed_labels_total = 0
+        self.files_written = 0
+        self.files_skipped = 0
+
+    @property
+    def _context(self) -> Optional[RefreshContext]:
+        return self._context_var.get()
 
     @property
     def now(self) -> datetime:
+        ctx = self._context
+        if ctx:
+            return ctx.now
         if self._now is None:
             raise RuntimeError("Reference time not set")
 
@@ -110,8 +409,116 @@ class FeatureManager(AsyncContextManager["FeatureManager"]):
             # Allow nesting
             yield
 
+    @asynccontextmanager
+    async def refresh_context(self) -> AsyncIterator[RefreshContext]:
+        """
+        Set up the shared state for a refresh, used by everything called within it
+        """
+
+        outer = self._context
+        now = outer.now if outer else self._now or datetime.now(tz=UTC)
+        ctx = RefreshContext(
+            now=now,
+            expiry=self.format_expiry(now + timedelta(seconds=self.ttl)),
+            zpools=list(self._zpools.values()),
+            plan=self.plan,
+        )
+
+        token = self._context_var.set(ctx)
+        try:
+            yield ctx
+        finally:
+            self._context_var.reset(token)
+
+    @property
+    def plan(self) -> RuntimePlan:
+        """
+        Label settings and registered pools, compiled on first use. Registering a
+        pool compiles it again; other settings must be changed before that.
+        """
+
+        ctx = self._context
+        if ctx:
+            return ctx.plan
+
+        if self._plan is None:
+            self._plan = compile_plan(
+                namespace=self.label_namespace,
+                zpool_format=self.zpool_label_format,
+                zfs_dataset_format=self.zfs_dataset_label_format,
+                global_format=self.global_label_format,
+                zpool_props=self.zpool_props,
+                zfs_dataset_props=self.zfs_dataset_props,
+                zpool_derived=self.zpool_derived_labels,
+                zfs_dataset_derived=self.zfs_dataset_derived_labels,
+                zfs_dataset_grouped=self.zfs_dataset_grouped_props,
+                pools={
+                    pool_name: zpool.datasets
+                    for pool_name, zpool in self._zpools.items()
+                },
+            )
+
+        return self._plan
+
+    @property
+    def labels(self) -> dict[str, str]:
+        """
+        All the labels from the latest refresh
+        """
+
+        return {k: v for labels in self._labels.values() for k, v in labels.items()}
+
+    async def wait_for_refresh(self, generation: int, timeout: float) -> bool:
+        """
+        Wait until a refresh newer than `generation` completes, or the timeout
+        expires. Returns whether a newer refresh happened.
+        """
+
+        async with self._refreshed:
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._refreshed.wait_for(lambda: self.generation > generation)
+            except TimeoutError:
+                pass
+
+            return self.generation > generation
+
+    async def _notify_refreshed(self, result: Optional[RefreshResult] = None) -> None:
+        """
+        Start a new generation, waking up waiters, after labels or properties
+        changed. `result` replaces the last one if passed, otherwise it was updated
+        in place.
+        """
+
+        async with self._refreshed:
+            if result is not None:
+                self.last_result = result
+            self.generation += 1
+            self._refreshed.notify_all()
+
     def register_zpool(self, zpool: ZpoolManager) -> None:
+        if self._output_format:
+            zpool.set_output_format(self._output_format)
+
         self._zpools[zpool.pool_name] = zpool
+        self._plan = None
+
+    def detect_output_format(self, zfs_version: ZfsVersion) -> None:
+        """
+        Use JSON output on ZFS versions that support it, when set to "auto"
+        """
+
+        if self.output_format != "auto":
+            return
+
+        output_format: OutputFormat = "json" if zfs_version.supports_json else "text"
+        if output_format == self._output_format:
+            return
+
+        log.info(f"Using {output_format} output for ZFS {zfs_version.main}")
+        self._output_format = output_format
+        for zpool in self._zpools.values():
+            zpool.set_output_format(output_format)
 
     def get_expiry(self) -> datetime:
         return self.now + timedelta(seconds=self.ttl)
@@ -119,180 +526,742 @@ class FeatureManager(AsyncContextManager["FeatureManager"]):
     def format_expiry(self, ts: datetime) -> str:
         return ts.isoformat().replace("+00:00", "Z")
 
-    async def write_feature_file(self, name: str, content: AsyncIterable[str]) -> Path:
-        expiry_s = self.format_expiry(self.get_expiry())
+    @property
+    def temp_prefix(self) -> str:
+        # Hidden from NFD, and not matching the prefix of finished files
+        return f".tmp{self.feature_file_prefix}"
 
-        full_name = f"{self.feature_file_prefix}{name}"
-        full_name = name.replace("/", "_")
-        full_path = self.feature_dir / full_name
+    def temp_name(self, directory: Path | str, name: str = "") -> str:
+        return os.path.join(
+            directory, f"{self.temp_prefix}{name}{secrets.token_hex(8)}"
+        )
 
-        header = [
-            "# Generated by zfs-feature-discovery\n",
-            f"# +expiry-time={expiry_s}\n",
-        ]
+    def feature_path(self, name: str) -> Path:
+        full_name = f"{self.feature_file_prefix}{name}".replace("/", "_")
+        return self.feature_dir / full_name
+
+    async def write_feature_file(
+        self,
+        name: str,
+        content: AsyncIterable[str],
+        state: Optional[FeatureFileState] = None,
+    ) -> Path:
+        """
+        Write a feature file atomically. If passed, `state` is recorded as what the
+        file holds once it is written.
+        """
+
+        if self._context:
+            expiry_s = self._context.expiry
+        else:
+            expiry_s = self.format_expiry(self.get_expiry())
+
+        full_path = self.feature_path(name)
+        full_name = full_path.name
+
+        header = [FILE_HEADER, f"# +expiry-time={expiry_s}\n"]
         # Make sure to use a name starting with dot and rename atomically, as documented
         # by node-feature-discovery
-        async with NamedTemporaryFile(
-            dir=full_path.parent,
-            prefix=".tmp",
-            delete=False,
-        ) as tmp_file:
-            tmp_fname = cast(str, tmp_file.name)
+        with tracing.span("write_feature_file", file=full_name):
+            # Named up front, so it is removed even if interrupted while creating it
+            tmp_fname = self.temp_name(full_path.parent)
+            self._temp_files.add(tmp_fname)
             log.debug(f"Temporary feature file {tmp_fname}")
 
+            renamed = False
             try:
-                await tmp_file.write("".join(header).encode())
+                # Only opened once created, so an interrupted open can't create it
+                # again after it was removed
+                await _run_to_end(_create(tmp_fname))
+                async with aiofiles.open(tmp_fname, "r+b") as tmp_file:
+                    await tmp_file.write("".join(header).encode())
 
-                async for chunk in content:
-                    await tmp_file.write(chunk.encode())
-                await tmp_file.flush()
+                    async for chunk in content:
+                        await tmp_file.write(chunk.encode())
+                    await tmp_file.flush()
 
-                await _chmod(tmp_file.name, 0o644)
-                await aiofiles.os.rename(tmp_fname, full_path)
-                log.info(f"Wrote feature file {full_path}")
+                await _chmod(tmp_fname, 0o644)
+                await _run_to_end(aiofiles.os.rename(tmp_fname, full_path))
+                renamed = True
+                self._written[full_name] = time.monotonic()
+                if state:
+                    self._files[name] = state
+                self.files_written += 1
+                log.debug(f"Wrote feature file {full_path}")
             except Exception:
                 log.exception(f"Failed writing feature file {full_path}")
             finally:
-                try:
-                    await aiofiles.os.unlink(tmp_fname)
-                except OSError:
-                    pass
+                # Once renamed, the temporary name may already belong to another
+                # write
+                if not renamed:
+                    # If interrupted while renaming, the file may have been
+                    # replaced anyway, so don't trust what it holds anymore
+                    self._files.pop(name, None)
+                    try:
+                        await aiofiles.os.unlink(tmp_fname)
+                    except OSError:
+                        pass
+                self._temp_files.discard(tmp_fname)
 
         return full_path
 
-    async def write_zpool_features(self, zpool: ZpoolManager) -> Path:
-        # We always write all the features; better an empty value than missing label
-        system_props = await zpool.get_properties() or {}
+    async def write_labels(
+        self, name: str, labels: Mapping[str, str], normalized: bool = False
+    ) -> Path:
+        """
+        Write a feature file with the passed labels, and keep them in memory as the
+        current labels for that file. Keys and values are normalized first, so NFD
+        does not reject the whole file over a single label, unless `normalized`.
+        """
 
-        all_props = {k: system_props.get(k) for k in self.zpool_props}
-        pool_name = sanitize(zpool.pool_name)
+        if not normalized:
+            labels = normalize_labels(labels.items(), self.label_value_overflow)
+        elif not isinstance(labels, dict):
+            labels = dict(labels)
+        self._labels[name] = labels
 
-        async def gen_content() -> AsyncIterable[str]:
-            ns = self.label_namespace
-            for prop_name, prop_value in all_props.items():
-                label = self.zpool_label_format.format(
-                    pool_name=pool_name,
-                    property_name=sanitize(prop_name),
-                )
-                value = prop_value.value if prop_value else ""
+        async def gen() -> AsyncIterable[str]:
+            # Each write goes through a thread, so write many lines at once. Lines
+            # are only formatted as they are written, between writes.
+            items = iter(labels.items())
+            while batch := list(islice(items, WRITE_BATCH_LINES)):
+                yield "".join(f"{key}={value}\n" for key, value in batch)
 
-                yield f"{ns}/{label}={value}\n"
+        path = self.feature_path(name)
+        # Overlapping writes of the same file apply in order, so that what we
+        # record is what it holds
+        async with self._file_locks[path.name]:
+            current = self._files.get(name)
+            if current and await self.is_current(name, current, labels):
+                log.debug(f"Feature file {name} is current, not rewriting it")
+                self.files_skipped += 1
+                return path
 
-        return await self.write_feature_file(f"zpool.{pool_name}", gen_content())
+            state = FeatureFileState(expiry=self.get_expiry(), labels=labels)
+            return await self.write_feature_file(name, gen(), state)
 
-    def gen_zfs_dataset_features(
-        self, zpool: ZpoolManager, dataset: str, props: Mapping[str, ZfsProperty]
-    ) -> Iterable[str]:
+    async def is_current(
+        self, name: str, state: FeatureFileState, labels: Mapping[str, str]
+    ) -> bool:
+        """
+        Whether a feature file already holds these labels, and is not due to expire
+        within `ttl_renew_threshold`
+        """
+
+        if state.labels != labels or state.expiry - self.now < timedelta(
+            seconds=self.ttl_renew_threshold
+        ):
+            return False
+
+        return bool(await aiofiles.os.path.isfile(self.feature_path(name)))
+
+    def restore(self, files: Mapping[str, FeatureFileState]) -> None:
+        """
+        Start from the feature files written by a previous run: labels are compared
+        against theirs, and files that are still current are not rewritten
+        """
+
+        self._files.update(files)
+        for name, state in files.items():
+            self._labels.setdefault(name, state.labels)
+
+    def file_states(self) -> dict[str, FeatureFileState]:
+        """
+        The current labels and expiry time of each feature file written
+        """
+
+        return dict(self._files)
+
+    def derive(self, derived: DerivedRule, props: Mapping[str, ZfsProperty]) -> str:
+        return derive(derived, props)
+
+    @property
+    def dataset_renderer(self) -> DatasetRenderer:
+        plan = self.plan
+        return DatasetRenderer(
+            props=plan.zfs_dataset_props,
+            derived=plan.zfs_dataset_derived,
+            sources=self.zfs_dataset_sources,
+            collapse_defaults=self.zfs_dataset_collapse_defaults,
+            overflow=self.label_value_overflow,
+        )
+
+    def gen_zpool_labels(
+        self, zpool: ZpoolManager, system_props: Optional[Mapping[str, ZfsProperty]]
+    ) -> Iterable[tuple[str, str]]:
         # We always write all the features; better an empty value than missing label
-        system_props = props
-        all_props = {k: system_props.get(k) for k in self.zfs_dataset_props}
+        system_props = system_props or {}
 
-        pool_name = zpool.pool_name
-        dataset_name = dataset.removeprefix(f"{pool_name}/")
-        assert dataset_name != dataset
-
-        pool_name = sanitize(pool_name)
-        dataset_name = sanitize(dataset_name)
-
-        ns = self.label_namespace
-        for prop_name, prop_value in all_props.items():
-            label = self.zfs_dataset_label_format.format(
-                pool_name=pool_name,
-                dataset_name=dataset_name,
-                property_name=sanitize(prop_name),
+        plan = self.plan
+        template = plan.pool(zpool.pool_name).zpool_label
+        for label_name, value in select_props(
+            plan.zpool_props,
+            system_props,
+            self.zpool_sources,
+            self.zpool_collapse_defaults,
+        ):
+            yield template.key(label_name), value
+
+        for derived in plan.zpool_derived:
+            yield template.key(derived.label_name), self.derive(derived, system_props)
+
+    async def write_zpool_features(
+        self, zpool: ZpoolManager, system_props: Optional[Mapping[str, ZfsProperty]]
+    ) -> Path:
+        labels = dict(self.gen_zpool_labels(zpool, system_props))
+        pool_name = self.plan.pool(zpool.pool_name).label_name
+        return await self.write_labels(f"zpool.{pool_name}", labels)
+
+    def gen_zfs_dataset_labels(
+        self, zpool: ZpoolManager, dataset: str, props: Mapping[str, ZfsProperty]
+    ) -> Iterable[tuple[str, str]]:
+        plan = self.plan
+        template = plan.dataset_label(plan.pool(zpool.pool_name), dataset)
+        return self.dataset_renderer.labels(template, props)
+
+    async def write_zpool_dataset_features(
+        self, zpool: ZpoolManager, ds_props: Mapping[str, Mapping[str, ZfsProperty]]
+    ) -> Path:
+        plan = self.plan
+        pool_plan = plan.pool(zpool.pool_name)
+        templates = [plan.dataset_label(pool_plan, ds) for ds in ds_props]
+
+        labels = None
+        if self.render_pool and self.render_pool.wants(len(ds_props)):
+            labels = await self.render_in_pool(
+                zpool, list(zip(templates, ds_props.values()))
             )
-            value = prop_value.value if prop_value else ""
+        if labels is None:
+            labels = await self.render_datasets(zpool, templates, ds_props)
 
-            yield f"{ns}/{label}={value}\n"
+        if plan.zfs_dataset_grouped:
+            group_labels(
+                labels, templates, pool_plan.dataset_summary, plan.zfs_dataset_grouped
+            )
 
-    async def refresh_zpool(self, zpool: ZpoolManager) -> Path:
-        log.info(f"Refreshing features for zpool {zpool.pool_name}")
-        return await self.write_zpool_features(zpool)
+        return await self.write_labels(
+            f"datasets.{pool_plan.label_name}", labels, normalized=True
+        )
 
-    async def refresh_all_zpools(self) -> list[Path]:
-        # make a copy to avoid any concurrency surprises
-        zpools = list(self._zpools.values())
+    async def render_in_pool(
+        self, zpool: ZpoolManager, items: list[DatasetItem]
+    ) -> Optional[dict[str, str]]:
+        """
+        Render normalized dataset labels in the worker processes, or None if they
+        failed
+        """
 
-        feature_files = await asyncio.gather(*(map(self.refresh_zpool, zpools)))
-        return list(feature_files)
+        assert self.render_pool
+        try:
+            with tracing.span(
+                "render_datasets", pool=zpool.pool_name, datasets=len(items)
+            ):
+                return await self.render_pool.render(self.dataset_renderer, items)
+        except Exception:
+            log.exception("Failed to render labels in worker processes")
+            return None
 
-    async def refresh_zpool_datasets(self, zpool: ZpoolManager) -> Path:
-        async def gen() -> AsyncIterable[str]:
-            ds_props = await zpool.dataset_properties()
-            for ds, props in ds_props.items():
-                log.info(f"Refreshing features for dataset {ds}")
-                try:
-                    chunk = "".join(self.gen_zfs_dataset_features(zpool, ds, props))
-                except Exception:
-                    log.exception(f"Failed to refresh features for dataset {ds}")
-                else:
-                    yield chunk
+    async def render_datasets(
+        self,
+        zpool: ZpoolManager,
+        templates: Sequence[LabelTemplate],
+        ds_props: Mapping[str, Mapping[str, ZfsProperty]],
+    ) -> dict[str, str]:
+        """
+        Render normalized dataset labels, normalizing them in chunks and yielding to
+        the event loop in between
+        """
 
-        pool_name = sanitize(zpool.pool_name)
-        return await self.write_feature_file(f"zfs.{pool_name}", gen())
+        renderer = self.dataset_renderer
+        labels: dict[str, str] = {}
+        pending: list[tuple[str, str]] = []
+        for template, (ds, props) in zip(templates, ds_props.items()):
+            log.debug(f"Refreshing features for dataset {ds}")
+            try:
+                with tracing.span("render_dataset", pool=zpool.pool_name, dataset=ds):
+                    ds_labels = list(renderer.labels(template, props))
+            except Exception:
+                log.exception(f"Failed to refresh features for dataset {ds}")
+            else:
+                pending.extend(ds_labels)
 
-    async def refresh_all_zpool_datasets(self) -> list[Path]:
-        # make a copy to avoid any concurrency surprises
-        zpools = list(self._zpools.values())
+            if len(pending) >= self.yield_rows:
+                labels.update(normalize_labels(pending, self.label_value_overflow))
+                pending.clear()
+                await asyncio.sleep(0)
 
-        paths = await asyncio.gather(*(map(self.refresh_zpool_datasets, zpools)))
-        return paths
+        labels.update(normalize_labels(pending, self.label_value_overflow))
+        return labels
 
-    async def write_global_features(
+    def gen_global_labels(
         self, zfs_version: ZfsVersion, hostid: Optional[str]
-    ) -> Path:
+    ) -> Iterable[tuple[str, str]]:
         props = {
             "ver": zfs_version.main or "",
             "kver": zfs_version.kernel or "",
             "hostid": hostid or "",
         }
 
-        async def gen() -> AsyncIterable[str]:
-            ns = self.label_namespace
-            for prop_name, prop_value in props.items():
-                label = self.global_label_format.format(
-                    property_name=sanitize(prop_name),
-                )
-                prop_value = sanitize(prop_value)
+        template = self.plan.global_label
+        for prop_name, prop_value in props.items():
+            yield template.key(prop_name), sanitize(prop_value)
+
+    async def write_global_features(
+        self, zfs_version: ZfsVersion, hostid: Optional[str]
+    ) -> Path:
+        labels = dict(self.gen_global_labels(zfs_version, hostid))
+        return await self.write_labels("global", labels)
+
+    async def is_owned(self, path: str) -> bool:
+        """
+        Whether a file was written by us, rather than by another NFD source
+        """
+
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                head = await f.read(HEADER_READ_SIZE)
+        except FileNotFoundError:
+            return False
+
+        return FILE_HEADER.encode() in head
+
+    async def remove_owned(self, path: str) -> bool:
+        """
+        Delete a feature file if it is ours. Returns whether it was deleted.
+
+        The file is first moved out of the way under a temporary name, and checked
+        again from there, so a file that someone else put in its place after the
+        first check is never deleted, but restored.
+        """
+
+        if not await self.is_owned(path):
+            return False
+
+        claimed = self.temp_name(os.path.dirname(path), f"{os.path.basename(path)}.")
+        self._temp_files.add(claimed)
+        try:
+            try:
+                await _run_to_end(aiofiles.os.rename(path, claimed))
+            except FileNotFoundError:
+                return False
 
-                yield f"{ns}/{label}={prop_value}\n"
+            if await self.is_owned(claimed):
+                log.debug(f"Deleting {path}")
+                return True
 
-        return await self.write_feature_file("zfs-global", gen())
+            log.debug(f"Not deleting {path}, replaced by another writer")
+            try:
+                await _run_to_end(aiofiles.os.link(claimed, path))
+            except FileExistsError:
+                # Replaced yet again, by a newer version
+                pass
+            return False
+        finally:
+            try:
+                await aiofiles.os.unlink(claimed)
+            except FileNotFoundError:
+                pass
+            self._temp_files.discard(claimed)
 
-    async def cleanup(self, keep: list[Path]) -> None:
+    async def cleanup(self, keep: list[Path], since: Optional[float] = None) -> None:
+        """
+        Delete the feature files we wrote before but are not in `keep` anymore,
+        unless written after `since` (monotonic) by an overlapping refresh. Files
+        are only deleted if they are ours, going by their header, so other NFD
+        sources can share our prefix. Files from versions that did not prefix their
+        names are deleted too.
+        """
+
+        since = time.monotonic() if since is None else since
         keep_names = frozenset(path.name for path in keep)
-        for entry in await aiofiles.os.scandir(self.feature_dir):
-            if not entry.is_file():
-                continue
+        prefix = self.feature_file_prefix
+        legacy_names = (
+            frozenset(
+                legacy_name(name.removeprefix(prefix)) for name in keep_names if prefix
+            )
+            - keep_names
+        )
+
+        def written_since(file_name: str) -> bool:
+            return self._written.get(file_name, since - 1) >= since
 
-            if not entry.name.startswith(self.feature_file_prefix):
-                continue
+        async with self._cleanup_lock:
+            # Forget files no longer written, such as ones restored from a previous
+            # run
+            for name in list(self._files):
+                file_name = self.feature_path(name).name
+                if file_name not in keep_names and not written_since(file_name):
+                    del self._files[name]
+                    self._labels.pop(name, None)
 
-            if entry.name in keep_names:
-                continue
+            stale_before = time.time() - STALE_TEMP_AGE
+            for entry in await aiofiles.os.scandir(self.feature_dir):
+                if not entry.is_file():
+                    continue
 
-            log.debug(f"Deleting {entry.path}")
-            await aiofiles.os.unlink(entry)
+                if entry.name.startswith(self.temp_prefix):
+                    # Left behind by a daemon that was killed while writing
+                    if entry.path not in self._temp_files:
+                        try:
+                            if entry.stat().st_mtime < stale_before:
+                                log.info(f"Deleting stale temporary file {entry.path}")
+                                await aiofiles.os.unlink(entry)
+                        except FileNotFoundError:
+                            pass
+                    continue
+
+                if entry.name in legacy_names:
+                    if await self.remove_owned(entry.path):
+                        log.info(f"Deleted unprefixed feature file {entry.path}")
+                    continue
+
+                if not entry.name.startswith(prefix) or entry.name in keep_names:
+                    continue
+
+                async with self._file_locks[entry.name]:
+                    if not written_since(entry.name):
+                        await self.remove_owned(entry.path)
+
+    def invalidate_static(self, pool_name: Optional[str] = None) -> None:
+        """
+        Fetch the static tier of a pool, or of all pools, on the next refresh
+        """
+
+        if pool_name is None:
+            self._static_collected.clear()
+        else:
+            self._static_collected.pop(pool_name, None)
 
-    async def refresh(self) -> None:
-        async with self.with_reference_time():
-            zfs_version, hostid = await asyncio.gather(
-                self._zfs_globals.zfs_version(),
-                self._zfs_globals.hostid(),
+    def static_due(self, zpool: ZpoolManager, now: float) -> bool:
+        if not zpool.tiered:
+            return False
+
+        collected = self._static_collected.get(zpool.pool_name)
+        if collected is None:
+            return True
+
+        interval = self.static_props_interval
+        return bool(interval) and now - collected >= interval
+
+    async def collect_static(self, zpool: ZpoolManager, now: float) -> None:
+        """
+        Fetch the static tier of a pool, keeping the previous values of anything
+        that failed until the next attempt
+        """
+
+        pool_name = zpool.pool_name
+        zpool_props, dataset_props = await asyncio.gather(
+            zpool.get_properties(static=True),
+            zpool.get_dataset_properties(static=True),
+        )
+
+        complete = True
+        if zpool_props is not None:
+            self._static_zpool_props[pool_name] = zpool_props
+        else:
+            complete = False
+
+        # Going by whether the command failed: datasets without static properties
+        # from the requested sources are simply left out of its output
+        if dataset_props is not None:
+            self._static_dataset_props[pool_name] = dataset_props
+        else:
+            complete = False
+
+        if complete:
+            self._static_collected[pool_name] = now
+        else:
+            log.warning(
+                f"Failed to fetch static properties for zpool {pool_name}, "
+                "retrying on the next refresh"
             )
 
-            globals_path = await self.write_global_features(zfs_version, hostid)
-            # We still run the zpool and dataset search, since they can handle failures,
-            # and they will properly generaty empty labels for all expected properties
-            results = await asyncio.gather(
-                self.refresh_all_zpools(), self.refresh_all_zpool_datasets()
+    def merge_static_zpool(
+        self, zpool: ZpoolManager, props: Optional[Mapping[str, ZfsProperty]]
+    ) -> Optional[Mapping[str, ZfsProperty]]:
+        if props is None or not zpool.zpool_tiered:
+            return props
+
+        return merge_static(self._static_zpool_props.get(zpool.pool_name, {}), props)
+
+    def merge_static_datasets(
+        self, zpool: ZpoolManager, ds_props: Mapping[str, Mapping[str, ZfsProperty]]
+    ) -> Mapping[str, Mapping[str, ZfsProperty]]:
+        if not zpool.datasets_tiered:
+            return ds_props
+
+        static = self._static_dataset_props.get(zpool.pool_name, {})
+        return {
+            ds: merge_static(static.get(ds, {}), ds_props.get(ds, {}))
+            for ds in ds_props.keys() | static.keys()
+        }
+
+    async def collect(self, ctx: Optional[RefreshContext] = None) -> RefreshResult:
+        """
+        Run all the commands for globals, zpools and datasets, without writing any
+        feature files. The static tier of tiered pools is only fetched when due.
+        """
+
+        # make a copy to avoid any concurrency surprises
+        zpools = ctx.zpools if ctx else list(self._zpools.values())
+        now = time.monotonic()
+        static_due = [zpool for zpool in zpools if self.static_due(zpool, now)]
+
+        version = asyncio.create_task(self._zfs_globals.zfs_version(), name="version")
+        if self._output_format is None:
+            # Commands depend on the version on the first refresh, after that any
+            # upgrade is picked up on the next one
+            self.detect_output_format(await version)
+
+        with tracing.span("collect"):
+            # Named tasks make profiles easier to follow
+            zfs_version, hostid, zpool_props, dataset_props, _ = await asyncio.gather(
+                version,
+                asyncio.create_task(self._zfs_globals.hostid(), name="hostid"),
+                asyncio.gather(
+                    *(
+                        asyncio.create_task(
+                            zpool.get_properties(), name=f"zpool {zpool.pool_name}"
+                        )
+                        for zpool in zpools
+                    )
+                ),
+                asyncio.gather(
+                    *(
+                        asyncio.create_task(
+                            zpool.get_dataset_properties(),
+                            name=f"datasets {zpool.pool_name}",
+                        )
+                        for zpool in zpools
+                    )
+                ),
+                asyncio.gather(
+                    *(
+                        asyncio.create_task(
+                            self.collect_static(zpool, now),
+                            name=f"static {zpool.pool_name}",
+                        )
+                        for zpool in static_due
+                    )
+                ),
             )
-            paths = [globals_path] + list(chain(*results))
 
-            await self.cleanup(keep=paths)
+        self.detect_output_format(zfs_version)
+
+        # We still label the datasets of pools whose zfs command failed, with no
+        # properties, but the result is incomplete
+        failed_datasets = frozenset(
+            zpool.pool_name
+            for zpool, props in zip(zpools, dataset_props)
+            if props is None
+        )
+
+        return RefreshResult(
+            zfs_version=zfs_version,
+            hostid=hostid,
+            zpool_props={
+                zpool.pool_name: self.merge_static_zpool(zpool, props)
+                for zpool, props in zip(zpools, zpool_props)
+            },
+            dataset_props={
+                zpool.pool_name: self.merge_static_datasets(
+                    zpool,
+                    props
+                    if props is not None
+                    else {ds: {} for ds in zpool.full_datasets},
+                )
+                for zpool, props in zip(zpools, dataset_props)
+            },
+            failed_datasets=failed_datasets,
+        )
+
+    async def write_result(
+        self, result: RefreshResult, ctx: Optional[RefreshContext] = None
+    ) -> list[Path]:
+        zpools = ctx.zpools if ctx else list(self._zpools.values())
+
+        globals_path = await self.write_global_features(
+            result.zfs_version, result.hostid
+        )
+        # We still write the zpool and dataset files if collection failed, so they
+        # will properly generate empty labels for all expected properties
+        paths = await asyncio.gather(
+            *(
+                self.write_zpool_features(
+                    zpool, result.zpool_props.get(zpool.pool_name)
+                )
+                for zpool in zpools
+            ),
+            *(
+                self.write_zpool_dataset_features(
+                    zpool, result.dataset_props.get(zpool.pool_name, {})
+                )
+                for zpool in zpools
+            ),
+        )
+
+        return [globals_path, *paths]
+
+    def retained_result(self, result: RefreshResult) -> RefreshResult:
+        """
+        The part of a refresh result kept in memory until the next refresh: only the
+        properties labels are rendered from, as `zfs get all` returns far more, and
+        dataset properties only if `retain_dataset_props`
+        """
+
+        plan = self.plan
+        zpool_used = [name for name, _ in plan.zpool_props] + [
+            d.property for d in plan.zpool_derived
+        ]
+        dataset_used = self.dataset_renderer.used_props
+
+        return replace(
+            result,
+            zpool_props={
+                pool: None if props is None else project_props(props, zpool_used)
+                for pool, props in result.zpool_props.items()
+            },
+            dataset_props={
+                pool: {
+                    ds: project_props(props, dataset_used)
+                    for ds, props in ds_props.items()
+                }
+                for pool, ds_props in result.dataset_props.items()
+            }
+            if self.retain_dataset_props
+            else {},
+        )
+
+    def record_changes(
+        self, old: Mapping[str, str], new: Mapping[str, str]
+    ) -> LabelDiff:
+        """
+        Compare the labels before and after a refresh, logging only what changed
+        """
+
+        diff = diff_labels(old, new)
+        self.last_diff = diff
+
+        if self.last_result is None and not old:
+            log.info(f"Wrote initial {len(new)} labels")
+            return diff
+
+        if not diff:
+            log.debug("No label changes")
+            return diff
+
+        self.changed_labels_total += len(diff)
+        log.info(
+            f"Labels changed: {len(diff.added)} added, {len(diff.removed)} removed, "
+            f"{len(diff.changed)} changed"
+        )
+        for i, line in enumerate(diff.describe()):
+            level = logging.INFO if i < MAX_LOGGED_CHANGES else logging.DEBUG
+            log.log(level, line)
+
+        if len(diff) > MAX_LOGGED_CHANGES:
+            log.info(f"{len(diff) - MAX_LOGGED_CHANGES} more changes logged at DEBUG")
+
+        return diff
+
+    async def refresh(
+        self, cache: Optional["ResultCache"] = None, force: bool = False
+    ) -> None:
+        """
+        Collect all properties and write the feature files. If a cache is passed,
+        a fresh enough result from it is used instead of running any commands,
+        unless `force` is set.
+        """
+
+        if force:
+            self.invalidate_static()
+
+        async with self.refresh_context() as ctx:
+            with tracing.span("refresh") as span:
+                result = await cache.load() if cache and not force else None
+                if result is None:
+                    result = await self.collect(ctx)
+                    if cache and result.complete:
+                        await cache.store(result)
+                else:
+                    log.info("Using cached results, skipping commands")
+                    span.set(cached=True)
+
+                previous = self.labels
+                paths = await self.write_result(result, ctx)
+                await self.cleanup(keep=paths, since=ctx.started)
+
+                diff = self.record_changes(previous, self.labels)
+                span.set(
+                    labels_added=len(diff.added),
+                    labels_removed=len(diff.removed),
+                    labels_changed=len(diff.changed),
+                )
+
+                retained = self.retained_result(result)
+
+            await self._notify_refreshed(retained)
+
+    async def update_zpool_health(self, pool_name: str, health: str) -> bool:
+        """
+        Rewrite a single pool's feature file if its health changed since the last
+        refresh, without collecting anything else. Returns whether it was rewritten.
+        """
+
+        zpool = self._zpools.get(pool_name)
+        result = self.last_result
+        if zpool is None or result is None or "health" not in self.zpool_props:
+            return False
+
+        props = result.zpool_props.get(pool_name)
+        if props is None:
+            # The full refresh failed for this pool, leave it to the next one
+            return False
+
+        current = props.get("health")
+        if current is not None and current.value == health:
+            return False
+
+        log.info(
+            f"Health of zpool {pool_name} changed: "
+            f"{current.value if current else None} -> {health}"
+        )
+        props = {**props, "health": ZfsProperty(pool_name, "health", health, None)}
+        result.zpool_props[pool_name] = props
+        # Pool changes such as imports and upgrades show up as health changes
+        self.invalidate_static(pool_name)
+
+        async with self.refresh_context():
+            with tracing.span("update_health", pool=pool_name):
+                previous = self.labels
+                await self.write_zpool_features(zpool, props)
+                self.record_changes(previous, self.labels)
+
+        # So API clients see the new health right away, and long-polls wake up
+        await self._notify_refreshed()
+        return True
 
     async def __aenter__(self) -> "FeatureManager":
         return self
 
+    async def remove_temp_files(self) -> None:
+        """
+        Remove the temporary files of writes that were interrupted
+        """
+
+        for tmp_fname in list(self._temp_files):
+            try:
+                await aiofiles.os.unlink(tmp_fname)
+                log.info(f"Deleted temporary file {tmp_fname}")
+            except FileNotFoundError:
+                pass
+            self._temp_files.discard(tmp_fname)
+
     async def __aexit__(self, *_: Any) -> bool:
+        await self.remove_temp_files()
+        if self.host:
+            await self.host.close()
+        if self.render_pool:
+            await asyncio.to_thread(self.render_pool.close)
+
         return False
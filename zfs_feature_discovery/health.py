@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import Any, Optional
+
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+log = logging.getLogger(__name__)
+
+
+def parse_health(output: str) -> dict[str, str]:
+    """
+    Parse the output of `zpool list -H -o name,health` into health by pool name
+    """
+
+    health = {}
+    for line in output.splitlines():
+        try:
+            name, value = line.split("\t")
+        except ValueError:
+            log.warning(f"Failed to parse zpool list line, ignoring: {line}")
+            continue
+
+        health[name] = value
+
+    return health
+
+
+class HealthWatchdog:
+    """
+    Polls the health of all pools with a single cheap `zpool list`, between full
+    refreshes. When a pool's health differs from its current label, only that pool's
+    feature file is rewritten.
+
+    Health is compared against the latest labeled value rather than the previous
+    poll, so a full refresh that overwrites it with older data is corrected on the
+    next poll.
+    """
+
+    def __init__(
+        self,
+        fm: FeatureManager,
+        *,
+        zpool_command: Path,
+        interval: float,
+        host: Optional[HostNamespace] = None,
+    ) -> None:
+        self.fm = fm
+        self.interval = interval
+        self.updates = 0
+
+        self._cmd = CommandHarness(
+            str(zpool_command), "list", "-H", "-o", "name,health", host=host
+        )
+        self._task: Optional[asyncio.Task[None]] = None
+
+    async def poll(self) -> int:
+        """
+        Check the health of all pools once, returning how many were relabeled
+        """
+
+        try:
+            output = await self._cmd.check_output()
+        except (OSError, CalledProcessError):
+            log.warning("Failed to check zpool health")
+            return 0
+
+        updated = 0
+        for pool_name, health in parse_health(output).items():
+            if await self.fm.update_zpool_health(pool_name, health):
+                updated += 1
+
+        self.updates += updated
+        return updated
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                log.exception("Failed to update zpool health")
+
+    async def __aenter__(self) -> "HealthWatchdog":
+        log.info(f"Watching zpool health every {self.interval}s")
+        self._task = asyncio.create_task(self.run(), name="health watchdog")
+        return self
+
+    async def __aexit__(self, *_: Any) -> bool:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        return False
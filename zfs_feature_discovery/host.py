@@ -0,0 +1,296 @@
+"""
+Running commands on the host from inside a container, without a wrapper binary
+entering the host filesystem on every call
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, Sequence
+
+if TYPE_CHECKING:
+    from zfs_feature_discovery.config import Config
+
+log = logging.getLogger(__name__)
+
+# How long to wait for the helper to enter the host, or to exit once closed
+HELPER_TIMEOUT = 10.0
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class HostProcess:
+    """
+    Stand-in for `asyncio.subprocess.Process` for a command spawned by the helper.
+    The helper reaps it and reports its exit code.
+    """
+
+    def __init__(
+        self,
+        pid: int,
+        stdout: asyncio.StreamReader,
+        stderr: asyncio.StreamReader,
+        exited: "asyncio.Future[int]",
+    ) -> None:
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self._exited = exited
+
+    @property
+    def returncode(self) -> Optional[int]:
+        if self._exited.done() and not self._exited.exception():
+            return self._exited.result()
+
+        return None
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def kill(self) -> None:
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+def _kill(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def _pipe_reader(fd: int) -> asyncio.StreamReader:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader, loop=loop),
+        os.fdopen(fd, "rb", buffering=0),
+    )
+    return reader
+
+
+class HostNamespace:
+    """
+    Host filesystem that commands are run in, entered once by a long-lived helper
+    process (`zfs_feature_discovery.host_helper`) that spawns every command.
+
+    `mount_namespace` is a mount namespace file such as `/proc/1/ns/mnt` (which
+    needs the host PID namespace), joined with `setns`. `root` is a directory
+    holding the host's root filesystem, such as a `hostPath` mount of `/`, that
+    commands are chrooted into. If both are set, `root` is resolved inside the mount
+    namespace. Command paths are resolved on the host.
+
+    The helper is small, so spawning from it is cheaper than having the daemon
+    fork itself to enter the host in each child. It is started on first use.
+    """
+
+    def __init__(
+        self,
+        *,
+        root: Optional[Path] = None,
+        mount_namespace: Optional[Path] = None,
+    ) -> None:
+        if root is None and mount_namespace is None:
+            raise ValueError("One of root or mount_namespace must be set")
+
+        self.root = root
+        self.mount_namespace = mount_namespace
+
+        self._helper: Optional[asyncio.subprocess.Process] = None
+        self._sock: Optional[socket.socket] = None
+        self._reader_task: Optional[asyncio.Task[None]] = None
+        self._start_lock = asyncio.Lock()
+        self._next_id = 0
+        # PID and exit code futures, keyed by request ID, then by PID once spawned
+        self._spawning: dict[int, asyncio.Future[tuple[int, asyncio.Future[int]]]] = {}
+        self._running: dict[int, asyncio.Future[int]] = {}
+
+    @classmethod
+    def from_config(cls, config: "Config") -> Optional["HostNamespace"]:
+        if config.host_root is None and config.host_mount_namespace is None:
+            return None
+
+        return cls(root=config.host_root, mount_namespace=config.host_mount_namespace)
+
+    @property
+    def running(self) -> bool:
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def _recv(self) -> dict[str, Any]:
+        assert self._sock
+        message = await asyncio.get_running_loop().sock_recv(
+            self._sock, MAX_MESSAGE_SIZE
+        )
+        if not message:
+            raise ConnectionResetError("Host helper exited")
+
+        return dict(json.loads(message))
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            if self.running:
+                return
+            if self._helper:
+                log.warning("Host helper exited, restarting it")
+                await self.close()
+
+            parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            args = ["--socket-fd", str(child.fileno())]
+            if self.root:
+                args += ["--root", str(self.root)]
+            if self.mount_namespace:
+                args += ["--mount-namespace", str(self.mount_namespace)]
+
+            try:
+                self._helper = await asyncio.create_subprocess_exec(
+                    sys.executable,
+                    "-m",
+                    "zfs_feature_discovery.host_helper",
+                    *args,
+                    pass_fds=[child.fileno()],
+                )
+            finally:
+                child.close()
+
+            parent.setblocking(False)
+            self._sock = parent
+            try:
+                async with asyncio.timeout(HELPER_TIMEOUT):
+                    ready = await self._recv()
+            except (OSError, TimeoutError, ValueError) as e:
+                await self.close()
+                raise OSError(f"Failed to start host helper: {e}") from e
+
+            if not ready.get("ready"):
+                await self.close()
+                raise OSError(
+                    ready.get("errno") or 0,
+                    f"Failed to enter host: {ready.get('error')}",
+                )
+
+            log.info(
+                f"Running commands in host namespace {self.mount_namespace or '-'}, "
+                f"root {self.root or '-'}, through helper {self._helper.pid}"
+            )
+            self._reader_task = asyncio.create_task(
+                self._read_replies(), name="host helper"
+            )
+
+    async def _read_replies(self) -> None:
+        try:
+            while True:
+                reply = await self._recv()
+                if "exit_code" in reply:
+                    exited = self._running.pop(reply["pid"], None)
+                    if exited and not exited.done():
+                        exited.set_result(reply["exit_code"])
+                    continue
+
+                spawned = self._spawning.pop(reply["id"], None)
+                if "pid" not in reply:
+                    if spawned and not spawned.done():
+                        spawned.set_exception(OSError(reply["errno"], reply["error"]))
+                elif spawned is None or spawned.done():
+                    # Cancelled while it was being spawned, so nothing owns it
+                    _kill(reply["pid"])
+                else:
+                    # Registered before its exit code can be received
+                    exited = asyncio.get_running_loop().create_future()
+                    self._running[reply["pid"]] = exited
+                    spawned.set_result((reply["pid"], exited))
+        except (OSError, ValueError, KeyError) as e:
+            log.error(f"Lost connection to host helper: {e}")
+        finally:
+            for spawned in self._spawning.values():
+                if not spawned.done():
+                    spawned.set_exception(ConnectionResetError("Host helper exited"))
+
+            # Nothing can reap them or report their exit codes anymore
+            for pid, exited in self._running.items():
+                _kill(pid)
+                if not exited.done():
+                    exited.set_result(-signal.SIGKILL)
+
+            self._spawning.clear()
+            self._running.clear()
+
+    async def spawn(self, cmd: Sequence[str]) -> HostProcess:
+        """
+        Spawn a command on the host, with its stdout and stderr piped
+        """
+
+        await self.start()
+        assert self._sock
+
+        request_id = self._next_id
+        self._next_id += 1
+        spawned = asyncio.get_running_loop().create_future()
+        self._spawning[request_id] = spawned
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            request = json.dumps({"id": request_id, "argv": list(cmd)}).encode()
+            socket.send_fds(self._sock, [request], [stdout_w, stderr_w])
+        except OSError:
+            self._spawning.pop(request_id, None)
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        try:
+            pid, exited = await spawned
+        except BaseException:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+
+        return HostProcess(
+            pid,
+            stdout=await _pipe_reader(stdout_r),
+            stderr=await _pipe_reader(stderr_r),
+            exited=exited,
+        )
+
+    async def close(self) -> None:
+        """
+        Stop the helper. Commands still running are killed.
+        """
+
+        if self._sock:
+            # The helper exits once the socket is closed
+            self._sock.close()
+            self._sock = None
+
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+        if self._helper:
+            try:
+                async with asyncio.timeout(HELPER_TIMEOUT):
+                    await self._helper.wait()
+            except TimeoutError:
+                log.warning(f"Host helper {self._helper.pid} did not exit, killing")
+                self._helper.kill()
+                await self._helper.wait()
+            self._helper = None
+
+    async def __aenter__(self) -> "HostNamespace":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_: Any) -> bool:
+        await self.close()
+        return False
@@ -0,0 +1,127 @@
+"""
+Helper process spawning commands in the host's filesystem on behalf of the daemon.
+See `zfs_feature_discovery.host.HostNamespace`.
+
+It enters the host once at startup, then reads requests from the socket passed as
+`--socket-fd`, one per datagram: a JSON object `{"id": ..., "argv": [...]}`, with
+the write ends of the stdout and stderr pipes attached. It replies with
+`{"id": ..., "pid": ...}` or `{"id": ..., "errno": ..., "error": ...}`, and once a
+command exits, with `{"pid": ..., "exit_code": ...}`. It exits when the socket is
+closed.
+
+Everything it uses is imported before entering the host, where the container's
+Python installation is no longer reachable.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+from typing import Any, Optional, Sequence
+
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+def enter(root: Optional[str], mount_namespace: Optional[str]) -> None:
+    # Joining a mount namespace requires not sharing the filesystem with other
+    # threads, so this must happen before any is started
+    if mount_namespace:
+        fd = os.open(mount_namespace, os.O_RDONLY)
+        try:
+            os.setns(fd, os.CLONE_NEWNS)
+        finally:
+            os.close(fd)
+    if root:
+        os.chroot(root)
+
+    os.chdir("/")
+
+
+class Helper:
+    def __init__(self, sock: socket.socket, stdin: int) -> None:
+        self.sock = sock
+        self.stdin = stdin
+        self._send_lock = threading.Lock()
+
+    def send(self, **message: Any) -> None:
+        with self._send_lock:
+            self.sock.send(json.dumps(message).encode())
+
+    def wait_child(self, pid: int) -> None:
+        _, status = os.waitpid(pid, 0)
+        try:
+            self.send(pid=pid, exit_code=os.waitstatus_to_exitcode(status))
+        except OSError:
+            # The daemon is gone
+            pass
+
+    def spawn(self, request_id: int, argv: list[str], fds: list[int]) -> None:
+        stdout, stderr = fds
+        try:
+            # In its own session, so anything it spawns can be killed with it
+            pid = os.posix_spawnp(
+                argv[0],
+                argv,
+                os.environ,
+                file_actions=[
+                    (os.POSIX_SPAWN_DUP2, self.stdin, 0),
+                    (os.POSIX_SPAWN_DUP2, stdout, 1),
+                    (os.POSIX_SPAWN_DUP2, stderr, 2),
+                ],
+                setsid=True,
+            )
+        except OSError as e:
+            self.send(id=request_id, errno=e.errno, error=e.strerror)
+            return
+
+        self.send(id=request_id, pid=pid)
+        threading.Thread(target=self.wait_child, args=(pid,), daemon=True).start()
+
+    def serve(self) -> None:
+        while True:
+            message, fds, _, _ = socket.recv_fds(
+                self.sock, MAX_MESSAGE_SIZE, 2, socket.MSG_CMSG_CLOEXEC
+            )
+            if not message:
+                return
+
+            try:
+                request = json.loads(message)
+                if len(fds) != 2:
+                    raise ValueError(f"Expected 2 descriptors, got {len(fds)}")
+                self.spawn(request["id"], request["argv"], fds)
+            except (ValueError, KeyError) as e:
+                print(f"Invalid request: {e}", file=sys.stderr)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--socket-fd", type=int, required=True)
+    parser.add_argument("--root")
+    parser.add_argument("--mount-namespace")
+    opts = parser.parse_args(args)
+
+    sock = socket.socket(fileno=opts.socket_fd)
+    # Commands holding on to it would keep the daemon from noticing the helper exit
+    sock.set_inheritable(False)
+    stdin = os.open(os.devnull, os.O_RDONLY)
+    helper = Helper(sock, stdin)
+
+    try:
+        enter(opts.root, opts.mount_namespace)
+    except OSError as e:
+        helper.send(ready=False, errno=e.errno, error=str(e))
+        return 1
+
+    helper.send(ready=True)
+    helper.serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
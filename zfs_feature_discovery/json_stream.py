@@ -0,0 +1,119 @@
+"""
+Incremental parsing of large JSON documents from command output
+"""
+
+import json
+import re
+from typing import Any, AsyncIterator
+
+_NON_WHITESPACE = re.compile(r"[^ \t\n\r]")
+_decoder = json.JSONDecoder()
+
+
+class JsonObjectStream:
+    """
+    Parses a JSON object from a stream of text chunks, yielding the members of one
+    of its child objects one at a time, such as each dataset in the output of
+    `zfs get -j`. Only the member being parsed is kept in memory.
+
+    Members are decoded with the standard `json` module: an incomplete member is
+    decoded again once the next chunk arrives.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str]) -> None:
+        self._chunks = chunks
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    async def _fill(self) -> bool:
+        if self._eof:
+            return False
+
+        try:
+            chunk = await anext(self._chunks)
+        except StopAsyncIteration:
+            self._eof = True
+            return False
+
+        self._buf = self._buf[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    async def _peek(self) -> str:
+        """
+        Skip whitespace and return the next character, without consuming it
+        """
+
+        while True:
+            if match := _NON_WHITESPACE.search(self._buf, self._pos):
+                self._pos = match.start()
+                return self._buf[self._pos]
+
+            self._pos = len(self._buf)
+            if not await self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    async def _expect(self, chars: str) -> str:
+        char = await self._peek()
+        if char not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} in JSON document, got {char!r}"
+            )
+
+        self._pos += 1
+        return char
+
+    async def _value(self) -> Any:
+        await self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not await self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer might continue in the next chunk
+            if end == len(self._buf) and isinstance(value, (int, float)):
+                if await self._fill():
+                    continue
+
+            self._pos = end
+            return value
+
+    async def _members(self) -> AsyncIterator[tuple[str, Any]]:
+        await self._expect("{")
+        if await self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            name = await self._value()
+            await self._expect(":")
+            yield name, await self._value()
+
+            if await self._expect(",}") == "}":
+                return
+
+    async def members(self, key: str) -> AsyncIterator[tuple[str, Any]]:
+        """
+        Yield the members of the object under `key` in the top-level object. Other
+        top-level members are parsed and discarded.
+        """
+
+        await self._expect("{")
+        if await self._peek() == "}":
+            return
+
+        while True:
+            name = await self._value()
+            await self._expect(":")
+            if name == key:
+                async for member in self._members():
+                    yield member
+            else:
+                await self._value()
+
+            if await self._expect(",}") == "}":
+                return
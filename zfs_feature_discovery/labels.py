@@ -0,0 +1,114 @@
+"""
+Normalization of labels to what Kubernetes accepts, applied when rendering feature
+files
+"""
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, Literal, Mapping
+
+log = logging.getLogger(__name__)
+
+# Applies to both label values and the name part of keys (after the namespace)
+LABEL_MAX_LENGTH = 63
+LABEL_VALUE_PATTERN = re.compile(r"(?:[A-Za-z0-9](?:[-A-Za-z0-9_.]*[A-Za-z0-9])?)?")
+LABEL_INVALID_CHARS = re.compile(r"[^-A-Za-z0-9_.]+")
+LABEL_EDGE_CHARS = "-_."
+
+HASH_LENGTH = 10
+
+OverflowMode = Literal["truncate", "hash"]
+
+
+def _shorten(value: str, original: str, overflow: OverflowMode) -> str:
+    if overflow == "truncate":
+        return value[:LABEL_MAX_LENGTH].rstrip(LABEL_EDGE_CHARS)
+
+    # Keep a readable prefix, and tell apart values that only differ at the end
+    digest = hashlib.sha256(original.encode()).hexdigest()[:HASH_LENGTH]
+    prefix = value[: LABEL_MAX_LENGTH - HASH_LENGTH - 1].rstrip(LABEL_EDGE_CHARS)
+    return f"{prefix}-{digest}" if prefix else digest
+
+
+def normalize_value(value: str, overflow: OverflowMode = "hash") -> str:
+    """
+    Make a label value valid: at most 63 characters, only alphanumerics, dashes,
+    underscores and dots, starting and ending with an alphanumeric character.
+
+    Invalid characters are replaced with underscores. Over-long values are either
+    truncated, or truncated and suffixed with a hash of the full value, so
+    different values still produce different labels.
+    """
+
+    if len(value) <= LABEL_MAX_LENGTH and LABEL_VALUE_PATTERN.fullmatch(value):
+        return value
+
+    normalized = LABEL_INVALID_CHARS.sub("_", value).strip(LABEL_EDGE_CHARS)
+    if len(normalized) > LABEL_MAX_LENGTH:
+        normalized = _shorten(normalized, value, overflow)
+
+    return normalized
+
+
+@lru_cache(maxsize=65536)
+def normalize_key(key: str) -> str:
+    """
+    Make the name part of a label key valid. Keys are stable between refreshes, so
+    results are cached. Over-long names are always hashed, so they stay unique.
+    """
+
+    namespace, sep, name = key.rpartition("/")
+    normalized = normalize_value(name, "hash")
+    if normalized != name:
+        log.debug(f"Label key {key} normalized to {namespace}{sep}{normalized}")
+
+    return f"{namespace}{sep}{normalized}"
+
+
+def normalize_labels(
+    labels: Iterable[tuple[str, str]], overflow: OverflowMode = "hash"
+) -> dict[str, str]:
+    return {
+        normalize_key(key): normalize_value(value, overflow) for key, value in labels
+    }
+
+
+@dataclass(frozen=True)
+class LabelDiff:
+    """
+    Changes between two label snapshots
+    """
+
+    added: dict[str, str] = field(default_factory=dict)
+    removed: dict[str, str] = field(default_factory=dict)
+    # key -> (old value, new value)
+    changed: dict[str, tuple[str, str]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def describe(self) -> Iterable[str]:
+        for key, value in sorted(self.added.items()):
+            yield f"+ {key}={value}"
+        for key, value in sorted(self.removed.items()):
+            yield f"- {key}={value}"
+        for key, (old, new) in sorted(self.changed.items()):
+            yield f"~ {key}={old} -> {new}"
+
+
+def diff_labels(old: Mapping[str, str], new: Mapping[str, str]) -> LabelDiff:
+    diff = LabelDiff()
+    for key, value in new.items():
+        old_value = old.get(key)
+        if old_value is None:
+            diff.added[key] = value
+        elif old_value != value:
+            diff.changed[key] = (old_value, value)
+
+    for key in old.keys() - new.keys():
+        diff.removed[key] = old[key]
+
+    return diff
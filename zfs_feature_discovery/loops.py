@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Literal, Optional
+
+log = logging.getLogger(__name__)
+
+# Rows (output lines, properties or labels) processed by long synchronous loops
+# between yields to the event loop
+YIELD_ROWS = 1000
+
+# "auto" uses uvloop if it is installed, and the default asyncio loop otherwise
+EventLoopName = Literal["auto", "asyncio", "uvloop"]
+
+LoopFactory = Callable[[], asyncio.AbstractEventLoop]
+
+
+def uvloop_available() -> bool:
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def loop_factory(name: EventLoopName) -> LoopFactory:
+    """
+    Get a factory for the named event loop implementation, for `asyncio.Runner`
+    """
+
+    if name == "auto":
+        name = "uvloop" if uvloop_available() else "asyncio"
+
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError as e:
+            raise ImportError("uvloop was requested, but is not installed") from e
+
+        factory: LoopFactory = uvloop.new_event_loop
+        return factory
+
+    return asyncio.new_event_loop
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how much later than scheduled a periodic timer runs,
+    which is how long everything else waiting on the loop, such as the query API,
+    the health watchdog or draining command stderr, was held up.
+
+    The maximum is kept since startup, and percentiles over the last `window`
+    samples. Lag of at least `warn_threshold` seconds is logged.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.25,
+        *,
+        window: int = 1200,
+        warn_threshold: float = 1.0,
+    ) -> None:
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.max_lag = 0.0
+        self.samples: deque[float] = deque(maxlen=window)
+
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def record(self, lag: float) -> None:
+        self.samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.warn_threshold:
+            log.warning(f"Event loop was blocked for {lag:.3f}s")
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "max_ms": round(self.max_lag * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "samples": len(self.samples),
+        }
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - scheduled))
+
+    async def __aenter__(self) -> "LoopLagMonitor":
+        log.info(f"Measuring event loop lag every {self.interval}s")
+        self._task = asyncio.create_task(self.run(), name="loop lag monitor")
+        return self
+
+    async def __aexit__(self, *_: Any) -> bool:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        return False
@@ -0,0 +1,195 @@
+"""
+Settings compiled once into immutable structures for the refresh loop, so nothing
+is re-parsed, re-sanitized or re-formatted on every refresh
+"""
+
+import re
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Iterable, Mapping, Optional, Sequence
+
+from zfs_feature_discovery.derived import ByteUnit
+
+if TYPE_CHECKING:
+    from zfs_feature_discovery.config import DerivedLabel
+
+# Stands in for the property name when pre-formatting label templates. Sanitized
+# names can never contain it.
+_PROPERTY_MARKER = "\0"
+
+# Stands in for the dataset name in pool summary labels of grouped dataset labels
+SUMMARY_DATASET = "_all"
+
+
+def sanitize(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+@dataclass(frozen=True, slots=True)
+class LabelTemplate:
+    """
+    A label key with everything but the property name already formatted
+    """
+
+    parts: tuple[str, ...]
+
+    @classmethod
+    def compile(cls, namespace: str, format: str, **fields: str) -> "LabelTemplate":
+        label = format.format(**fields, property_name=_PROPERTY_MARKER)
+        return cls(tuple(f"{namespace}/{label}".split(_PROPERTY_MARKER)))
+
+    def key(self, property_name: str) -> str:
+        return property_name.join(self.parts)
+
+
+@dataclass(frozen=True, slots=True)
+class DerivedRule:
+    """
+    A derived label, detached from its pydantic model
+    """
+
+    name: str
+    label_name: str
+    property: str
+    unit: ByteUnit
+    bucket: Optional[float]
+    min: Optional[float]
+
+    @classmethod
+    def compile(cls, derived: "DerivedLabel") -> "DerivedRule":
+        return cls(
+            name=derived.name,
+            label_name=sanitize(derived.name),
+            property=derived.property,
+            unit=derived.unit,
+            bucket=derived.bucket,
+            min=derived.min,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class PoolPlan:
+    pool_name: str
+    # Sanitized, for label keys and feature file names
+    label_name: str
+    zpool_label: LabelTemplate
+    # Keyed by full dataset name
+    dataset_labels: Mapping[str, LabelTemplate]
+    # Summary of grouped labels over all datasets
+    dataset_summary: LabelTemplate
+
+
+@dataclass(frozen=True, slots=True)
+class RuntimePlan:
+    namespace: str
+    zpool_format: str
+    zfs_dataset_format: str
+    # (property name, sanitized name)
+    zpool_props: tuple[tuple[str, str], ...]
+    zfs_dataset_props: tuple[tuple[str, str], ...]
+    zpool_derived: tuple[DerivedRule, ...]
+    zfs_dataset_derived: tuple[DerivedRule, ...]
+    # Sanitized names of the dataset labels summarized per pool
+    zfs_dataset_grouped: tuple[str, ...]
+    global_label: LabelTemplate
+    pools: Mapping[str, PoolPlan]
+
+    def pool(self, pool_name: str) -> PoolPlan:
+        """
+        Plan for a pool, compiled on the spot if it was not configured
+        """
+
+        pool = self.pools.get(pool_name)
+        if pool is None:
+            pool = self.compile_pool(pool_name, ())
+
+        return pool
+
+    def compile_pool(self, pool_name: str, datasets: Iterable[str]) -> PoolPlan:
+        label_name = sanitize(pool_name)
+        return PoolPlan(
+            pool_name=pool_name,
+            label_name=label_name,
+            zpool_label=LabelTemplate.compile(
+                self.namespace, self.zpool_format, pool_name=label_name
+            ),
+            dataset_labels=MappingProxyType(
+                {
+                    f"{pool_name}/{ds}": self.compile_dataset_label(
+                        label_name, pool_name, f"{pool_name}/{ds}"
+                    )
+                    for ds in datasets
+                }
+            ),
+            dataset_summary=LabelTemplate.compile(
+                self.namespace,
+                self.zfs_dataset_format,
+                pool_name=label_name,
+                dataset_name=SUMMARY_DATASET,
+            ),
+        )
+
+    def dataset_label(self, pool: PoolPlan, dataset: str) -> LabelTemplate:
+        """
+        Label template for a dataset, compiled on the spot if it was not configured
+        """
+
+        template = pool.dataset_labels.get(dataset)
+        if template is None:
+            template = self.compile_dataset_label(
+                pool.label_name, pool.pool_name, dataset
+            )
+
+        return template
+
+    def compile_dataset_label(
+        self, pool_label_name: str, pool_name: str, dataset: str
+    ) -> LabelTemplate:
+        dataset_name = dataset.removeprefix(f"{pool_name}/")
+        assert dataset_name != dataset
+
+        return LabelTemplate.compile(
+            self.namespace,
+            self.zfs_dataset_format,
+            pool_name=pool_label_name,
+            dataset_name=sanitize(dataset_name),
+        )
+
+
+def compile_plan(
+    *,
+    namespace: str,
+    zpool_format: str,
+    zfs_dataset_format: str,
+    global_format: str,
+    zpool_props: Iterable[str],
+    zfs_dataset_props: Iterable[str],
+    zpool_derived: Sequence["DerivedLabel"],
+    zfs_dataset_derived: Sequence["DerivedLabel"],
+    pools: Mapping[str, Iterable[str]],
+    zfs_dataset_grouped: Iterable[str] = (),
+) -> RuntimePlan:
+    """
+    Compile label settings and the datasets of each pool, by pool name, into a plan
+    """
+
+    plan = RuntimePlan(
+        namespace=namespace,
+        zpool_format=zpool_format,
+        zfs_dataset_format=zfs_dataset_format,
+        zpool_props=tuple((name, sanitize(name)) for name in sorted(zpool_props)),
+        zfs_dataset_props=tuple(
+            (name, sanitize(name)) for name in sorted(zfs_dataset_props)
+        ),
+        zpool_derived=tuple(map(DerivedRule.compile, zpool_derived)),
+        zfs_dataset_derived=tuple(map(DerivedRule.compile, zfs_dataset_derived)),
+        zfs_dataset_grouped=tuple(sorted(map(sanitize, zfs_dataset_grouped))),
+        global_label=LabelTemplate.compile(namespace, global_format),
+        pools=MappingProxyType({}),
+    )
+
+    compiled = {
+        pool_name: plan.compile_pool(pool_name, datasets)
+        for pool_name, datasets in pools.items()
+    }
+    return replace(plan, pools=MappingProxyType(compiled))
@@ -0,0 +1,216 @@
+import asyncio
+import asyncio.subprocess as subprocess
+import codecs
+import logging
+import os
+import signal
+import time
+from typing import Any, AsyncIterator, Optional
+
+log = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_STDERR_SIZE = 64 * 1024
+# After killing a process, how long to wait for its pipes to be closed
+PIPE_CLOSE_TIMEOUT = 1.0
+
+
+class RateLimiter:
+    """
+    Token bucket allowing bursts of `burst` events, refilled at `rate` per second
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0
+
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+
+        self.suppressed += 1
+        return False
+
+
+# Per command, so a noisy command doesn't hide errors from others
+_stderr_limiters: dict[str, RateLimiter] = {}
+
+
+def stderr_limiter(command: str) -> RateLimiter:
+    limiter = _stderr_limiters.get(command)
+    if limiter is None:
+        limiter = _stderr_limiters[command] = RateLimiter(rate=1, burst=20)
+
+    return limiter
+
+
+class ManagedProcess:
+    """
+    Owns a spawned process until it is reaped.
+
+    Stderr is drained in bulk in the background, keeping at most `max_stderr` bytes,
+    which are logged once the process exits under a per-command rate limit. Stdout is
+    also read in bulk. If the context is left before the process was waited for,
+    including on cancellation or errors, the process (and its process group, if it
+    leads one) is killed and reaped, and its pipes closed.
+    """
+
+    def __init__(
+        self,
+        proc: subprocess.Process,
+        name: str,
+        *,
+        max_stderr: int = MAX_STDERR_SIZE,
+        process_group: bool = False,
+    ) -> None:
+        self.proc = proc
+        self.name = name
+        self.max_stderr = max_stderr
+        self.process_group = process_group
+
+        self.stderr = bytearray()
+        self.stderr_dropped = 0
+
+        self._stderr_task: Optional[asyncio.Task[None]] = None
+        self._waited = False
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    async def _drain_stderr(self) -> None:
+        assert self.proc.stderr
+        while chunk := await self.proc.stderr.read(READ_CHUNK_SIZE):
+            keep = max(0, self.max_stderr - len(self.stderr))
+            self.stderr += chunk[:keep]
+            self.stderr_dropped += max(0, len(chunk) - keep)
+
+    async def _drain_stdout(self) -> None:
+        assert self.proc.stdout
+        while await self.proc.stdout.read(READ_CHUNK_SIZE):
+            pass
+
+    async def line_batches(self) -> AsyncIterator[list[str]]:
+        """
+        Read stdout in bulk, yielding all the complete lines in each chunk, without
+        line endings
+        """
+
+        assert self.proc.stdout
+        pending = b""
+        while chunk := await self.proc.stdout.read(READ_CHUNK_SIZE):
+            *lines, pending = (pending + chunk).split(b"\n")
+            if lines:
+                yield [line.decode() for line in lines]
+
+        if pending:
+            yield [pending.decode()]
+
+    async def chunks(self) -> AsyncIterator[str]:
+        """
+        Read stdout in bulk, yielding decoded chunks as they are read
+        """
+
+        assert self.proc.stdout
+        # Characters can be split between chunks
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while chunk := await self.proc.stdout.read(READ_CHUNK_SIZE):
+            if text := decoder.decode(chunk):
+                yield text
+
+        if text := decoder.decode(b"", final=True):
+            yield text
+
+    async def read_output(self) -> str:
+        assert self.proc.stdout
+        return (await self.proc.stdout.read()).decode()
+
+    def log_stderr(self) -> None:
+        limiter = stderr_limiter(self.name)
+        for line in self.stderr.decode(errors="replace").splitlines():
+            if limiter.allow():
+                log.warning(f"{self.name}: {line}")
+
+        if limiter.suppressed:
+            log.warning(
+                f"{self.name}: suppressed {limiter.suppressed} lines of stderr "
+                "over the rate limit"
+            )
+            limiter.suppressed = 0
+
+        if self.stderr_dropped:
+            log.warning(
+                f"{self.name}: dropped {self.stderr_dropped} bytes of stderr over "
+                f"{self.max_stderr} bytes"
+            )
+
+    async def wait(self) -> int:
+        """
+        Wait for the process to exit, discarding any unread stdout, and log its
+        stderr
+        """
+
+        await self._drain_stdout()
+        if self._stderr_task:
+            await self._stderr_task
+
+        exit_code = await self.proc.wait()
+        self._waited = True
+        self.log_stderr()
+
+        return exit_code
+
+    def _kill(self) -> None:
+        if self.proc.returncode is not None:
+            return
+
+        try:
+            if self.process_group:
+                os.killpg(self.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except ProcessLookupError:
+            pass
+
+    async def terminate(self) -> None:
+        """
+        Kill and reap the process, and wait for its pipes to be closed
+        """
+
+        self._kill()
+        await self.proc.wait()
+
+        # Anything it spawned might still hold on to the pipes
+        try:
+            async with asyncio.timeout(PIPE_CLOSE_TIMEOUT):
+                await self._drain_stdout()
+                if self._stderr_task:
+                    await self._stderr_task
+        except TimeoutError:
+            log.warning(f"{self.name}: pipes still open after killing {self.pid}")
+            if self._stderr_task:
+                self._stderr_task.cancel()
+
+        self._waited = True
+
+    async def __aenter__(self) -> "ManagedProcess":
+        self._stderr_task = asyncio.create_task(
+            self._drain_stderr(), name=f"{self.name} stderr"
+        )
+        return self
+
+    async def __aexit__(self, *_: Any) -> bool:
+        if not self._waited:
+            # Shielded, so cancelling again while cleaning up can't leak the process
+            await asyncio.shield(self.terminate())
+
+        return False
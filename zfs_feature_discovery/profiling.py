@@ -0,0 +1,170 @@
+import asyncio
+import cProfile
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Awaitable, Literal, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ProfileMode = Literal["cprofile", "sampling"]
+
+
+class StackSampler:
+    """
+    Samples the stack of the event loop thread from a background thread, tagging
+    each sample with the name of the asyncio task that was running.
+
+    Output uses the "folded stacks" format understood by flamegraph tools.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float) -> None:
+        self.loop = loop
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        frame: Optional[FrameType] = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_name() if task else "<loop>"
+
+        self.samples[";".join([f"task:{task_name}", *reversed(stack)])] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def dump(self, path: Path) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RefreshProfiler:
+    """
+    Profiles the next N refresh cycles once armed, either from the start with
+    `--profile`, or at runtime by sending SIGUSR1 to the daemon.
+
+    In `cprofile` mode, a pstats file is written (`refresh-<ts>.prof`). In
+    `sampling` mode, a folded stacks file prefixed with asyncio task names is
+    written (`refresh-<ts>.folded`).
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        *,
+        cycles: int = 1,
+        mode: ProfileMode = "cprofile",
+        sample_interval: float = 0.005,
+    ) -> None:
+        self.output_dir = output_dir
+        self.cycles = cycles
+        self.mode = mode
+        self.sample_interval = sample_interval
+
+        self._remaining = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+
+    @property
+    def armed(self) -> bool:
+        return self._remaining > 0
+
+    def arm(self, cycles: Optional[int] = None) -> None:
+        if self.armed:
+            log.info("Profiling already in progress, ignoring request")
+            return
+
+        self._remaining = cycles or self.cycles
+        log.info(f"Profiling the next {self._remaining} refresh cycles")
+
+    def _start(self) -> None:
+        if self.mode == "sampling":
+            if self._sampler is None:
+                self._sampler = StackSampler(
+                    asyncio.get_running_loop(), self.sample_interval
+                )
+            self._sampler.start()
+        else:
+            if self._profile is None:
+                self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def _stop(self) -> None:
+        if self._sampler:
+            self._sampler.stop()
+        if self._profile:
+            self._profile.disable()
+
+    def dump(self) -> Optional[Path]:
+        ts = time.strftime("%Y%m%dT%H%M%S")
+        path: Optional[Path] = None
+
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            if self._sampler:
+                path = self.output_dir / f"refresh-{ts}.folded"
+                self._sampler.dump(path)
+            elif self._profile:
+                path = self.output_dir / f"refresh-{ts}.prof"
+                self._profile.dump_stats(path)
+        except OSError:
+            log.exception("Failed to write profile")
+            path = None
+        else:
+            log.info(f"Wrote refresh profile to {path}")
+        finally:
+            self._profile = None
+            self._sampler = None
+
+        return path
+
+    async def profile(self, aw: Awaitable[T]) -> T:
+        """
+        Await a refresh, profiling it if armed
+        """
+
+        if not self.armed:
+            return await aw
+
+        self._start()
+        try:
+            return await aw
+        finally:
+            self._stop()
+            self._remaining -= 1
+            if not self.armed:
+                self.dump()
@@ -0,0 +1,257 @@
+"""
+Rendering of dataset labels, optionally in worker processes for pools with very
+large numbers of datasets
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, Mapping, Optional, Sequence
+
+from zfs_feature_discovery.derived import derive_value
+from zfs_feature_discovery.labels import OverflowMode, normalize_key, normalize_labels
+from zfs_feature_discovery.plan import DerivedRule, LabelTemplate
+from zfs_feature_discovery.zfs_props import ZfsProperty
+
+if TYPE_CHECKING:
+    from zfs_feature_discovery.config import Config
+
+log = logging.getLogger(__name__)
+
+# Datasets sent to a worker at once
+RENDER_CHUNK_SIZE = 2000
+
+# Label for the number of properties left at their default value, replacing them when
+# collapsing defaults
+DEFAULTS_LABEL = "defaults"
+
+# Value of a pool summary label when datasets differ
+MIXED_VALUE = "mixed"
+
+# A dataset's label template and properties
+DatasetItem = tuple[LabelTemplate, Mapping[str, ZfsProperty]]
+
+
+def select_props(
+    names: Iterable[tuple[str, str]],
+    props: Mapping[str, ZfsProperty],
+    sources: frozenset[str],
+    collapse_defaults: bool,
+) -> Iterable[tuple[str, str]]:
+    """
+    Pick the properties to label from (name, label name) pairs, yielding label names
+    and values.
+
+    Without a source filter all properties are kept, with missing ones as empty
+    values, so their labels are still written. With one, only properties from those
+    sources are, where properties without a source count as "none". Properties
+    collapsed as defaults are counted in a single label at the end.
+    """
+
+    defaults = 0
+    for name, label_name in names:
+        prop = props.get(name)
+        source = (prop.source or "none") if prop else None
+        if collapse_defaults and source == "default":
+            defaults += 1
+        elif not sources or source in sources:
+            yield label_name, prop.value if prop else ""
+
+    if collapse_defaults:
+        yield DEFAULTS_LABEL, str(defaults)
+
+
+def project_props(
+    props: Mapping[str, ZfsProperty], names: Iterable[str]
+) -> dict[str, ZfsProperty]:
+    """
+    Only the named properties, out of everything collected
+    """
+
+    return {name: props[name] for name in names if name in props}
+
+
+def derive(derived: DerivedRule, props: Mapping[str, ZfsProperty]) -> str:
+    return derive_value(
+        props.get(derived.property),
+        unit=derived.unit,
+        bucket=derived.bucket,
+        min=derived.min,
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class DatasetRenderer:
+    """
+    Everything needed to render dataset labels, detached from the `FeatureManager`
+    so it can be sent to worker processes
+    """
+
+    # (property name, sanitized name)
+    props: tuple[tuple[str, str], ...]
+    derived: tuple[DerivedRule, ...]
+    sources: frozenset[str]
+    collapse_defaults: bool
+    overflow: OverflowMode
+
+    @property
+    def used_props(self) -> frozenset[str]:
+        """
+        Names of the properties that labels are rendered from
+        """
+
+        return frozenset(
+            [name for name, _ in self.props] + [d.property for d in self.derived]
+        )
+
+    def labels(
+        self, template: LabelTemplate, props: Mapping[str, ZfsProperty]
+    ) -> Iterable[tuple[str, str]]:
+        # We always write all the features; better an empty value than missing label
+        for label_name, value in select_props(
+            self.props, props, self.sources, self.collapse_defaults
+        ):
+            yield template.key(label_name), value
+
+        for derived in self.derived:
+            yield template.key(derived.label_name), derive(derived, props)
+
+    def render(self, items: Iterable[DatasetItem]) -> dict[str, str]:
+        """
+        Render and normalize the labels of many datasets
+        """
+
+        raw: list[tuple[str, str]] = []
+        for template, props in items:
+            try:
+                raw.extend(self.labels(template, props))
+            except Exception:
+                log.exception(f"Failed to render labels with template {template}")
+
+        return normalize_labels(raw, self.overflow)
+
+
+def group_labels(
+    labels: dict[str, str],
+    templates: Sequence[LabelTemplate],
+    summary: LabelTemplate,
+    names: Iterable[str],
+) -> None:
+    """
+    Summarize normalized dataset labels over all of a pool's datasets, in place.
+    For each label name, a summary label holds the value shared by every dataset,
+    whose own labels are then removed, or `MIXED_VALUE` if any differs or is
+    missing, keeping theirs.
+    """
+
+    if not templates:
+        return
+
+    for name in names:
+        # Datasets can share a sanitized name
+        keys = list(
+            dict.fromkeys(normalize_key(template.key(name)) for template in templates)
+        )
+        values = {labels.get(key) for key in keys}
+        value = values.pop() if len(values) == 1 else None
+        if value is None:
+            value = MIXED_VALUE
+        else:
+            for key in keys:
+                del labels[key]
+
+        labels[normalize_key(summary.key(name))] = value
+
+
+def render_chunk(renderer: DatasetRenderer, items: list[DatasetItem]) -> dict[str, str]:
+    """
+    Entry point of worker processes
+    """
+
+    return renderer.render(items)
+
+
+class RenderPool:
+    """
+    Worker processes rendering the labels of pools with at least `threshold`
+    datasets, in chunks, so the event loop keeps running meanwhile. The processes
+    are only started the first time a pool is large enough.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        *,
+        threshold: int,
+        chunk_size: int = RENDER_CHUNK_SIZE,
+    ) -> None:
+        self.processes = processes
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self._executor: Optional[Executor] = None
+
+    @classmethod
+    def from_config(cls, config: "Config") -> Optional["RenderPool"]:
+        if not config.render_processes:
+            return None
+
+        return cls(config.render_processes, threshold=config.render_threshold)
+
+    def wants(self, datasets: int) -> bool:
+        return self.processes > 0 and datasets >= self.threshold
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            log.info(f"Starting {self.processes} render worker processes")
+            # Forking a process running an event loop and threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context("forkserver")
+            )
+
+        return self._executor
+
+    async def render(
+        self, renderer: DatasetRenderer, items: Sequence[DatasetItem]
+    ) -> dict[str, str]:
+        """
+        Render the labels of many datasets in the worker processes, in order
+        """
+
+        used = renderer.used_props
+        # Only send what is needed: `zfs get all` output is mostly unused
+        chunks: list[list[DatasetItem]] = [
+            [
+                (template, project_props(props, used))
+                for template, props in items[i : i + self.chunk_size]
+            ]
+            for i in range(0, len(items), self.chunk_size)
+        ]
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, render_chunk, renderer, chunk)
+                    for chunk in chunks
+                )
+            )
+        except BrokenProcessPool:
+            # Start new workers next time
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        labels: dict[str, str] = {}
+        for result in results:
+            labels.update(result)
+
+        return labels
+
+    def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
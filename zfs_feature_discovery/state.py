@@ -0,0 +1,108 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+import aiofiles
+
+from zfs_feature_discovery.cache import config_hash, write_json
+from zfs_feature_discovery.features import FeatureFileState
+
+if TYPE_CHECKING:
+    from zfs_feature_discovery.config import Config
+
+log = logging.getLogger(__name__)
+
+STATE_FORMAT_VERSION = 1
+
+
+def dump_files(files: Mapping[str, FeatureFileState]) -> dict[str, Any]:
+    return {
+        name: {"expiry": state.expiry.isoformat(), "labels": state.labels}
+        for name, state in files.items()
+    }
+
+
+def load_files(data: dict[str, Any]) -> dict[str, FeatureFileState]:
+    files = {}
+    for name, state in data.items():
+        labels = state["labels"]
+        if not all(isinstance(v, str) for v in labels.values()):
+            raise ValueError(f"Invalid labels of {name}")
+
+        files[name] = FeatureFileState(
+            expiry=datetime.fromisoformat(state["expiry"]), labels=dict(labels)
+        )
+
+    return files
+
+
+class StateStore:
+    """
+    On-disk copy of the labels and expiry time of the feature files last written by
+    the daemon, so that a replacement daemon can start from them instead of
+    rewriting every file.
+
+    The state is only used if it was stored with the same key (usually a hash of
+    the config). It is only written when it changed since it was last loaded or
+    stored, so nothing is written while feature files are not either.
+    """
+
+    @classmethod
+    def from_config(cls, config: "Config") -> Optional["StateStore"]:
+        if not config.state_path:
+            return None
+
+        return cls(path=config.state_path, key=config_hash(config))
+
+    def __init__(self, path: Path, *, key: str) -> None:
+        self.path = path
+        self.key = key
+        # What the file holds, as far as we know
+        self._stored: Optional[dict[str, FeatureFileState]] = None
+
+    async def load(self) -> dict[str, FeatureFileState]:
+        files = await self._load()
+        self._stored = dict(files)
+        return files
+
+    async def _load(self) -> dict[str, FeatureFileState]:
+        try:
+            async with aiofiles.open(self.path) as f:
+                data = json.loads(await f.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            log.warning(f"Failed to read state file {self.path}, ignoring")
+            return {}
+
+        if data.get("version") != STATE_FORMAT_VERSION or data.get("key") != self.key:
+            log.debug("State file does not match current config, ignoring")
+            return {}
+
+        try:
+            return load_files(data["files"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            log.warning(f"Invalid state file {self.path}, ignoring")
+            return {}
+
+    async def store(self, files: Mapping[str, FeatureFileState]) -> None:
+        if files == self._stored:
+            log.debug("State unchanged, not writing it")
+            return
+
+        data = {
+            "version": STATE_FORMAT_VERSION,
+            "key": self.key,
+            "files": dump_files(files),
+        }
+
+        try:
+            await write_json(self.path, data)
+        except OSError:
+            log.exception(f"Failed writing state file {self.path}")
+            return
+
+        self._stored = dict(files)
+        log.debug(f"Wrote state file {self.path}")
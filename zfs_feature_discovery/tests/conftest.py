@@ -1,20 +1,23 @@
 import asyncio
 import asyncio.subprocess as subprocess
 from asyncio.subprocess import Process
+from datetime import UTC, datetime
 from pathlib import Path
-from typing import Any, AsyncIterable, Generator, Optional, Sequence
+from typing import Any, AsyncIterable, AsyncIterator, Generator, Optional, Sequence
 from unittest.mock import ANY, AsyncMock, MagicMock, Mock
 
 import aiofiles
 import pytest
+import pytest_asyncio
 from aiofiles.tempfile import NamedTemporaryFile
 from aiofiles.threadpool.binary import AsyncBufferedIOBase
+from pytest import TempPathFactory
 from pytest_mock import MockerFixture
 
 from zfs_feature_discovery.config import Config
-from zfs_feature_discovery.features import FeatureManager
-from zfs_feature_discovery.zfs_globals import ZfsGlobals
-from zfs_feature_discovery.zfs_props import CommandHarness
+from zfs_feature_discovery.features import FeatureManager, RefreshResult
+from zfs_feature_discovery.zfs_globals import ZfsGlobals, ZfsVersion
+from zfs_feature_discovery.zfs_props import CommandHarness, ZfsProperty
 from zfs_feature_discovery.zpool import ZpoolManager
 
 TEST_DATA_DIR = Path(__file__).resolve().parent / "fixtures"
@@ -46,6 +49,7 @@ async def run_mock_process(
             **kwargs,
             executable="/bin/bash",
             pass_fds=(stdout_tmp.fileno(), stderr_tmp.fileno()),
+            start_new_session=True,
         )
         return proc
 
@@ -265,3 +269,55 @@ def mock_zfs_global_properties(
         stdout=hostid_output,
         exit_code=0,
     )
+
+
+@pytest.fixture
+def reference_time() -> datetime:
+    return datetime(2024, 2, 7, 10, 42, 8, 52969, tzinfo=UTC)
+
+
+@pytest_asyncio.fixture
+async def feature_manager(
+    tmp_path_factory: TempPathFactory,
+    zpool_test_props: frozenset[str],
+    zfs_dataset_test_props: frozenset[str],
+    zfs_globals: ZfsGlobals,
+    reference_time: datetime,
+) -> AsyncIterator[FeatureManager]:
+    fm = FeatureManager(
+        feature_dir=tmp_path_factory.mktemp("features-"),
+        zpool_props=zpool_test_props,
+        zfs_dataset_props=zfs_dataset_test_props,
+        label_namespace="me.danielkza.io",
+        zpool_label_format="zpool.{pool_name}.{property_name}",
+        zfs_dataset_label_format="zfs.{pool_name}.{dataset_name}.{property_name}",
+        global_label_format="zfs-global.{property_name}",
+        zfs_globals=zfs_globals,
+    )
+    async with fm:
+        async with fm.with_reference_time(reference_time):
+            yield fm
+
+
+@pytest.fixture
+def refresh_result() -> RefreshResult:
+    return RefreshResult(
+        zfs_version=ZfsVersion(main="2.2.2-1", kernel="2.2.2-1"),
+        hostid="00fac711",
+        zpool_props={
+            "rpool": {
+                "health": ZfsProperty("rpool", "health", "ONLINE", None),
+                "guid": ZfsProperty("rpool", "guid", "2706753758230323468", None),
+            }
+        },
+        dataset_props={
+            "rpool": {
+                "rpool/test1": {
+                    "type": ZfsProperty("rpool/test1", "type", "filesystem", None),
+                    "readonly": ZfsProperty(
+                        "rpool/test1", "readonly", "off", "default"
+                    ),
+                }
+            }
+        },
+    )
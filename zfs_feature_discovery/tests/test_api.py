@@ -0,0 +1,262 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import pytest
+import pytest_asyncio
+
+from zfs_feature_discovery.api import QueryApi
+from zfs_feature_discovery.features import FeatureManager, RefreshResult
+from zfs_feature_discovery.loops import LoopLagMonitor
+from zfs_feature_discovery.zfs_globals import ZfsVersion
+from zfs_feature_discovery.zpool import ZpoolManager
+
+
+@pytest_asyncio.fixture
+async def query_api(
+    feature_manager: FeatureManager, tmp_path: Path
+) -> AsyncIterator[QueryApi]:
+    async with QueryApi(
+        feature_manager, socket_path=tmp_path / "api.sock", port=0
+    ) as api:
+        yield api
+
+
+async def request(
+    api: QueryApi,
+    path: str,
+    method: str = "GET",
+    etag: Optional[str] = None,
+    tcp: bool = False,
+) -> tuple[int, dict[str, str], bytes]:
+    if tcp:
+        host, port = api._servers[1].sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        assert api.socket_path
+        reader, writer = await asyncio.open_unix_connection(api.socket_path)
+
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost"]
+    if etag:
+        lines.append(f"If-None-Match: {etag}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, body = response.split(b"\r\n\r\n", 1)
+    status_line, *header_lines = head.decode().split("\r\n")
+    headers = {}
+    for line in header_lines:
+        key, value = line.split(": ", 1)
+        headers[key.lower()] = value
+
+    return int(status_line.split(" ")[1]), headers, body
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_api_labels(
+    query_api: QueryApi, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    status, _, _ = await request(query_api, "/v1/labels")
+    assert status == 503
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    status, headers, body = await request(query_api, "/v1/labels")
+    assert status == 200
+    assert headers["content-type"] == "application/json"
+    assert "etag" in headers
+
+    labels = json.loads(body)
+    assert labels["me.danielkza.io/zpool.rpool.health"] == "ONLINE"
+    assert labels["me.danielkza.io/zfs.rpool.zvol1.type"] == "volume"
+    assert labels["me.danielkza.io/zfs-global.hostid"] == "00fac711"
+
+    status, _, tcp_body = await request(query_api, "/v1/labels", tcp=True)
+    assert status == 200
+    assert tcp_body == body
+
+    status, _, body = await request(
+        query_api, "/v1/labels", method="HEAD", etag='"other"'
+    )
+    assert status == 200
+    assert body == b""
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_api_properties(
+    query_api: QueryApi, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    status, _, body = await request(query_api, "/v1/properties")
+    assert status == 200
+
+    props = json.loads(body)
+    assert props["zfs_version"] == {"main": "2.2.2-1", "kernel": "2.2.2-1"}
+    assert props["zpools"]["rpool"]["health"] == {"value": "ONLINE", "source": None}
+    assert props["datasets"]["rpool"]["rpool/test1"]["recordsize"] == {
+        "value": "131072",
+        "source": "default",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_api_etag_long_poll(
+    query_api: QueryApi, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    _, headers, _ = await request(query_api, "/v1/labels")
+    etag = headers["etag"]
+
+    status, headers, body = await request(query_api, "/v1/labels", etag=etag)
+    assert status == 304
+    assert headers["etag"] == etag
+    assert body == b""
+
+    # A refresh with no changes keeps waiting until the timeout
+    poll = asyncio.create_task(request(query_api, "/v1/labels?wait=0.5", etag=etag))
+    await asyncio.sleep(0.1)
+    assert feature_manager.last_result
+    await feature_manager._notify_refreshed(feature_manager.last_result)
+    status, _, _ = await poll
+    assert status == 304
+
+    poll = asyncio.create_task(request(query_api, "/v1/labels?wait=5", etag=etag))
+    await asyncio.sleep(0.1)
+    assert not poll.done()
+
+    await feature_manager.write_global_features(
+        ZfsVersion(main="2.2.3-1", kernel="2.2.3-1"), "00fac711"
+    )
+    await feature_manager._notify_refreshed(feature_manager.last_result)
+
+    async with asyncio.timeout(1):
+        status, headers, body = await poll
+
+    assert status == 200
+    assert headers["etag"] != etag
+    assert json.loads(body)["me.danielkza.io/zfs-global.ver"] == "2.2.3-1"
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_api_health_update(
+    query_api: QueryApi, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    key = "me.danielkza.io/zpool.rpool.health"
+    _, headers, body = await request(query_api, "/v1/labels")
+    assert json.loads(body)[key] == "ONLINE"
+    etag = headers["etag"]
+
+    # Health changes between refreshes wake up long-polls, and are served by every
+    # route
+    poll = asyncio.create_task(request(query_api, "/v1/labels?wait=5", etag=etag))
+    await asyncio.sleep(0.1)
+    assert await feature_manager.update_zpool_health("rpool", "DEGRADED")
+
+    async with asyncio.timeout(1):
+        status, headers, body = await poll
+
+    assert status == 200
+    assert headers["etag"] != etag
+    assert json.loads(body)[key] == "DEGRADED"
+
+    _, _, body = await request(query_api, "/v1/properties")
+    assert json.loads(body)["zpools"]["rpool"]["health"]["value"] == "DEGRADED"
+
+
+@pytest.mark.asyncio
+async def test_api_errors(query_api: QueryApi) -> None:
+    status, _, _ = await request(query_api, "/v1/unknown")
+    assert status == 404
+
+    status, _, _ = await request(query_api, "/v1/labels", method="POST")
+    assert status == 405
+
+    for wait in ("abc", "nan", "inf", "-1"):
+        status, _, _ = await request(query_api, f"/v1/labels?wait={wait}")
+        assert status == 400
+
+
+@pytest.mark.asyncio
+async def test_api_close_pending_poll(
+    feature_manager: FeatureManager, tmp_path: Path
+) -> None:
+    api = QueryApi(feature_manager, socket_path=tmp_path / "api.sock")
+    await api.start()
+
+    zfs_version = ZfsVersion(main=None, kernel=None)
+    await feature_manager.write_global_features(zfs_version, None)
+    await feature_manager._notify_refreshed(
+        RefreshResult(zfs_version, hostid=None, zpool_props={}, dataset_props={})
+    )
+    _, headers, _ = await request(api, "/v1/labels")
+
+    poll = asyncio.create_task(request(api, "/v1/labels?wait=60", etag=headers["etag"]))
+    await asyncio.sleep(0.1)
+
+    async with asyncio.timeout(1):
+        await api.close()
+
+    assert not (tmp_path / "api.sock").exists()
+    with pytest.raises(ValueError):
+        await poll
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_api_status(
+    query_api: QueryApi, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+    feature_manager.changed_labels_total = 3
+    assert feature_manager.last_result
+    await feature_manager._notify_refreshed(feature_manager.last_result)
+
+    status, _, body = await request(query_api, "/v1/status")
+    assert status == 200
+    assert json.loads(body) == {"generation": 2, "changed_labels_total": 3}
+
+
+@pytest.mark.asyncio
+async def test_api_metrics(query_api: QueryApi) -> None:
+    # Available before the first refresh, which can be what holds up the loop
+    status, _, body = await request(query_api, "/v1/metrics")
+    assert status == 200
+    assert json.loads(body) == {"loop_lag": None}
+
+    monitor = LoopLagMonitor()
+    query_api.lag_monitor = monitor
+    monitor.record(0.25)
+    _, _, body = await request(query_api, "/v1/metrics")
+    assert json.loads(body)["loop_lag"]["max_ms"] == 250.0
+
+    # Not cached until the next refresh
+    monitor.record(0.5)
+    _, _, body = await request(query_api, "/v1/metrics")
+    assert json.loads(body)["loop_lag"]["max_ms"] == 500.0
@@ -0,0 +1,150 @@
+import os
+from pathlib import Path
+
+import pytest
+from pytest import TempPathFactory
+
+from zfs_feature_discovery.benchmark.host import run_host_benchmark
+from zfs_feature_discovery.benchmark.loops import parse_args, run_loop_benchmark
+from zfs_feature_discovery.benchmark.parsers import run_parser_benchmark
+from zfs_feature_discovery.benchmark.runner import (
+    DEFAULT_BASELINE_PATH,
+    REGRESSION_KEYS,
+    Scenario,
+    ScenarioResult,
+    benchmark_refresh,
+    find_regressions,
+    format_report,
+    load_baseline,
+    scenario_matrix,
+)
+from zfs_feature_discovery.benchmark.synthetic import (
+    ZFS_DATASET_TEMPLATE,
+    FakeCommands,
+    split_datasets,
+    zfs_get_output,
+    zpool_get_output,
+)
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.zfs_props import ZfsProperty
+
+from .conftest import read_all_labels
+
+
+def test_synthetic_output_parses() -> None:
+    datasets = ["ds0", "group/ds1"]
+    lines = zfs_get_output("tank", datasets).splitlines()
+    assert len(lines) == len(datasets) * len(ZFS_DATASET_TEMPLATE)
+
+    props = [ZfsProperty.parse(line) for line in lines]
+    assert {prop.dataset for prop in props} == {"tank/ds0", "tank/group/ds1"}
+
+    pool_props = {
+        prop.name: prop
+        for prop in map(ZfsProperty.parse, zpool_get_output("tank").splitlines())
+    }
+    assert pool_props["health"].value == "ONLINE"
+
+
+def test_synthetic_split_datasets() -> None:
+    datasets = split_datasets(["pool0", "pool1", "pool2"], 10)
+    assert sum(map(len, datasets.values())) == 10
+    assert {len(ds) for ds in datasets.values()} == {3, 4}
+
+
+@pytest.mark.asyncio
+async def test_fake_commands_refresh(tmp_path_factory: TempPathFactory) -> None:
+    work_dir = tmp_path_factory.mktemp("bench-")
+    feature_dir = work_dir / "features"
+    feature_dir.mkdir()
+
+    config = Scenario(pools=2, datasets=3).config(
+        FakeCommands(work_dir / "bin"), feature_dir
+    )
+    assert isinstance(config, Config)
+
+    async with FeatureManager.from_config(config) as fm:
+        await fm.refresh()
+
+    labels = await read_all_labels(feature_dir)
+    ns = "feature.node.kubernetes.io"
+    assert labels[f"{ns}/zfs-global.ver"] == "2.2.2-1"
+    assert labels[f"{ns}/zpool.pool1.health"] == "ONLINE"
+    assert labels[f"{ns}/zfs.pool0.group0_ds0.type"] == "filesystem"
+    assert labels[f"{ns}/zfs.pool1.group0_ds1.type"] == "filesystem"
+
+
+@pytest.mark.asyncio
+async def test_benchmark_refresh(tmp_path: Path) -> None:
+    latencies, render_ns = await benchmark_refresh(
+        Scenario(pools=1, datasets=10), tmp_path, iterations=3, warmup=1
+    )
+    assert len(latencies) == 3
+    assert all(latency > 0 for latency in latencies)
+    assert render_ns > 0
+
+
+def test_benchmark_regressions() -> None:
+    result = ScenarioResult(
+        Scenario(pools=1, datasets=100),
+        latencies=[0.1, 0.2, 0.3],
+        peak_rss_kb=100 * 1024,
+    )
+    summary = result.summary()
+    assert summary["p50_ms"] == 200
+    assert summary["p99_ms"] == 300
+    assert summary["datasets_per_s"] == 500
+
+    assert find_regressions(summary, None) == []
+    assert find_regressions(summary, {"p50_ms": 190, "peak_rss_mb": 100}) == []
+    assert find_regressions(summary, {"p50_ms": 100}, tolerance=0.25) == [
+        "p50_ms 200.0 > baseline 100"
+    ]
+
+    _, regressed = format_report([result], {result.scenario.name: {"p99_ms": 100}})
+    assert regressed
+
+
+def test_benchmark_baseline_complete() -> None:
+    # Metrics missing from the baseline are silently never checked
+    baseline = load_baseline(DEFAULT_BASELINE_PATH)
+    for scenario in scenario_matrix():
+        assert set(REGRESSION_KEYS) <= baseline[scenario.name].keys()
+
+
+def test_benchmark_loops() -> None:
+    opts = parse_args(
+        [
+            "--spawns=5",
+            "--read-datasets=10",
+            "--datasets=10",
+            "--iterations=1",
+            "--warmup=0",
+        ]
+    )
+    result = run_loop_benchmark("asyncio", opts)
+
+    assert result.loop == "asyncio"
+    assert result.spawns_per_s > 0
+    assert result.read_mb_per_s > 0
+    assert result.refresh_p50_ms > 0
+
+
+def test_benchmark_parsers() -> None:
+    results = run_parser_benchmark(10, ["text", "json"], iterations=1)
+
+    assert [r.output_format for r in results] == ["text", "json"]
+    for result in results:
+        assert result.datasets == 10
+        assert result.props_per_s > 0
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="chroot needs root")
+def test_benchmark_host() -> None:
+    results = run_host_benchmark(["direct", "wrapper", "session"], count=5)
+
+    assert [r.mode for r in results] == ["direct", "wrapper", "session"]
+    for result in results:
+        assert result.commands == 5
+        assert 0 < result.p50_ms <= result.p90_ms
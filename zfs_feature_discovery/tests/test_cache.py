@@ -0,0 +1,149 @@
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pytest import TempPathFactory
+from pytest_mock import MockerFixture
+
+from zfs_feature_discovery.cache import ResultCache, config_hash
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager, RefreshResult
+from zfs_feature_discovery.zpool import ZpoolManager
+
+from .conftest import CommandMocker, read_all_labels
+
+
+@pytest.fixture
+def cache_path(tmp_path_factory: TempPathFactory) -> Path:
+    return tmp_path_factory.mktemp("cache-") / "cache.json"
+
+
+@pytest.fixture
+def result_cache(cache_path: Path) -> ResultCache:
+    return ResultCache(cache_path, key="test", max_age=30)
+
+
+@pytest.mark.asyncio
+async def test_cache_roundtrip(
+    result_cache: ResultCache, refresh_result: RefreshResult
+) -> None:
+    assert await result_cache.load() is None
+
+    await result_cache.store(refresh_result)
+    assert await result_cache.load() == refresh_result
+
+
+@pytest.mark.asyncio
+async def test_cache_key_mismatch(
+    result_cache: ResultCache, cache_path: Path, refresh_result: RefreshResult
+) -> None:
+    await result_cache.store(refresh_result)
+
+    other_cache = ResultCache(cache_path, key="other", max_age=30)
+    assert await other_cache.load() is None
+
+
+@pytest.mark.asyncio
+async def test_cache_stale(
+    result_cache: ResultCache,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> None:
+    await result_cache.store(refresh_result)
+
+    mocker.patch("time.time", return_value=time.time() + 31)
+    assert await result_cache.load() is None
+
+
+@pytest.mark.asyncio
+async def test_cache_invalid(result_cache: ResultCache, cache_path: Path) -> None:
+    cache_path.write_text("not json")
+    assert await result_cache.load() is None
+
+    cache_path.write_text(
+        json.dumps(
+            {"version": 1, "key": "test", "timestamp": time.time(), "result": {}}
+        )
+    )
+    assert await result_cache.load() is None
+
+
+def test_config_hash_stable(config_defaults: dict[str, Any]) -> None:
+    config = Config.model_validate(config_defaults)
+    same_config = Config.model_validate(
+        {**config_defaults, "cache_path": "/tmp/cache.json"}
+    )
+    other_config = Config.model_validate({**config_defaults, "zpool_props": "-all"})
+
+    assert config_hash(config) == config_hash(same_config)
+    assert config_hash(config) != config_hash(other_config)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_refresh_from_cache(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    result_cache: ResultCache,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> None:
+    await result_cache.store(refresh_result)
+    collect = mocker.patch.object(feature_manager, "collect")
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh(cache=result_cache)
+
+    collect.assert_not_called()
+    all_labels = await read_all_labels(feature_manager.feature_dir)
+    assert all_labels["me.danielkza.io/zpool.rpool.health"] == "ONLINE"
+    assert all_labels["me.danielkza.io/zfs.rpool.test1.type"] == "filesystem"
+    assert all_labels["me.danielkza.io/zfs-global.hostid"] == "00fac711"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_refresh_force_skips_cache(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    result_cache: ResultCache,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> None:
+    await result_cache.store(refresh_result)
+    collect = mocker.patch.object(
+        feature_manager, "collect", return_value=refresh_result
+    )
+    store = mocker.spy(result_cache, "store")
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh(cache=result_cache, force=True)
+
+    collect.assert_called_once()
+    store.assert_called_once_with(refresh_result)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_refresh_dataset_failure_not_cached(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    command_mocker: CommandMocker,
+    result_cache: ResultCache,
+    mocker: MockerFixture,
+) -> None:
+    command_mocker.mock(zpool._zfs_cmd, exit_code=1)
+    collect = mocker.spy(feature_manager, "collect")
+    store = mocker.spy(result_cache, "store")
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh(cache=result_cache)
+
+    result = collect.spy_return
+    assert result.failed_datasets == {"rpool"}
+    assert not result.complete
+    store.assert_not_called()
+    assert await result_cache.load() is None
@@ -1,15 +1,21 @@
 import asyncio
+import os
+import signal
+from datetime import UTC, datetime
+from pathlib import Path
 from typing import Any
-from unittest.mock import MagicMock
+from unittest.mock import ANY, MagicMock
 
 import pytest
 import yaml
 from pytest import MonkeyPatch, TempPathFactory
 from pytest_mock import MockerFixture
 
+from zfs_feature_discovery.cache import config_hash
 from zfs_feature_discovery.cli import main, run
 from zfs_feature_discovery.config import Config
-from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.features import FeatureFileState, FeatureManager
+from zfs_feature_discovery.state import StateStore
 
 
 @pytest.mark.usefixtures("mock_default_config")
@@ -51,6 +57,61 @@ async def test_cli_sleep_interval(mock_feature_manager: MagicMock) -> None:
     assert mock_feature_manager.refresh.call_count == 3
 
 
+@pytest.mark.usefixtures("mock_default_config")
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "config_defaults", [{"zpools": {"pool1": []}, "shutdown_timeout": 0.1}]
+)
+@pytest.mark.parametrize(
+    ("refresh_time", "cancelled"), [(0.05, False), (10, True)], ids=["finish", "cancel"]
+)
+async def test_cli_stop_signal(
+    mock_feature_manager: MagicMock, refresh_time: float, cancelled: bool
+) -> None:
+    started = asyncio.Event()
+    finished = False
+
+    async def refresh() -> None:
+        nonlocal finished
+        started.set()
+        await asyncio.sleep(refresh_time)
+        finished = True
+
+    mock_feature_manager.refresh.side_effect = refresh
+
+    async def terminate() -> None:
+        await started.wait()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    async with asyncio.timeout(1):
+        await asyncio.gather(run(sleep_interval=60), terminate())
+
+    assert mock_feature_manager.refresh.call_count == 1
+    assert finished != cancelled
+
+
+@pytest.mark.asyncio
+async def test_cli_state(
+    mock_feature_manager: MagicMock, mocker: MockerFixture, tmp_path: Path
+) -> None:
+    state_path = tmp_path / "state.json"
+    config = Config.model_validate({"zpools": {"pool1": []}, "state_path": state_path})
+    mocker.patch("zfs_feature_discovery.cli.default_config", return_value=config)
+    files = {"zpool.pool1": FeatureFileState(expiry=datetime.now(UTC), labels={})}
+    mock_feature_manager.file_states.return_value = files
+
+    async def refresh() -> None:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    mock_feature_manager.refresh.side_effect = refresh
+
+    async with asyncio.timeout(1):
+        await run(sleep_interval=60)
+
+    mock_feature_manager.restore.assert_called_once_with({})
+    assert await StateStore(state_path, key=config_hash(config)).load() == files
+
+
 @pytest.mark.usefixtures("mock_default_config")
 @pytest.mark.asyncio
 async def test_cli_oneshot(mock_feature_manager: MagicMock) -> None:
@@ -58,3 +119,16 @@ async def test_cli_oneshot(mock_feature_manager: MagicMock) -> None:
         await run(oneshot=True)
 
     assert mock_feature_manager.refresh.call_count == 1
+
+
+@pytest.mark.usefixtures("mock_default_config")
+@pytest.mark.parametrize(
+    "config_defaults",
+    [{"zpools": {"pool1": []}, "cache_path": "/tmp/zfs-feature-discovery.json"}],
+)
+def test_cli_oneshot_force(mock_feature_manager: MagicMock) -> None:
+    main(["--oneshot", "--force"])
+
+    mock_feature_manager.refresh.assert_called_once_with(cache=ANY, force=True)
+    cache = mock_feature_manager.refresh.call_args.kwargs["cache"]
+    assert str(cache.path) == "/tmp/zfs-feature-discovery.json"
@@ -0,0 +1,206 @@
+"""
+Stress tests of overlapping refreshes, health updates and other writers sharing the
+feature directory
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+from dataclasses import replace
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from pytest import TempPathFactory
+from pytest_mock import MockerFixture
+
+from zfs_feature_discovery.features import (
+    FILE_HEADER,
+    FeatureManager,
+    RefreshContext,
+    RefreshResult,
+)
+from zfs_feature_discovery.zfs_props import ZfsProperty
+from zfs_feature_discovery.zpool import ZpoolManager
+
+REFRESHES = 2000
+# Refreshes and health updates in flight at once
+OVERLAP = 16
+EXTERNAL_WRITERS = 4
+HEALTH_VALUES = ["ONLINE", "DEGRADED", "FAULTED"]
+# Seconds between iterations of the directory watcher and external writers
+PACE = 0.001
+
+
+@pytest.fixture
+def tmpfs_dir(tmp_path_factory: TempPathFactory) -> Iterator[Path]:
+    # Fast enough for writes to overlap on every refresh, like a busy node
+    shm = Path("/dev/shm")
+    if not (shm.is_dir() and os.access(shm, os.W_OK)):
+        yield tmp_path_factory.mktemp("features-")
+        return
+
+    with tempfile.TemporaryDirectory(dir=shm, prefix="zfs-feature-discovery-") as tmp:
+        yield Path(tmp)
+
+
+def read_labels(path: Path) -> dict[str, str]:
+    lines = path.read_text().splitlines()
+    return dict(
+        line.split("=", 1) for line in lines if line and not line.startswith("#")
+    )
+
+
+class ExternalWriter:
+    """
+    Another NFD source, atomically replacing its own files over and over: one with
+    our prefix but not our header, and one without
+    """
+
+    def __init__(self, feature_dir: Path, index: int) -> None:
+        self.feature_dir = feature_dir
+        self.paths = [
+            feature_dir / f"zfs-external-{index}",
+            feature_dir / f"external-{index}",
+        ]
+        self.writes = 0
+
+    def write(self, path: Path) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.feature_dir, prefix=".external-")
+        with os.fdopen(fd, "w") as f:
+            f.write(f"external={self.writes}\n")
+        os.rename(tmp_name, path)
+        self.writes += 1
+
+    async def run(self, stop: asyncio.Event) -> None:
+        # Racing with our writes, which run in threads
+        while not stop.is_set():
+            for path in self.paths:
+                self.write(path)
+            await asyncio.sleep(PACE)
+
+
+async def watch(feature_dir: Path, live: set[str], stop: asyncio.Event) -> int:
+    """
+    List the feature directory until stopped, failing as soon as a live file is
+    missing. Returns how many times it was listed.
+    """
+
+    listings = 0
+    while not stop.is_set():
+        names = set(os.listdir(feature_dir))
+        assert live <= names, f"Deleted live files: {live - names}"
+        listings += 1
+        await asyncio.sleep(PACE)
+
+    return listings
+
+
+@pytest.fixture
+def stress_manager(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    tmpfs_dir: Path,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> FeatureManager:
+    feature_manager.feature_dir = tmpfs_dir
+    feature_manager.register_zpool(zpool)
+    # Rewrite every file on every refresh
+    feature_manager.ttl_renew_threshold = feature_manager.ttl + 1
+    rng = random.Random(0)
+
+    async def collect(_: RefreshContext) -> RefreshResult:
+        await asyncio.sleep(0)
+        health = rng.choice(HEALTH_VALUES)
+        zpool_props = dict(refresh_result.zpool_props["rpool"] or {})
+        zpool_props["health"] = ZfsProperty("rpool", "health", health, None)
+        return replace(refresh_result, zpool_props={"rpool": zpool_props})
+
+    mocker.patch.object(feature_manager, "collect", side_effect=collect)
+    return feature_manager
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_stress_overlapping_refreshes(stress_manager: FeatureManager) -> None:
+    fm = stress_manager
+    feature_dir = fm.feature_dir
+    await fm.refresh()
+    live = set(os.listdir(feature_dir))
+    assert live == {"zfs-global", "zfs-zpool.rpool", "zfs-datasets.rpool"}
+
+    writers = [ExternalWriter(feature_dir, i) for i in range(EXTERNAL_WRITERS)]
+    for writer in writers:
+        for path in writer.paths:
+            writer.write(path)
+            live.add(path.name)
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch(feature_dir, live, stop))
+    external = [asyncio.create_task(writer.run(stop)) for writer in writers]
+
+    rng = random.Random(1)
+    overlap = asyncio.Semaphore(OVERLAP)
+
+    async def one(i: int) -> None:
+        async with overlap:
+            if i % 4 == 0:
+                await fm.update_zpool_health("rpool", rng.choice(HEALTH_VALUES))
+            else:
+                await fm.refresh()
+
+    try:
+        await asyncio.gather(*map(one, range(REFRESHES)))
+    finally:
+        stop.set()
+        await asyncio.gather(*external)
+
+    assert await watcher > 0
+    assert all(writer.writes > 2 for writer in writers)
+    assert fm.files_written >= REFRESHES
+
+    # No temporary files left, ours or anyone else's
+    names = set(os.listdir(feature_dir))
+    assert names == live
+    assert not fm._temp_files
+
+    # What we recorded is what the files hold
+    for name, state in fm.file_states().items():
+        path = fm.feature_path(name)
+        assert path.read_text().startswith(FILE_HEADER)
+        assert read_labels(path) == state.labels
+
+    # Other sources' files are left alone, even with our prefix
+    for writer in writers:
+        for path in writer.paths:
+            assert list(read_labels(path)) == ["external"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_stress_cancelled_refreshes(stress_manager: FeatureManager) -> None:
+    fm = stress_manager
+    feature_dir = fm.feature_dir
+    await fm.refresh()
+    live = set(os.listdir(feature_dir))
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch(feature_dir, live, stop))
+    rng = random.Random(2)
+
+    for _ in range(REFRESHES // OVERLAP):
+        tasks = [asyncio.create_task(fm.refresh()) for _ in range(OVERLAP)]
+        # Cancel at arbitrary points, such as in the middle of writing a file
+        for _ in range(rng.randrange(1, 10)):
+            await asyncio.sleep(0)
+        for task in rng.sample(tasks, OVERLAP // 2):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    stop.set()
+    await watcher
+
+    assert set(os.listdir(feature_dir)) == live
+    assert not fm._temp_files
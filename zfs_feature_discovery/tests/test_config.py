@@ -8,6 +8,7 @@ from zfs_feature_discovery.config import (
     ZFS_DATASET_DEFAULT_PROPS,
     ZPOOL_DEFAULT_PROPS,
     Config,
+    DerivedLabel,
     LabelConfig,
 )
 
@@ -56,6 +57,36 @@ def test_config_zfs_dataset_props(
     assert set(config.zfs_dataset_props) == set(result)
 
 
+@pytest.mark.parametrize(
+    "env_value,result",
+    [
+        (None, []),
+        ("local", ["local"]),
+        ("local,received,none", ["local", "received", "none"]),
+    ],
+)
+def test_config_sources(
+    monkeypatch: MonkeyPatch,
+    config_defaults: dict[str, Any],
+    env_value: str,
+    result: list[str],
+) -> None:
+    if env_value is not None:
+        monkeypatch.setenv("ZFS_FEATURE_DISCOVERY_ZFS_DATASET_SOURCES", env_value)
+
+    config = Config.model_validate(config_defaults)
+    assert set(config.zfs_dataset_sources) == set(result)
+
+
+def test_config_sources_reject(
+    monkeypatch: MonkeyPatch, config_defaults: dict[str, Any]
+) -> None:
+    monkeypatch.setenv("ZFS_FEATURE_DISCOVERY_ZPOOL_SOURCES", "local,inherited from")
+
+    with pytest.raises(ValidationError):
+        Config.model_validate(config_defaults)
+
+
 @pytest.mark.parametrize("namespace", ["test.danielkza.io"])
 def test_config_validate_label_namespace_accept(namespace: str) -> None:
     LabelConfig(namespace=namespace)
@@ -123,3 +154,29 @@ def test_config_validate_label_zfs_dataset_format_accept(fmt: str) -> None:
 def test_config_validate_label_zfs_dataset_format_reject(fmt: str) -> None:
     with pytest.raises(ValidationError):
         LabelConfig(zfs_dataset_format=fmt)
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"name": "capacity-bucket", "property": "capacity", "bucket": 10},
+        {"name": "free-gib", "property": "free", "unit": "GiB", "min": 100},
+    ],
+)
+def test_config_derived_label_accept(rule: dict[str, Any]) -> None:
+    DerivedLabel.model_validate(rule)
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"name": "capacity", "property": "capacity"},  # no expression
+        {"name": "capacity", "property": "capacity", "bucket": 10, "min": 80},
+        {"name": "capacity", "property": "capacity", "bucket": 0},
+        {"name": "capacity", "property": "capacity", "bucket": 10, "unit": "GB"},
+        {"name": "cap/bucket", "property": "capacity", "bucket": 10},
+    ],
+)
+def test_config_derived_label_reject(rule: dict[str, Any]) -> None:
+    with pytest.raises(ValidationError):
+        DerivedLabel.model_validate(rule)
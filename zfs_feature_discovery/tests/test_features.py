@@ -1,23 +1,37 @@
+import asyncio
+import dataclasses
+import logging
+import os
 import stat
+import time
 from datetime import UTC, datetime
-from typing import AsyncIterator
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+from unittest.mock import AsyncMock
 
 import aiofiles
 import aiofiles.os
 import pytest
-import pytest_asyncio
-from pytest import TempPathFactory
-
-from zfs_feature_discovery.features import FeatureManager
-from zfs_feature_discovery.zfs_globals import ZfsGlobals
+from pytest_mock import MockerFixture
+
+from zfs_feature_discovery.config import Config, DerivedLabel
+from zfs_feature_discovery.derived import derive_value
+from zfs_feature_discovery.features import (
+    FILE_HEADER,
+    STALE_TEMP_AGE,
+    FeatureManager,
+    RefreshResult,
+    property_tiers,
+)
+from zfs_feature_discovery.zfs_globals import ZfsGlobals, ZfsVersion
+from zfs_feature_discovery.zfs_props import ZfsProperty
 from zfs_feature_discovery.zpool import ZpoolManager
 
-from .conftest import CommandMocker, read_all_labels
+from .conftest import CommandMocker, read_all_labels, read_labels_file
 
 
-@pytest.fixture
-def reference_time() -> datetime:
-    return datetime(2024, 2, 7, 10, 42, 8, 52969, tzinfo=UTC)
+async def read_feature_file(fm: FeatureManager, name: str) -> dict[str, str]:
+    return {k: v async for k, v in read_labels_file(fm.feature_path(name))}
 
 
 @pytest.fixture
@@ -30,39 +44,18 @@ def expiry_time_s() -> str:
     return "2024-02-07T11:42:08.052969Z"
 
 
-@pytest_asyncio.fixture
-async def feature_manager(
-    tmp_path_factory: TempPathFactory,
-    zpool_test_props: frozenset[str],
-    zfs_dataset_test_props: frozenset[str],
-    zfs_globals: ZfsGlobals,
-    reference_time: datetime,
-) -> AsyncIterator[FeatureManager]:
-    fm = FeatureManager(
-        feature_dir=tmp_path_factory.mktemp("features-"),
-        zpool_props=zpool_test_props,
-        zfs_dataset_props=zfs_dataset_test_props,
-        label_namespace="me.danielkza.io",
-        zpool_label_format="zpool.{pool_name}.{property_name}",
-        zfs_dataset_label_format="zfs.{pool_name}.{dataset_name}.{property_name}",
-        global_label_format="zfs-global.{property_name}",
-        zfs_globals=zfs_globals,
-    )
-    async with fm:
-        async with fm.with_reference_time(reference_time):
-            yield fm
-
-
 @pytest.mark.asyncio
 @pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
 async def test_zpool_write_features(
     feature_manager: FeatureManager, zpool: ZpoolManager
 ) -> None:
     feature_manager.register_zpool(zpool)
-    await feature_manager.refresh_all_zpools()
+    await feature_manager.refresh()
 
-    all_labels = await read_all_labels(feature_manager.feature_dir)
-    assert all_labels == {
+    labels = await read_feature_file(feature_manager, "zpool.rpool")
+    assert labels == {
         "me.danielkza.io/zpool.rpool.readonly": "off",
         "me.danielkza.io/zpool.rpool.size": "944892805120",
         "me.danielkza.io/zpool.rpool.health": "ONLINE",
@@ -72,15 +65,92 @@ async def test_zpool_write_features(
 
 
 @pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
 @pytest.mark.usefixtures("mock_zfs_dataset_properties")
-async def test_zfs_dataset_write_features(
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_derived_labels(
     feature_manager: FeatureManager, zpool: ZpoolManager
 ) -> None:
+    feature_manager.zpool_derived_labels = [
+        DerivedLabel(name="size-tib", property="size", unit="TiB", bucket=0.5),
+        DerivedLabel(name="big", property="size", unit="GiB", min=500),
+        DerivedLabel(name="missing", property="nonexistent", bucket=10),
+    ]
+    feature_manager.zfs_dataset_derived_labels = [
+        DerivedLabel(name="large-records", property="recordsize", min=1048576),
+    ]
     feature_manager.register_zpool(zpool)
-    await feature_manager.refresh_zpool_datasets(zpool)
+    await feature_manager.refresh()
 
     all_labels = await read_all_labels(feature_manager.feature_dir)
-    assert all_labels == {
+    assert all_labels["me.danielkza.io/zpool.rpool.size-tib"] == "0.5"
+    assert all_labels["me.danielkza.io/zpool.rpool.big"] == "true"
+    assert all_labels["me.danielkza.io/zpool.rpool.missing"] == ""
+    assert all_labels["me.danielkza.io/zfs.rpool.test1.large-records"] == "false"
+    assert all_labels["me.danielkza.io/zfs.rpool.zvol1.large-records"] == ""
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_source_filtering(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.zpool_sources = frozenset(["local"])
+    feature_manager.zfs_dataset_sources = frozenset(["local", "none"])
+    feature_manager.zfs_dataset_collapse_defaults = True
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    zpool_labels = await read_feature_file(feature_manager, "zpool.rpool")
+    assert zpool_labels == {
+        "me.danielkza.io/zpool.rpool.feature_async_destroy": "enabled",
+    }
+    dataset_labels = await read_feature_file(feature_manager, "datasets.rpool")
+    assert dataset_labels == {
+        "me.danielkza.io/zfs.rpool.test1.type": "filesystem",
+        "me.danielkza.io/zfs.rpool.test1.guid": "2574342567579829017",
+        "me.danielkza.io/zfs.rpool.test1.defaults": "2",
+        "me.danielkza.io/zfs.rpool.test_test2.type": "filesystem",
+        "me.danielkza.io/zfs.rpool.test_test2.guid": "2574342567579829017",
+        "me.danielkza.io/zfs.rpool.test_test2.defaults": "2",
+        "me.danielkza.io/zfs.rpool.zvol1.type": "volume",
+        "me.danielkza.io/zfs.rpool.zvol1.guid": "2814323311404247512",
+        "me.danielkza.io/zfs.rpool.zvol1.volsize": "10737418240",
+        "me.danielkza.io/zfs.rpool.zvol1.defaults": "2",
+    }
+
+
+@pytest.mark.parametrize(
+    "value,kwargs,result",
+    [
+        ("37", {"bucket": 10}, "30"),
+        ("40", {"bucket": 10}, "40"),
+        ("3221225472", {"unit": "GiB", "bucket": 2}, "2"),
+        ("80", {"min": 80}, "true"),
+        ("79", {"min": 80}, "false"),
+        ("-", {"min": 80}, ""),
+        ("inf", {"bucket": 10}, ""),
+    ],
+)
+def test_derive_value(value: str, kwargs: dict[str, Any], result: str) -> None:
+    prop = ZfsProperty("rpool", "capacity", value, None)
+    assert derive_value(prop, **kwargs) == result
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_zfs_dataset_write_features(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    labels = await read_feature_file(feature_manager, "datasets.rpool")
+    assert labels == {
         "me.danielkza.io/zfs.rpool.test1.readonly": "off",
         "me.danielkza.io/zfs.rpool.test1.volsize": "",
         "me.danielkza.io/zfs.rpool.test1.volblocksize": "",
@@ -102,17 +172,59 @@ async def test_zfs_dataset_write_features(
     }
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+async def test_zfs_dataset_write_features_yields(
+    mocker: MockerFixture, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    ds_props = await zpool.dataset_properties()
+    await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+    labels = await read_all_labels(feature_manager.feature_dir)
+
+    # 6 labels per dataset
+    feature_manager.yield_rows = 5
+    sleep = mocker.spy(asyncio, "sleep")
+    await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+
+    assert [c.args for c in sleep.call_args_list] == [(0,)] * 3
+    assert await read_all_labels(feature_manager.feature_dir) == labels
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_zfs_dataset_grouped_labels(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.zfs_dataset_grouped_props = frozenset(["readonly", "type"])
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    all_labels = await read_feature_file(feature_manager, "datasets.rpool")
+    # Shared by all datasets, so only the summary is left
+    assert all_labels["me.danielkza.io/zfs.rpool._all.readonly"] == "off"
+    assert not any(key.endswith(".readonly") for key in all_labels if "_all" not in key)
+    # Differs, so kept for each dataset
+    assert all_labels["me.danielkza.io/zfs.rpool._all.type"] == "mixed"
+    assert all_labels["me.danielkza.io/zfs.rpool.zvol1.type"] == "volume"
+    assert len(all_labels) == 18 - 3 + 1 + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
 @pytest.mark.parametrize("zpool_datasets", [[]])
 async def test_zpool_no_datasets_write_features(
     feature_manager: FeatureManager, zpool: ZpoolManager
 ) -> None:
     feature_manager.register_zpool(zpool)
-    await feature_manager.refresh_all_zpools()
+    await feature_manager.refresh()
 
-    all_labels = await read_all_labels(feature_manager.feature_dir)
-    assert all_labels == {
+    assert await read_feature_file(feature_manager, "datasets.rpool") == {}
+    labels = await read_feature_file(feature_manager, "zpool.rpool")
+    assert labels == {
         "me.danielkza.io/zpool.rpool.readonly": "off",
         "me.danielkza.io/zpool.rpool.size": "944892805120",
         "me.danielkza.io/zpool.rpool.health": "ONLINE",
@@ -160,6 +272,118 @@ rubbish=rubbish
     }
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+@pytest.mark.parametrize("zpool_datasets", [[]])
+async def test_features_cleanup_temp_files(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_dir = feature_manager.feature_dir
+    stale = feature_dir / f"{feature_manager.temp_prefix}stale"
+    stale.write_text("")
+    stale_time = time.time() - STALE_TEMP_AGE - 1
+    os.utime(stale, (stale_time, stale_time))
+    # Possibly still being written by another daemon
+    recent = feature_dir / f"{feature_manager.temp_prefix}recent"
+    recent.write_text("")
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    assert not stale.exists()
+    assert recent.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+@pytest.mark.parametrize("zpool_datasets", [[]])
+async def test_features_cleanup_ownership(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_dir = feature_manager.feature_dir
+    # Another NFD source sharing our prefix
+    foreign = feature_dir / "zfs-other"
+    foreign.write_text("other=label\n")
+    # Written before names were prefixed
+    legacy = [feature_dir / "zpool.rpool", feature_dir / "zfs.rpool"]
+    # Written when the global and dataset file names repeated the prefix
+    legacy += [feature_dir / "zfs-zfs-global", feature_dir / "zfs-zfs.rpool"]
+    for path in legacy:
+        path.write_text(f"{FILE_HEADER}legacy=label\n")
+    unrelated = feature_dir / "zpool.other"
+    unrelated.write_text(f"{FILE_HEADER}other=label\n")
+
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    assert foreign.exists()
+    assert not any(path.exists() for path in legacy)
+    assert unrelated.exists()
+    assert {path.name for path in feature_dir.iterdir()} == {
+        "zfs-other",
+        "zpool.other",
+        "zfs-global",
+        "zfs-zpool.rpool",
+        "zfs-datasets.rpool",
+    }
+
+
+@pytest.mark.asyncio
+async def test_features_remove_owned_replaced(
+    feature_manager: FeatureManager, mocker: MockerFixture
+) -> None:
+    path = feature_manager.feature_dir / "zfs-test"
+    path.write_text(f"{FILE_HEADER}a=b\n")
+    assert await feature_manager.remove_owned(str(path))
+    assert not list(feature_manager.feature_dir.iterdir())
+
+    # Replaced by another writer between the first check and moving it away
+    path.write_text("c=d\n")
+    mocker.patch.object(feature_manager, "is_owned", side_effect=[True, False])
+    assert not await feature_manager.remove_owned(str(path))
+    assert path.read_text() == "c=d\n"
+    assert list(feature_manager.feature_dir.iterdir()) == [path]
+
+
+@pytest.mark.asyncio
+async def test_features_interrupted_write(
+    feature_manager: FeatureManager,
+) -> None:
+    started = asyncio.Event()
+
+    async def content() -> AsyncIterator[str]:
+        yield "a=b\n"
+        started.set()
+        await asyncio.Event().wait()
+
+    task = asyncio.create_task(feature_manager.write_feature_file("test", content()))
+    await started.wait()
+    assert len(feature_manager._temp_files) == 1
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert not feature_manager._temp_files
+    assert not list(feature_manager.feature_dir.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_features_exit_removes_temp_files(
+    feature_manager: FeatureManager,
+) -> None:
+    # As if a write was still in flight when exiting
+    tmp_file = feature_manager.feature_dir / f"{feature_manager.temp_prefix}test"
+    tmp_file.write_text("")
+    feature_manager._temp_files.add(str(tmp_file))
+
+    await feature_manager.__aexit__(None, None, None)
+
+    assert not tmp_file.exists()
+    assert not feature_manager._temp_files
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures("mock_zpool_properties")
 @pytest.mark.usefixtures("mock_zfs_global_properties")
@@ -205,6 +429,58 @@ async def test_features_expiry(
     assert found, "FeatureManager should generate files"
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_features_expiry_renewal(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch.object(feature_manager, "collect", return_value=refresh_result)
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+    assert feature_manager.files_written == 3
+
+    # Unchanged, and not about to expire
+    await feature_manager.refresh()
+    assert feature_manager.files_written == 3
+    assert feature_manager.files_skipped == 3
+
+    # Changed labels are always written
+    zpool_props = dict(refresh_result.zpool_props["rpool"] or {})
+    zpool_props["health"] = zpool_props["health"]._replace(value="DEGRADED")
+    refresh_result.zpool_props["rpool"] = zpool_props
+    await feature_manager.refresh()
+    assert feature_manager.files_written == 4
+
+    # Every file is renewed when the threshold covers the whole TTL
+    feature_manager.ttl_renew_threshold = feature_manager.ttl + 1
+    await feature_manager.refresh()
+    assert feature_manager.files_written == 7
+
+
+def test_features_ttl_from_config() -> None:
+    config = Config.model_validate(
+        {"zpools": {"rpool": []}, "ttl": 600, "ttl_renew_threshold": 300}
+    )
+    fm = FeatureManager.from_config(config)
+    assert fm.ttl == 600 and fm.ttl_renew_threshold == 300
+
+    # Half the TTL by default
+    config = Config.model_validate({"zpools": {"rpool": []}, "ttl": 600})
+    assert FeatureManager.from_config(config).ttl_renew_threshold == 300
+
+
+def test_features_retain_dataset_props_from_config() -> None:
+    # Only kept for the query API
+    config = Config.model_validate({"zpools": {"rpool": []}})
+    assert not FeatureManager.from_config(config).retain_dataset_props
+
+    config = Config.model_validate({"zpools": {"rpool": []}, "api_port": 0})
+    assert FeatureManager.from_config(config).retain_dataset_props
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("zpool_datasets", [[]])
 async def test_zfs_missing(
@@ -249,7 +525,319 @@ async def test_get_expiry_reference_time(
     assert feature_manager.get_expiry() == expiry_time
 
 
+@pytest.mark.asyncio
+async def test_refresh_context(
+    feature_manager: FeatureManager, zpool: ZpoolManager, expiry_time_s: str
+) -> None:
+    feature_manager.register_zpool(zpool)
+    async with feature_manager.refresh_context() as ctx:
+        assert ctx.zpools == [zpool]
+        assert ctx.expiry == expiry_time_s
+        assert ctx.plan is feature_manager.plan
+        assert list(ctx.plan.pools) == ["rpool"]
+
+    assert feature_manager._context is None
+
+
+@pytest.mark.asyncio
+async def test_refresh_context_overlapping(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    entered = asyncio.Event()
+    exited = asyncio.Event()
+
+    async def short() -> None:
+        async with feature_manager.refresh_context() as ctx:
+            entered.set()
+            assert feature_manager._context is ctx
+        exited.set()
+
+    async def long() -> None:
+        await entered.wait()
+        async with feature_manager.refresh_context() as ctx:
+            await exited.wait()
+            # Not reset by the other one exiting
+            assert feature_manager._context is ctx
+            assert feature_manager.now == ctx.now
+
+    await asyncio.gather(short(), long())
+    assert feature_manager._context is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+@pytest.mark.parametrize(
+    "zfs_version_output,output_format",
+    [
+        (b"zfs-2.2.2-1\nzfs-kmod-2.2.2-1\n", "text"),
+        (b"zfs-2.3.0-1\nzfs-kmod-2.3.0-1\n", "json"),
+    ],
+)
+@pytest.mark.parametrize("zpool_datasets", [[]])
+async def test_detect_output_format(
+    mocker: MockerFixture,
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    output_format: str,
+) -> None:
+    feature_manager.output_format = "auto"
+    feature_manager._output_format = None
+    feature_manager.register_zpool(zpool)
+
+    # The format is already picked when the first commands run
+    formats = []
+
+    async def get_properties() -> dict[str, ZfsProperty]:
+        formats.append(zpool.output_format)
+        return {}
+
+    mocker.patch.object(zpool, "get_properties", side_effect=get_properties)
+
+    await feature_manager.collect()
+    assert formats == [output_format]
+
+
 def test_format_expiry(
     feature_manager: FeatureManager, expiry_time: datetime, expiry_time_s: str
 ) -> None:
     assert feature_manager.format_expiry(expiry_time) == expiry_time_s
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_refresh_label_diff(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    caplog: pytest.LogCaptureFixture,
+    mocker: MockerFixture,
+) -> None:
+    caplog.set_level(logging.INFO, logger="zfs_feature_discovery")
+    feature_manager.register_zpool(zpool)
+
+    await feature_manager.refresh()
+    assert feature_manager.changed_labels_total == 0
+    assert "Wrote initial" in caplog.text
+    assert "Refreshing features for dataset" not in caplog.text
+
+    result = feature_manager.last_result
+    assert result
+    caplog.clear()
+
+    # Same result: nothing logged at INFO
+    mocker.patch.object(feature_manager, "collect", AsyncMock(return_value=result))
+    await feature_manager.refresh()
+    assert feature_manager.last_diff is not None
+    assert len(feature_manager.last_diff) == 0
+    assert caplog.messages == []
+
+    changed = dataclasses.replace(
+        result,
+        zfs_version=ZfsVersion(main="2.2.3-1", kernel="2.2.2-1"),
+        dataset_props={
+            "rpool": {"rpool/test1": result.dataset_props["rpool"]["rpool/test1"]}
+        },
+    )
+    mocker.patch.object(feature_manager, "collect", AsyncMock(return_value=changed))
+    await feature_manager.refresh()
+
+    diff = feature_manager.last_diff
+    assert diff
+    ns = "me.danielkza.io"
+    assert diff.changed == {f"{ns}/zfs-global.ver": ("2.2.2-1", "2.2.3-1")}
+    assert diff.added == {}
+    assert f"{ns}/zfs.rpool.zvol1.type" in diff.removed
+    assert feature_manager.changed_labels_total == len(diff)
+    assert "Labels changed: 0 added, 12 removed, 1 changed" in caplog.messages
+    assert f"~ {ns}/zfs-global.ver=2.2.2-1 -> 2.2.3-1" in caplog.messages
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_refresh_retained_result(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    zpool_test_props: frozenset[str],
+    zfs_dataset_test_props: frozenset[str],
+    mocker: MockerFixture,
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    # Only the labeled properties are kept
+    result = feature_manager.last_result
+    assert result
+    zpool_props = result.zpool_props["rpool"]
+    assert zpool_props
+    assert set(zpool_props) == zpool_test_props
+    for props in result.dataset_props["rpool"].values():
+        assert set(props) <= zfs_dataset_test_props
+    assert "volblocksize" in result.dataset_props["rpool"]["rpool/zvol1"]
+
+    feature_manager.retain_dataset_props = False
+    labels = feature_manager.labels
+    mocker.patch.object(feature_manager, "collect", AsyncMock(return_value=result))
+    await feature_manager.refresh()
+
+    result = feature_manager.last_result
+    assert result
+    assert result.zpool_props["rpool"] == zpool_props
+    assert result.dataset_props == {}
+    assert feature_manager.labels == labels
+
+
+def test_property_tiers() -> None:
+    props = frozenset(["guid", "health", "size"])
+    assert property_tiers(props, frozenset(["guid", "other"]), False) == (
+        frozenset(["health", "size"]),
+        frozenset(["guid"]),
+    )
+    # Nothing left to request by name in the regular tier
+    assert property_tiers(props, props, False) == (None, None)
+    assert property_tiers(props, frozenset(), True) == (props, None)
+
+
+def tiered_zpool(zpool_datasets: list[str]) -> ZpoolManager:
+    return ZpoolManager(
+        pool_name="rpool",
+        zpool_command=Path("/zpool_test"),
+        zfs_command=Path("/zfs_test"),
+        datasets=zpool_datasets,
+        zpool_props=["health"],
+        zfs_dataset_props=["mounted"],
+        zpool_static_props=["guid"],
+        zfs_dataset_static_props=["encryption"],
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_static_tier(
+    mocker: MockerFixture,
+    feature_manager: FeatureManager,
+    zpool_datasets: list[str],
+) -> None:
+    zpool = tiered_zpool(zpool_datasets)
+    feature_manager.register_zpool(zpool)
+    feature_manager.static_props_interval = 60
+    clock = mocker.patch("zfs_feature_discovery.features.time")
+    clock.monotonic.return_value = 1000
+
+    fetched: list[str] = []
+    static_guid: Optional[str] = "123"
+    ds = "rpool/test1"
+    static_datasets: Optional[dict[str, dict[str, ZfsProperty]]] = {
+        ds: {"encryption": ZfsProperty(ds, "encryption", "off", "default")}
+    }
+
+    async def get_properties(static: bool = False) -> Optional[dict[str, ZfsProperty]]:
+        if not static:
+            fetched.append("zpool")
+            return {"health": ZfsProperty("rpool", "health", "ONLINE", None)}
+
+        fetched.append("zpool static")
+        if static_guid is None:
+            return None
+        return {"guid": ZfsProperty("rpool", "guid", static_guid, None)}
+
+    async def get_dataset_properties(
+        static: bool = False,
+    ) -> Optional[dict[str, dict[str, ZfsProperty]]]:
+        if not static:
+            fetched.append("datasets")
+            return {ds: {"mounted": ZfsProperty(ds, "mounted", "yes", None)}}
+
+        fetched.append("datasets static")
+        return static_datasets
+
+    mocker.patch.object(zpool, "get_properties", side_effect=get_properties)
+    mocker.patch.object(
+        zpool, "get_dataset_properties", side_effect=get_dataset_properties
+    )
+
+    async def collect() -> tuple[dict[str, str], dict[str, str]]:
+        fetched.clear()
+        result = await feature_manager.collect()
+        zpool_props = result.zpool_props["rpool"]
+        assert zpool_props is not None
+        ds_props = result.dataset_props["rpool"][ds]
+        return (
+            {name: prop.value for name, prop in zpool_props.items()},
+            {name: prop.value for name, prop in ds_props.items()},
+        )
+
+    # Fetched at startup, along with the regular tier
+    assert await collect() == (
+        {"guid": "123", "health": "ONLINE"},
+        {"encryption": "off", "mounted": "yes"},
+    )
+    assert sorted(fetched) == [
+        "datasets",
+        "datasets static",
+        "zpool",
+        "zpool static",
+    ]
+
+    # Reused until the interval passes
+    static_guid = "456"
+    clock.monotonic.return_value = 1059
+    assert (await collect())[0] == {"guid": "123", "health": "ONLINE"}
+    assert sorted(fetched) == ["datasets", "zpool"]
+
+    clock.monotonic.return_value = 1060
+    assert (await collect())[0] == {"guid": "456", "health": "ONLINE"}
+    assert "zpool static" in fetched
+
+    # Failures keep the previous values, and are retried on the next refresh
+    static_guid = None
+    feature_manager.invalidate_static("rpool")
+    assert (await collect())[0] == {"guid": "456", "health": "ONLINE"}
+    static_guid = "789"
+    assert (await collect())[0] == {"guid": "789", "health": "ONLINE"}
+    assert "zpool static" in fetched
+
+    await collect()
+    assert "zpool static" not in fetched
+
+    # Datasets without static properties from the requested sources are left out of
+    # the output, which still counts as fetched
+    static_datasets = {}
+    feature_manager.invalidate_static("rpool")
+    assert (await collect())[1] == {"mounted": "yes"}
+    assert "datasets static" in fetched
+    await collect()
+    assert "datasets static" not in fetched
+
+    # Only failed commands are retried
+    static_datasets = None
+    feature_manager.invalidate_static("rpool")
+    assert (await collect())[1] == {"mounted": "yes"}
+    await collect()
+    assert "datasets static" in fetched
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [[]])
+async def test_static_tier_health_change(
+    feature_manager: FeatureManager, zpool_datasets: list[str]
+) -> None:
+    zpool = tiered_zpool(zpool_datasets)
+    feature_manager.register_zpool(zpool)
+    feature_manager._static_collected["rpool"] = 0
+    feature_manager.last_result = RefreshResult(
+        zfs_version=ZfsVersion(main="2.2.2-1", kernel="2.2.2-1"),
+        hostid=None,
+        zpool_props={
+            "rpool": {"health": ZfsProperty("rpool", "health", "ONLINE", None)}
+        },
+        dataset_props={},
+    )
+
+    assert not feature_manager.static_due(zpool, 0)
+    assert await feature_manager.update_zpool_health("rpool", "DEGRADED")
+    assert feature_manager.static_due(zpool, 0)
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.health import HealthWatchdog, parse_health
+from zfs_feature_discovery.zpool import ZpoolManager
+
+from .conftest import CommandMocker, read_all_labels
+
+
+def test_parse_health() -> None:
+    assert parse_health("rpool\tONLINE\ntank\tDEGRADED\ngarbage\n") == {
+        "rpool": "ONLINE",
+        "tank": "DEGRADED",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+@pytest.mark.parametrize("zpool_datasets", [[]])
+async def test_health_watchdog(
+    mocker: MockerFixture, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    watchdog = HealthWatchdog(
+        feature_manager, zpool_command=Path("/zpool_test"), interval=1
+    )
+    health_mocker = CommandMocker(mocker)
+    health_mocker.mock(
+        watchdog._cmd,
+        cmd=["/zpool_test", "list", "-H", "-o", "name,health"],
+        stdout=b"rpool\tDEGRADED\nother\tFAULTED\n",
+    )
+
+    # Nothing to compare against before the first refresh
+    assert await watchdog.poll() == 0
+
+    await feature_manager.refresh()
+    files_written = feature_manager.files_written
+
+    assert await watchdog.poll() == 1
+    assert feature_manager.files_written == files_written + 1
+    assert feature_manager.last_diff is not None
+    assert feature_manager.last_diff.changed == {
+        "me.danielkza.io/zpool.rpool.health": ("ONLINE", "DEGRADED")
+    }
+
+    all_labels = await read_all_labels(feature_manager.feature_dir)
+    assert all_labels["me.danielkza.io/zpool.rpool.health"] == "DEGRADED"
+    assert all_labels["me.danielkza.io/zpool.rpool.size"] == "944892805120"
+
+    # Unchanged since the last poll
+    assert await watchdog.poll() == 0
+    assert watchdog.updates == 1
+
+
+@pytest.mark.asyncio
+async def test_health_watchdog_command_failure(
+    feature_manager: FeatureManager, command_mocker: CommandMocker
+) -> None:
+    watchdog = HealthWatchdog(
+        feature_manager, zpool_command=Path("/zpool_test"), interval=1
+    )
+    command_mocker.mock(watchdog._cmd, exit_code=1)
+
+    assert await watchdog.poll() == 0
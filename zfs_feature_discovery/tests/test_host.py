@@ -0,0 +1,120 @@
+import asyncio
+import os
+import signal
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from pytest import TempPathFactory
+
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+from .test_process import wait_for_exit
+
+# Entering a root needs to be able to chroot. The fake host is the current root.
+pytestmark = pytest.mark.skipif(os.geteuid() != 0, reason="chroot needs root")
+
+
+@pytest_asyncio.fixture
+async def host() -> AsyncIterator[HostNamespace]:
+    async with HostNamespace(root=Path("/")) as host:
+        yield host
+
+
+def sh(host: HostNamespace, script: str) -> CommandHarness:
+    return CommandHarness("/bin/sh", "-c", script, host=host)
+
+
+@pytest.mark.asyncio
+async def test_host_runs_commands(host: HostNamespace) -> None:
+    assert await sh(host, "pwd; echo error >&2").check_output() == "/\n"
+
+    async with sh(host, "exit 3").run() as proc:
+        assert await proc.wait() == 3
+
+    # Searched for in PATH, as with exec
+    assert await CommandHarness("echo", "hi", host=host).check_output() == "hi\n"
+
+
+@pytest.mark.asyncio
+async def test_host_concurrent_commands(host: HostNamespace) -> None:
+    outputs = await asyncio.gather(
+        *(sh(host, f"sleep 0.0{i % 3}; echo {i}").check_output() for i in range(20))
+    )
+    assert outputs == [f"{i}\n" for i in range(20)]
+
+
+@pytest.mark.asyncio
+async def test_host_resolves_commands_in_root(
+    tmp_path_factory: TempPathFactory,
+) -> None:
+    # An empty root has no /bin/sh
+    async with HostNamespace(root=tmp_path_factory.mktemp("root")) as host:
+        with pytest.raises(FileNotFoundError):
+            await sh(host, "true").check_output()
+
+        # The helper is still usable
+        with pytest.raises(FileNotFoundError):
+            await sh(host, "true").check_output()
+
+
+@pytest.mark.asyncio
+async def test_host_enter_failure(tmp_path: Path) -> None:
+    host = HostNamespace(root=tmp_path / "missing")
+    with pytest.raises(OSError, match="Failed to enter host"):
+        await sh(host, "true").check_output()
+
+    assert not host.running
+
+
+@pytest.mark.asyncio
+async def test_host_cancel_kills(host: HostNamespace) -> None:
+    started = asyncio.Event()
+    pids: list[int] = []
+
+    async def run() -> None:
+        async with sh(host, "echo started; sleep 60").run() as proc:
+            pids.append(proc.pid)
+            async for _ in proc.line_batches():
+                started.set()
+
+    task = asyncio.create_task(run())
+    async with asyncio.timeout(5):
+        await started.wait()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        async with asyncio.timeout(5):
+            await task
+
+    # Reaped by the helper
+    assert await wait_for_exit(pids[0])
+
+
+@pytest.mark.asyncio
+async def test_host_helper_exit_kills_commands(host: HostNamespace) -> None:
+    async with sh(host, "sleep 60").run() as proc:
+        assert host._helper
+        host._helper.kill()
+
+        async with asyncio.timeout(5):
+            assert await proc.wait() == -signal.SIGKILL
+
+    assert not host.running
+    # Started again on next use
+    assert await sh(host, "echo ok").check_output() == "ok\n"
+
+
+def test_host_from_config() -> None:
+    config = Config.model_validate({"zpools": {"rpool": []}})
+    assert HostNamespace.from_config(config) is None
+
+    config = Config.model_validate({"zpools": {"rpool": ["ds"]}, "host_root": "/host"})
+    fm = FeatureManager.from_config(config)
+    assert fm.host and fm.host.root == Path("/host")
+    assert fm._zfs_globals._hostid_cmd.host is fm.host
+    assert fm._zpools["rpool"]._zfs_cmd.host is fm.host
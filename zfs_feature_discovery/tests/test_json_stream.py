@@ -0,0 +1,58 @@
+import json
+from typing import Any, AsyncIterator, Optional
+
+import pytest
+
+from zfs_feature_discovery.json_stream import JsonObjectStream
+
+DOCUMENT: dict[str, Any] = {
+    "output_version": {"command": "zfs get", "vers_major": 0, "vers_minor": 1},
+    "datasets": {
+        "rpool/a": {"properties": {"used": {"value": "12345"}}},
+        "rpool/b\tc": {"properties": {"comment": {"value": 'tabs\tand "quotes"'}}},
+        "rpool/ç": {"properties": {"size": {"value": 1048576}}},
+    },
+    "trailing": [1, 2, 3],
+}
+
+
+async def chunked(text: str, size: int) -> AsyncIterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i : i + size]
+
+
+async def members(text: str, key: str, size: int) -> list[tuple[str, Any]]:
+    stream = JsonObjectStream(chunked(text, size))
+    return [member async for member in stream.members(key)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+async def test_json_stream_members(size: int, indent: Optional[int]) -> None:
+    text = json.dumps(DOCUMENT, indent=indent, ensure_ascii=False)
+    assert await members(text, "datasets", size) == list(DOCUMENT["datasets"].items())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "text", ['{"datasets": {}}', "{}", '{"other": {"a": 1}}', ' { "datasets" : { } } ']
+)
+async def test_json_stream_empty(text: str) -> None:
+    assert await members(text, "datasets", 3) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        '{"datasets": {"a": 1',
+        '{"datasets": {"a" 1}}',
+        '{"datasets": {"a": 1,}}',
+        "usage: zfs get ...",
+    ],
+)
+async def test_json_stream_invalid(text: str) -> None:
+    with pytest.raises(ValueError):
+        await members(text, "datasets", 3)
@@ -0,0 +1,82 @@
+import pytest
+
+from zfs_feature_discovery.labels import (
+    LABEL_MAX_LENGTH,
+    LABEL_VALUE_PATTERN,
+    diff_labels,
+    normalize_key,
+    normalize_labels,
+    normalize_value,
+)
+
+SHARENFS = "rw=@10.0.0.0/8,no_root_squash,sec=sys,crossmnt,async,insecure,fsid=1"
+
+
+@pytest.mark.parametrize(
+    "value,result",
+    [
+        ("", ""),
+        ("on", "on"),
+        ("2.2.2-1", "2.2.2-1"),
+        ("-", ""),
+        ("_private_", "private"),
+        ("rw=@10.0.0.0/8", "rw_10.0.0.0_8"),
+        ("a" * LABEL_MAX_LENGTH, "a" * LABEL_MAX_LENGTH),
+    ],
+)
+def test_normalize_value(value: str, result: str) -> None:
+    assert normalize_value(value) == result
+
+
+def test_normalize_value_truncate() -> None:
+    value = normalize_value(SHARENFS, "truncate")
+    assert LABEL_VALUE_PATTERN.fullmatch(value)
+    assert value == "rw_10.0.0.0_8_no_root_squash_sec_sys_crossmnt_async_insecure_fs"
+
+
+def test_normalize_value_hash() -> None:
+    value = normalize_value(SHARENFS, "hash")
+    other = normalize_value(SHARENFS.replace("fsid=1", "fsid=2"), "hash")
+
+    assert LABEL_VALUE_PATTERN.fullmatch(value)
+    assert len(value) <= LABEL_MAX_LENGTH
+    assert value.startswith("rw_10.0.0.0_8_no_root_squash")
+    assert value != other
+    assert value[:-10] == other[:-10]
+
+
+def test_normalize_key() -> None:
+    assert normalize_key("example.com/zfs.rpool.test.type") == (
+        "example.com/zfs.rpool.test.type"
+    )
+    assert (
+        normalize_key("example.com/zfs.rpool._test_") == "example.com/zfs.rpool._test"
+    )
+
+    long_name = "zfs.rpool." + "nested_" * 10
+    key = normalize_key(f"example.com/{long_name}type")
+    other = normalize_key(f"example.com/{long_name}guid")
+
+    namespace, name = key.split("/")
+    assert namespace == "example.com"
+    assert len(name) <= LABEL_MAX_LENGTH
+    assert key != other
+
+
+def test_normalize_labels() -> None:
+    labels = normalize_labels([("example.com/a", "-"), ("example.com/b", "on")])
+    assert labels == {"example.com/a": "", "example.com/b": "on"}
+
+
+def test_diff_labels() -> None:
+    old = {"a": "1", "b": "2", "c": "3"}
+    new = {"a": "1", "b": "20", "d": "4"}
+
+    diff = diff_labels(old, new)
+    assert diff.added == {"d": "4"}
+    assert diff.removed == {"c": "3"}
+    assert diff.changed == {"b": ("2", "20")}
+    assert len(diff) == 3
+    assert list(diff.describe()) == ["+ d=4", "- c=3", "~ b=2 -> 20"]
+
+    assert not diff_labels(new, dict(new))
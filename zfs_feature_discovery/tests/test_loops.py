@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from pytest import MonkeyPatch
+
+from zfs_feature_discovery.cli import main
+from zfs_feature_discovery.loops import LoopLagMonitor, loop_factory
+
+
+def test_loop_factory_asyncio() -> None:
+    loop = loop_factory("asyncio")()
+    try:
+        assert isinstance(loop, asyncio.BaseEventLoop)
+    finally:
+        loop.close()
+
+
+def test_loop_factory_uvloop_missing(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    assert loop_factory("auto") is asyncio.new_event_loop
+    with pytest.raises(ImportError, match="uvloop was requested"):
+        loop_factory("uvloop")
+
+
+def test_loop_factory_uvloop() -> None:
+    uvloop = pytest.importorskip("uvloop")
+
+    assert loop_factory("auto") is uvloop.new_event_loop
+    assert loop_factory("uvloop") is uvloop.new_event_loop
+
+
+@pytest.mark.usefixtures("mock_default_config")
+def test_cli_event_loop(mock_feature_manager: MagicMock) -> None:
+    loops = []
+
+    async def refresh(**_: object) -> None:
+        loops.append(asyncio.get_running_loop())
+
+    mock_feature_manager.refresh.side_effect = refresh
+    main(["--oneshot", "--event-loop", "asyncio"])
+
+    assert len(loops) == 1
+    assert type(loops[0]).__module__.startswith("asyncio")
+
+
+def test_loop_lag_stats(caplog: pytest.LogCaptureFixture) -> None:
+    monitor = LoopLagMonitor(window=100, warn_threshold=0.5)
+    assert monitor.stats() == {"max_ms": 0.0, "p99_ms": 0.0, "samples": 0}
+
+    monitor.record(0.6)
+    for i in range(200):
+        monitor.record(i / 1000)
+
+    # The maximum is kept after it leaves the window
+    assert monitor.stats() == {"max_ms": 600.0, "p99_ms": 199.0, "samples": 100}
+    assert "Event loop was blocked for 0.600s" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor() -> None:
+    async with LoopLagMonitor(0.01) as monitor:
+        await asyncio.sleep(0.05)
+        time.sleep(0.1)
+        await asyncio.sleep(0.05)
+
+    assert monitor.max_lag >= 0.05
+    assert len(monitor.samples) >= 2
@@ -0,0 +1,66 @@
+import dataclasses
+
+import pytest
+
+from zfs_feature_discovery.config import DerivedLabel
+from zfs_feature_discovery.plan import LabelTemplate, RuntimePlan, compile_plan
+
+
+@pytest.fixture
+def plan() -> RuntimePlan:
+    return compile_plan(
+        namespace="me.danielkza.io",
+        zpool_format="zpool.{pool_name}.{property_name}",
+        zfs_dataset_format="zfs.{pool_name}.{dataset_name}.{property_name}",
+        global_format="zfs-global.{property_name}",
+        zpool_props=["size", "feature@async_destroy"],
+        zfs_dataset_props=["type"],
+        zpool_derived=[DerivedLabel(name="cap", property="capacity", bucket=10)],
+        zfs_dataset_derived=[],
+        pools={"rpool": ["test/test2"]},
+        zfs_dataset_grouped=["type", "feature@x"],
+    )
+
+
+@pytest.mark.parametrize(
+    "format,key",
+    [
+        ("zpool.{pool_name}.{property_name}", "ns.io/zpool.rpool.size"),
+        ("{property_name}-{pool_name}-{property_name}", "ns.io/size-rpool-size"),
+        ("zpool.{pool_name}", "ns.io/zpool.rpool"),
+    ],
+)
+def test_label_template(format: str, key: str) -> None:
+    template = LabelTemplate.compile("ns.io", format, pool_name="rpool")
+    assert template.key("size") == key
+
+
+def test_compile_plan(plan: RuntimePlan) -> None:
+    assert plan.zpool_props == (
+        ("feature@async_destroy", "feature_async_destroy"),
+        ("size", "size"),
+    )
+    assert plan.zpool_derived[0].label_name == "cap"
+    assert plan.global_label.key("ver") == "me.danielkza.io/zfs-global.ver"
+
+    pool = plan.pools["rpool"]
+    assert pool.zpool_label.key("size") == "me.danielkza.io/zpool.rpool.size"
+    assert plan.dataset_label(pool, "rpool/test/test2").key("type") == (
+        "me.danielkza.io/zfs.rpool.test_test2.type"
+    )
+    # Datasets that were not configured are compiled on the spot
+    assert plan.dataset_label(pool, "rpool/other").key("type") == (
+        "me.danielkza.io/zfs.rpool.other.type"
+    )
+    assert plan.pool("tank").label_name == "tank"
+    assert pool.dataset_summary.key("type") == "me.danielkza.io/zfs.rpool._all.type"
+    assert plan.zfs_dataset_grouped == ("feature_x", "type")
+
+
+def test_plan_immutable(plan: RuntimePlan) -> None:
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        plan.namespace = "other"  # type: ignore[misc]
+    with pytest.raises(TypeError):
+        plan.pools["tank"] = plan.pools["rpool"]  # type: ignore[index]
+
+    assert not hasattr(plan, "__dict__")
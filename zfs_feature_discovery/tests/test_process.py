@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from pytest import MonkeyPatch
+
+from zfs_feature_discovery import process
+from zfs_feature_discovery.process import RateLimiter
+from zfs_feature_discovery.zfs_props import CommandHarness
+
+
+@pytest.fixture(autouse=True)
+def stderr_limiters(monkeypatch: MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(process, "_stderr_limiters", {})
+    yield
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def is_running(pid: int) -> bool:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+
+    # Zombies of processes we don't own are reaped by init, eventually
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+async def wait_for_exit(pid: int) -> bool:
+    # Pipes are closed slightly before a killed process turns into a zombie
+    for _ in range(100):
+        if not is_running(pid):
+            return True
+        await asyncio.sleep(0.01)
+
+    return False
+
+
+async def wait_for_fds(count: int) -> int:
+    # Pipe transports are closed from loop callbacks
+    for _ in range(100):
+        if open_fds() <= count:
+            break
+        await asyncio.sleep(0.01)
+
+    return open_fds()
+
+
+def sh(script: str) -> CommandHarness:
+    return CommandHarness("/bin/sh", "-c", script)
+
+
+@pytest.mark.asyncio
+async def test_process_line_batches() -> None:
+    harness = sh("printf 'a\\tb\\nc\\n'; printf 'd'")
+    async with harness.run() as proc:
+        lines = [line async for batch in proc.line_batches() for line in batch]
+        assert await proc.wait() == 0
+
+    assert lines == ["a\tb", "c", "d"]
+
+
+@pytest.mark.asyncio
+async def test_process_stderr_capped(caplog: pytest.LogCaptureFixture) -> None:
+    harness = sh("head -c 200000 /dev/zero | tr '\\0' x >&2; echo ok; exit 3")
+    async with harness.run() as proc:
+        proc.max_stderr = 1000
+        assert await proc.read_output() == "ok\n"
+        assert await proc.wait() == 3
+
+    assert len(proc.stderr) == 1000
+    assert proc.stderr_dropped == 199000
+    assert "dropped 199000 bytes of stderr" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_process_stderr_rate_limited(caplog: pytest.LogCaptureFixture) -> None:
+    caplog.set_level(logging.WARNING, logger="zfs_feature_discovery.process")
+    harness = sh("for i in $(seq 50); do echo error $i >&2; done; exit 1")
+
+    for _ in range(2):
+        async with harness.run() as proc:
+            await proc.wait()
+
+    errors = [m for m in caplog.messages if m.startswith("/bin/sh: error")]
+    assert len(errors) == 20
+    assert (
+        "/bin/sh: suppressed 30 lines of stderr over the rate limit" in caplog.messages
+    )
+    assert (
+        "/bin/sh: suppressed 50 lines of stderr over the rate limit" in caplog.messages
+    )
+
+
+def test_rate_limiter() -> None:
+    limiter = RateLimiter(rate=1000, burst=2)
+    assert limiter.allow()
+    assert limiter.allow()
+    assert not limiter.allow()
+    assert limiter.suppressed == 1
+
+
+@pytest.mark.asyncio
+async def test_process_cancel_kills_and_reaps() -> None:
+    fds = open_fds()
+    started = asyncio.Event()
+    pids: list[int] = []
+
+    async def run() -> None:
+        # The child spawns a grandchild holding on to the pipes
+        async with sh("sleep 60 & echo $!; wait").run() as proc:
+            pids.append(proc.pid)
+            async for batch in proc.line_batches():
+                pids.extend(map(int, batch))
+                started.set()
+
+    task = asyncio.create_task(run())
+    async with asyncio.timeout(5):
+        await started.wait()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        async with asyncio.timeout(5):
+            await task
+
+    pid, grandchild_pid = pids
+    # Reaped: no zombie left behind
+    with pytest.raises(ChildProcessError):
+        os.waitpid(pid, os.WNOHANG)
+    assert not Path(f"/proc/{pid}").exists()
+    assert await wait_for_exit(grandchild_pid)
+
+    assert await wait_for_fds(fds) == fds
+
+
+@pytest.mark.asyncio
+async def test_process_error_kills_unread_output() -> None:
+    fds = open_fds()
+
+    with pytest.raises(RuntimeError):
+        async with sh("yes").run() as proc:
+            async for _ in proc.line_batches():
+                raise RuntimeError("parse error")
+
+    assert proc.proc.returncode is not None
+    assert not Path(f"/proc/{proc.pid}").exists()
+    assert await wait_for_fds(fds) == fds
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import pstats
+import signal
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from zfs_feature_discovery.cli import run
+from zfs_feature_discovery.profiling import RefreshProfiler
+
+
+def busy_wait(duration: float) -> None:
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+async def fake_refresh() -> int:
+    busy_wait(0.02)
+    await asyncio.sleep(0)
+    return 42
+
+
+@pytest.mark.asyncio
+async def test_profiler_not_armed(tmp_path: Path) -> None:
+    profiler = RefreshProfiler(tmp_path)
+
+    assert await profiler.profile(fake_refresh()) == 42
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_profiler_cprofile_cycles(tmp_path: Path) -> None:
+    profiler = RefreshProfiler(tmp_path, cycles=2)
+    profiler.arm()
+
+    assert await profiler.profile(fake_refresh()) == 42
+    assert list(tmp_path.iterdir()) == []
+    assert await profiler.profile(fake_refresh()) == 42
+    assert not profiler.armed
+
+    (profile_path,) = tmp_path.glob("refresh-*.prof")
+    stats = pstats.Stats(str(profile_path))
+    profiled_funcs = {func for _, _, func in stats.stats}  # type: ignore[attr-defined]
+    assert "fake_refresh" in profiled_funcs
+
+
+@pytest.mark.asyncio
+async def test_profiler_sampling_task_names(tmp_path: Path) -> None:
+    profiler = RefreshProfiler(tmp_path, mode="sampling", sample_interval=0.001)
+    profiler.arm()
+
+    async def refresh() -> None:
+        await asyncio.create_task(fake_refresh(), name="busy")
+
+    await profiler.profile(refresh())
+
+    (profile_path,) = tmp_path.glob("refresh-*.folded")
+    stacks = profile_path.read_text().splitlines()
+    assert any(
+        stack.startswith("task:busy;") and "busy_wait" in stack for stack in stacks
+    )
+
+
+@pytest.mark.usefixtures("mock_default_config")
+@pytest.mark.asyncio
+async def test_cli_profile_oneshot(
+    mock_feature_manager: MagicMock, tmp_path: Path
+) -> None:
+    await run(oneshot=True, profile=True, profile_dir=tmp_path)
+
+    mock_feature_manager.refresh.assert_called_once()
+    assert len(list(tmp_path.glob("refresh-*.prof"))) == 1
+
+
+@pytest.mark.usefixtures("mock_default_config")
+@pytest.mark.asyncio
+async def test_cli_profile_signal(
+    mock_feature_manager: MagicMock, tmp_path: Path
+) -> None:
+    async def send_signal() -> None:
+        await asyncio.sleep(0.05)
+        os.kill(os.getpid(), signal.SIGUSR1)
+
+    signal_task = asyncio.create_task(send_signal())
+    try:
+        async with asyncio.timeout(0.3):
+            await run(sleep_interval=0.1, profile_dir=tmp_path)
+    except asyncio.TimeoutError:
+        pass
+
+    await signal_task
+    assert len(list(tmp_path.glob("refresh-*.prof"))) == 1
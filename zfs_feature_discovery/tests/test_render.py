@@ -0,0 +1,106 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from zfs_feature_discovery.config import Config
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.plan import LabelTemplate
+from zfs_feature_discovery.render import RenderPool, group_labels
+from zfs_feature_discovery.zpool import ZpoolManager
+
+from .conftest import read_all_labels
+
+
+def test_render_pool_wants() -> None:
+    pool = RenderPool(2, threshold=100)
+    assert not pool.wants(99)
+    assert pool.wants(100)
+    assert not RenderPool(0, threshold=1).wants(100)
+
+
+def test_render_pool_from_config() -> None:
+    config = Config.model_validate({"zpools": {"rpool": []}})
+    assert RenderPool.from_config(config) is None
+    assert FeatureManager.from_config(config).render_pool is None
+
+    config = Config.model_validate(
+        {"zpools": {"rpool": []}, "render_processes": 2, "render_threshold": 10}
+    )
+    pool = RenderPool.from_config(config)
+    assert pool and pool.processes == 2 and pool.threshold == 10
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+async def test_render_pool_same_labels(
+    feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    ds_props = await zpool.dataset_properties()
+    await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+    inline_labels = await read_all_labels(feature_manager.feature_dir)
+
+    # One dataset per chunk, so the results of several workers are merged
+    pool = RenderPool(2, threshold=1, chunk_size=1)
+    feature_manager.render_pool = pool
+    try:
+        await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+        assert pool._executor is not None
+    finally:
+        pool.close()
+
+    pool_labels = await read_all_labels(feature_manager.feature_dir)
+    assert pool_labels == inline_labels
+    assert list(pool_labels) == list(inline_labels)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+async def test_render_pool_failure(
+    mocker: MockerFixture, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    ds_props = await zpool.dataset_properties()
+    await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+    inline_labels = await read_all_labels(feature_manager.feature_dir)
+
+    pool = RenderPool(2, threshold=1)
+    mocker.patch.object(pool, "render", AsyncMock(side_effect=RuntimeError))
+    feature_manager.render_pool = pool
+    await feature_manager.write_zpool_dataset_features(zpool, ds_props)
+
+    # Rendered inline instead
+    assert await read_all_labels(feature_manager.feature_dir) == inline_labels
+
+
+def test_group_labels() -> None:
+    format = "zfs.{dataset_name}.{property_name}"
+    templates = [
+        LabelTemplate.compile("ns.io", format, dataset_name=ds)
+        for ds in ["a", "b", "b"]
+    ]
+    summary = LabelTemplate.compile("ns.io", format, dataset_name="_all")
+    labels = {
+        "ns.io/zfs.a.type": "filesystem",
+        "ns.io/zfs.b.type": "filesystem",
+        "ns.io/zfs.a.readonly": "off",
+        "ns.io/zfs.b.readonly": "on",
+        "ns.io/zfs.a.quota": "0",
+    }
+
+    group_labels(labels, templates, summary, ["type", "readonly", "quota"])
+    assert labels == {
+        "ns.io/zfs.a.readonly": "off",
+        "ns.io/zfs.b.readonly": "on",
+        "ns.io/zfs.a.quota": "0",
+        "ns.io/zfs._all.type": "filesystem",
+        "ns.io/zfs._all.readonly": "mixed",
+        # Missing for a dataset
+        "ns.io/zfs._all.quota": "mixed",
+    }
+
+    # Nothing to summarize without datasets
+    labels = {}
+    group_labels(labels, [], summary, ["type"])
+    assert labels == {}
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from pathlib import Path
+
+import aiofiles
+
+from zfs_feature_discovery.benchmark.simulation import (
+    SimulationSettings,
+    VirtualTimeEventLoop,
+    format_report,
+    run_simulation,
+)
+
+
+def test_virtual_clock(tmp_path: Path) -> None:
+    async def main() -> float:
+        loop = asyncio.get_running_loop()
+        for i in range(3):
+            await asyncio.sleep(3600)
+            # File I/O in the executor doesn't let the clock skip ahead
+            async with aiofiles.open(tmp_path / f"file{i}", "w") as f:
+                await f.write(str(loop.time()))
+
+        return loop.time()
+
+    start = time.perf_counter()
+    with asyncio.Runner(loop_factory=VirtualTimeEventLoop) as runner:
+        assert runner.run(main()) == 3 * 3600
+
+    assert time.perf_counter() - start < 5
+    assert (tmp_path / "file2").read_text() == str(3.0 * 3600)
+
+
+def test_simulation_counts() -> None:
+    settings = SimulationSettings(
+        nodes=3,
+        datasets=2,
+        interval=60,
+        splay="none",
+        duration=180,
+        changes_per_minute=100,
+        dataset_props="used,available",
+    )
+    result = run_simulation(settings)
+    summary = result.summary()
+
+    # 3 refreshes per node, running version, hostid, zpool get and zfs get
+    assert sum(result.per_minute["forks"].values()) == 3 * 3 * 4
+    # Writing global, zpool and dataset files at first, then only changed ones
+    assert result.per_minute["writes"][0] == 3 * 3
+    assert 0 < sum(result.per_minute["writes"].values()) - 3 * 3 < 2 * 3 * 2
+    assert summary["forks_peak_min"] == 3 * 4
+    assert summary["label_changes_per_min"] > 0
+    # All nodes refresh at the same time
+    assert summary["peak_running_commands"] == 3 * 4
+
+    assert settings.name in format_report([result])
+
+
+def test_simulation_steady_state() -> None:
+    settings = SimulationSettings(
+        nodes=1,
+        datasets=1,
+        interval=600,
+        splay="none",
+        duration=7200,
+        changes_per_minute=0,
+    )
+    result = run_simulation(settings)
+
+    # Files are only rewritten once less than half their TTL is left
+    writes = result.per_minute["writes"]
+    assert {minute: n for minute, n in writes.items() if n} == {0: 3, 40: 3, 80: 3}
+
+
+def test_simulation_splay() -> None:
+    settings = SimulationSettings(nodes=20, datasets=1, splay="random", duration=120)
+    summary = run_simulation(settings).summary()
+
+    assert summary["peak_running_commands"] < 20 * 4
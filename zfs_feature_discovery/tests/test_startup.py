@@ -0,0 +1,62 @@
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Total import time budget for a CLI invocation, in microseconds. This is
+# intentionally generous to avoid flakiness on slow CI runners: it is meant to
+# catch heavy dependencies creeping back into startup, not small changes.
+CLI_IMPORT_BUDGET_US = 400_000
+
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def import_times(code: str, top_level: bool = False) -> dict[str, int]:
+    """
+    Run code in a fresh interpreter with `-X importtime`, and return the
+    cumulative import time of each import it caused, in microseconds. With
+    `top_level`, only imports not made by other modules are included, which add
+    up to the total.
+    """
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    result = {}
+    for line in proc.stderr.splitlines():
+        if match := IMPORTTIME_PATTERN.match(line):
+            _, cumulative, indent, name = match.groups()
+            if not (top_level and indent):
+                result[name] = int(cumulative)
+
+    return result
+
+
+@pytest.mark.parametrize(
+    "module,lazy_modules",
+    [
+        ("zfs_feature_discovery.cli", ["yaml", "argdantic", "pydantic_settings"]),
+        ("zfs_feature_discovery.features", ["yaml", "argdantic", "pydantic"]),
+    ],
+)
+def test_startup_lazy_imports(module: str, lazy_modules: list[str]) -> None:
+    imported = import_times(f"import {module}")
+    assert module in imported
+
+    for lazy_module in lazy_modules:
+        assert lazy_module not in imported, f"{lazy_module} imported by {module}"
+
+
+def test_startup_import_budget() -> None:
+    # Time an actual invocation, as the parser and config are only imported then
+    imported = import_times(
+        "from zfs_feature_discovery.cli import main; main(['--help'])",
+        top_level=True,
+    )
+    assert "argdantic" in imported
+    assert sum(imported.values()) < CLI_IMPORT_BUDGET_US
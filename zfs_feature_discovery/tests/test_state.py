@@ -0,0 +1,129 @@
+import json
+from dataclasses import replace
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from pytest import TempPathFactory
+from pytest_mock import MockerFixture
+
+import zfs_feature_discovery.state
+from zfs_feature_discovery.features import (
+    FeatureFileState,
+    FeatureManager,
+    RefreshResult,
+)
+from zfs_feature_discovery.state import StateStore
+from zfs_feature_discovery.zpool import ZpoolManager
+
+from .conftest import read_all_labels
+
+
+@pytest.fixture
+def state_path(tmp_path_factory: TempPathFactory) -> Path:
+    return tmp_path_factory.mktemp("state-") / "state.json"
+
+
+@pytest.fixture
+def state_store(state_path: Path) -> StateStore:
+    return StateStore(state_path, key="test")
+
+
+@pytest.fixture
+def file_states(reference_time: datetime) -> dict[str, FeatureFileState]:
+    return {
+        "zpool.rpool": FeatureFileState(
+            expiry=reference_time + timedelta(hours=1),
+            labels={"me.danielkza.io/zpool.rpool.health": "ONLINE"},
+        )
+    }
+
+
+@pytest.mark.asyncio
+async def test_state_roundtrip(
+    state_store: StateStore, file_states: dict[str, FeatureFileState]
+) -> None:
+    assert await state_store.load() == {}
+
+    await state_store.store(file_states)
+    assert await state_store.load() == file_states
+
+
+@pytest.mark.asyncio
+async def test_state_store_unchanged(
+    state_store: StateStore,
+    state_path: Path,
+    file_states: dict[str, FeatureFileState],
+    mocker: MockerFixture,
+) -> None:
+    write_json = mocker.spy(zfs_feature_discovery.state, "write_json")
+    await state_store.store(file_states)
+    await state_store.store(dict(file_states))
+    assert write_json.call_count == 1
+
+    # Nor after loading the same state
+    store = StateStore(state_path, key="test")
+    await store.store(await store.load())
+    assert write_json.call_count == 1
+
+    changed = replace(file_states["zpool.rpool"], labels={})
+    await store.store({"zpool.rpool": changed})
+    assert write_json.call_count == 2
+    assert await store.load() == {"zpool.rpool": changed}
+
+
+@pytest.mark.asyncio
+async def test_state_key_mismatch(
+    state_store: StateStore,
+    state_path: Path,
+    file_states: dict[str, FeatureFileState],
+) -> None:
+    await state_store.store(file_states)
+
+    assert await StateStore(state_path, key="other").load() == {}
+
+
+@pytest.mark.asyncio
+async def test_state_invalid(state_store: StateStore, state_path: Path) -> None:
+    state_path.write_text("not json")
+    assert await state_store.load() == {}
+
+    state_path.write_text(
+        json.dumps(
+            {"version": 1, "key": "test", "files": {"rpool": {"labels": {"a": 1}}}}
+        )
+    )
+    assert await state_store.load() == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("zpool_datasets", [["test1"]])
+async def test_refresh_restored_state(
+    feature_manager: FeatureManager,
+    zpool: ZpoolManager,
+    state_store: StateStore,
+    refresh_result: RefreshResult,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch.object(feature_manager, "collect", return_value=refresh_result)
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+    written = feature_manager.files_written
+    all_labels = await read_all_labels(feature_manager.feature_dir)
+
+    await state_store.store(feature_manager.file_states())
+    files = await state_store.load()
+    assert files == feature_manager.file_states()
+
+    # Nothing changed, and the files are far from expiring
+    feature_manager.restore(files)
+    await feature_manager.refresh()
+    assert feature_manager.files_written == written
+    assert await read_all_labels(feature_manager.feature_dir) == all_labels
+
+    # Only the file about to expire is rewritten
+    expiring = replace(files["zpool.rpool"], expiry=feature_manager.now)
+    feature_manager.restore({**files, "zpool.rpool": expiring})
+    await feature_manager.refresh()
+    assert feature_manager.files_written == written + 1
+    assert feature_manager.file_states() == files
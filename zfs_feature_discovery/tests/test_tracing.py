@@ -0,0 +1,93 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from pytest import TempPathFactory
+
+from zfs_feature_discovery import tracing
+from zfs_feature_discovery.features import FeatureManager
+from zfs_feature_discovery.zpool import ZpoolManager
+
+
+@pytest.fixture
+def trace_path(tmp_path_factory: TempPathFactory) -> Iterator[Path]:
+    path = tmp_path_factory.mktemp("trace-") / "trace.jsonl"
+    with tracing.trace_to(path):
+        yield path
+
+
+def read_spans(path: Path) -> list[dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_tracing_disabled() -> None:
+    span = tracing.span("test", attr=1)
+    assert isinstance(span, tracing.NoopSpan)
+
+    with span as s:
+        s.set(other=2)
+
+
+@pytest.mark.asyncio
+async def test_tracing_nested_spans(trace_path: Path) -> None:
+    async def child(n: int) -> None:
+        with tracing.span("child", n=n) as span:
+            await asyncio.sleep(0)
+            span.set(done=True)
+
+    with tracing.span("parent"):
+        await asyncio.gather(child(1), child(2))
+
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError()
+
+    spans = {(s["name"], s["attrs"].get("n")): s for s in read_spans(trace_path)}
+    parent = spans[("parent", None)]
+    assert parent["parent_id"] is None
+
+    for n in (1, 2):
+        child_span = spans[("child", n)]
+        assert child_span["trace_id"] == parent["trace_id"]
+        assert child_span["parent_id"] == parent["span_id"]
+        assert child_span["attrs"]["done"] is True
+        assert child_span["duration_ms"] <= parent["duration_ms"]
+
+    failing = spans[("failing", None)]
+    assert failing["trace_id"] != parent["trace_id"]
+    assert failing["attrs"]["error"] == "ValueError"
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_zpool_properties")
+@pytest.mark.usefixtures("mock_zfs_dataset_properties")
+@pytest.mark.usefixtures("mock_zfs_global_properties")
+async def test_tracing_refresh(
+    trace_path: Path, feature_manager: FeatureManager, zpool: ZpoolManager
+) -> None:
+    feature_manager.register_zpool(zpool)
+    await feature_manager.refresh()
+
+    spans = read_spans(trace_path)
+    names = {span["name"] for span in spans}
+    assert names >= {
+        "refresh",
+        "collect",
+        "command.spawn",
+        "command.run",
+        "zpool.parse",
+        "zfs.parse",
+        "render_dataset",
+        "write_feature_file",
+    }
+
+    (refresh_span,) = [span for span in spans if span["name"] == "refresh"]
+    assert all(span["trace_id"] == refresh_span["trace_id"] for span in spans)
+
+    rendered = {
+        span["attrs"]["dataset"] for span in spans if span["name"] == "render_dataset"
+    }
+    assert rendered == zpool.full_datasets
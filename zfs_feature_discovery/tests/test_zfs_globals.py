@@ -1,3 +1,5 @@
+from typing import Optional
+
 import pytest
 
 from zfs_feature_discovery.tests.conftest import CommandMocker
@@ -60,3 +62,17 @@ async def test_hostid_missing(
     )
     hostid = await zfs_globals.hostid()
     assert hostid is None
+
+
+@pytest.mark.parametrize(
+    "main,result",
+    [
+        ("2.2.2-1", False),
+        ("2.3.0-1", True),
+        ("2.10.1", True),
+        ("3.0.0", True),
+        (None, False),
+    ],
+)
+def test_zfs_version_supports_json(main: Optional[str], result: bool) -> None:
+    assert ZfsVersion(main=main, kernel=main).supports_json == result
@@ -1,7 +1,13 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Optional
+
 import pytest
 from pytest_mock import MockerFixture
 
 from zfs_feature_discovery.tests.conftest import CommandMocker
+from zfs_feature_discovery.zfs_props import OutputFormat, ZfsProperty
 from zfs_feature_discovery.zpool import ZpoolManager
 
 
@@ -53,3 +59,203 @@ async def test_zfs_no_dataset_get_properties(
 
     command_mocker.mock(zpool._zfs_cmd, mocker.ANY, exit_code=1)
     command_mocker.check_not_called()
+
+
+@pytest.mark.asyncio
+async def test_zfs_dataset_get_properties_failed(
+    zpool: ZpoolManager, command_mocker: CommandMocker
+) -> None:
+    command_mocker.mock(zpool._zfs_cmd, exit_code=1)
+    assert await zpool.get_dataset_properties() is None
+
+    # Every dataset still gets its labels, if empty
+    command_mocker.mock(zpool._zfs_cmd, exit_code=1)
+    assert await zpool.dataset_properties() == {ds: {} for ds in zpool.full_datasets}
+
+
+@pytest.mark.asyncio
+async def test_zfs_dataset_get_properties_pushdown(
+    zpool_datasets: list[str], command_mocker: CommandMocker
+) -> None:
+    zpool = ZpoolManager(
+        pool_name="rpool",
+        zpool_command=Path("/zpool_test"),
+        zfs_command=Path("/zfs_test"),
+        datasets=zpool_datasets,
+        zpool_props=["size", "health"],
+        zfs_dataset_props=["type", "recordsize"],
+        zfs_dataset_sources=["local", "received"],
+    )
+
+    command_mocker.mock(
+        zpool._zpool_cmd,
+        cmd=["/zpool_test", "get", "-Hp", "health,size", "rpool"],
+    )
+    await zpool.get_properties()
+    command_mocker.check_called()
+
+    command_mocker.mock(
+        zpool._zfs_cmd,
+        cmd=[
+            "/zfs_test",
+            *["get", "-Hp", "-s", "local,received", "recordsize,type"],
+            *zpool.full_datasets,
+        ],
+    )
+    await zpool.dataset_properties()
+    command_mocker.check_called()
+
+
+@pytest.mark.asyncio
+async def test_zpool_static_tier_commands(
+    zpool_datasets: list[str], command_mocker: CommandMocker
+) -> None:
+    zpool = ZpoolManager(
+        pool_name="rpool",
+        zpool_command=Path("/zpool_test"),
+        zfs_command=Path("/zfs_test"),
+        datasets=zpool_datasets,
+        zpool_props=["health", "capacity"],
+        zfs_dataset_props=["mounted"],
+        zpool_static_props=["guid", "ashift"],
+        zfs_dataset_static_props=["encryption"],
+    )
+    assert zpool.tiered
+
+    command_mocker.mock(
+        zpool._zpool_cmd,
+        cmd=["/zpool_test", "get", "-Hp", "capacity,health", "rpool"],
+    )
+    await zpool.get_properties()
+    command_mocker.check_called()
+
+    assert zpool._zpool_static_cmd
+    command_mocker.mock(
+        zpool._zpool_static_cmd,
+        cmd=["/zpool_test", "get", "-Hp", "ashift,guid", "rpool"],
+    )
+    await zpool.get_properties(static=True)
+    command_mocker.check_called()
+
+    assert zpool._zfs_static_cmd
+    command_mocker.mock(
+        zpool._zfs_static_cmd,
+        cmd=["/zfs_test", "get", "-Hp", "encryption", *zpool.full_datasets],
+    )
+    await zpool.dataset_properties(static=True)
+    command_mocker.check_called()
+
+
+@pytest.mark.asyncio
+async def test_zpool_untiered(zpool: ZpoolManager) -> None:
+    assert not zpool.tiered
+    assert await zpool.get_properties(static=True) == {}
+    assert await zpool.dataset_properties(static=True) == {}
+
+
+@pytest.mark.parametrize(
+    "source,result",
+    [
+        ("local", "local"),
+        ("inherited from rpool", "inherited"),
+        ("-", None),
+    ],
+)
+def test_zfs_property_source(source: str, result: Optional[str]) -> None:
+    prop = ZfsProperty.parse(f"rpool/test1\tcompression\tlz4\t{source}")
+    assert prop.source == result
+
+
+def to_json_output(output: bytes, key: str) -> bytes:
+    """
+    Convert tab-separated `get` output to the JSON format of OpenZFS 2.3
+    """
+
+    objects: dict[str, Any] = {}
+    for line in output.decode().splitlines():
+        name, prop, value, source = line.split("\t")
+        if source == "-":
+            json_source = {"type": "NONE", "data": "-"}
+        elif source.startswith("inherited from "):
+            json_source = {"type": "INHERITED", "data": source.split(" ")[-1]}
+        else:
+            json_source = {"type": source.upper(), "data": "-"}
+
+        obj = objects.setdefault(name, {"name": name, "properties": {}})
+        obj["properties"][prop] = {"value": value, "source": json_source}
+
+    return json.dumps({"output_version": {}, key: objects}).encode()
+
+
+@pytest.mark.asyncio
+async def test_zpool_get_properties_json(
+    zpool: ZpoolManager, command_mocker: CommandMocker, zpool_get_output: bytes
+) -> None:
+    command_mocker.mock(zpool._zpool_cmd, stdout=zpool_get_output)
+    text_props = await zpool.get_properties()
+
+    zpool.set_output_format("json")
+    command_mocker.mock(
+        zpool._zpool_cmd,
+        cmd=["/zpool_test", "get", "-jp", "all", zpool.pool_name],
+        stdout=to_json_output(zpool_get_output, "pools"),
+    )
+    assert await zpool.get_properties() == text_props
+
+
+@pytest.mark.asyncio
+async def test_zfs_dataset_get_properties_json(
+    zpool: ZpoolManager, command_mocker: CommandMocker, zfs_get_output: bytes
+) -> None:
+    command_mocker.mock(zpool._zfs_cmd, stdout=zfs_get_output)
+    text_props = await zpool.dataset_properties()
+
+    zpool.set_output_format("json")
+    command_mocker.mock(
+        zpool._zfs_cmd,
+        cmd=["/zfs_test", "get", "-jp", "all", *zpool.full_datasets],
+        stdout=to_json_output(zfs_get_output, "datasets"),
+    )
+    assert await zpool.dataset_properties() == text_props
+
+
+@pytest.mark.asyncio
+async def test_zfs_dataset_get_properties_json_invalid(
+    zpool: ZpoolManager, command_mocker: CommandMocker
+) -> None:
+    zpool.set_output_format("json")
+    command_mocker.mock(zpool._zfs_cmd, stdout=b'{"datasets": {"rpool/test1": ')
+
+    ds_props = await zpool.dataset_properties()
+    assert ds_props == {ds: {} for ds in zpool.full_datasets}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("output_format", ["text", "json"])
+async def test_zfs_dataset_get_properties_yields(
+    mocker: MockerFixture,
+    command_mocker: CommandMocker,
+    zfs_get_output: bytes,
+    zpool_datasets: list[str],
+    output_format: OutputFormat,
+) -> None:
+    zpool = ZpoolManager(
+        pool_name="rpool",
+        zpool_command=Path("/zpool_test"),
+        zfs_command=Path("/zfs_test"),
+        datasets=zpool_datasets,
+        output_format=output_format,
+        yield_rows=10,
+    )
+    stdout = zfs_get_output
+    if output_format == "json":
+        stdout = to_json_output(zfs_get_output, "datasets")
+    command_mocker.mock(zpool._zfs_cmd, stdout=stdout)
+
+    sleep = mocker.spy(asyncio, "sleep")
+    ds_props = await zpool.dataset_properties()
+
+    rows = sum(len(props) for props in ds_props.values())
+    assert rows > 20
+    yields = [c for c in sleep.call_args_list if c.args == (0,)]
+    assert len(yields) == rows // 10
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Iterator, Optional, TextIO
+
+log = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class NoopSpan:
+    """
+    Returned by `span` when tracing is disabled, so instrumented code pays nothing
+    but a function call
+    """
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "attrs",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration",
+        "_tracer",
+        "_start_ns",
+        "_token",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = ""
+        self.parent_id: Optional[str] = None
+        self.start = 0.0
+        self.duration = 0.0
+
+        self._tracer = tracer
+        self._start_ns = 0
+        self._token: Any = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        if parent:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        else:
+            self.trace_id = os.urandom(16).hex()
+
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.duration = (time.perf_counter_ns() - self._start_ns) / 1e9
+        _current_span.reset(self._token)
+
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+
+        self._tracer.export(self)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    """
+    Exports finished spans as JSON lines to a text stream
+    """
+
+    def __init__(self, output: TextIO) -> None:
+        self.output = output
+
+    def export(self, span: Span) -> None:
+        try:
+            self.output.write(json.dumps(span.to_dict(), default=str) + "\n")
+            # Flush at the end of every trace, so we don't lose a partial refresh
+            if span.parent_id is None:
+                self.output.flush()
+        except (OSError, ValueError):
+            log.exception("Failed to export trace span")
+
+    def close(self) -> None:
+        if self.output is not sys.stderr:
+            self.output.close()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable_tracing(path: Path | str) -> Tracer:
+    """
+    Start exporting spans to a file. A path of `-` exports to stderr instead.
+    """
+
+    global _tracer
+
+    disable_tracing()
+    if str(path) == "-":
+        _tracer = Tracer(sys.stderr)
+    else:
+        _tracer = Tracer(open(path, "a"))
+
+    return _tracer
+
+
+def disable_tracing() -> None:
+    global _tracer
+
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+@contextmanager
+def trace_to(path: Path | str) -> Iterator[Tracer]:
+    tracer = enable_tracing(path)
+    try:
+        yield tracer
+    finally:
+        disable_tracing()
+
+
+def span(name: str, **attrs: Any) -> Span | NoopSpan:
+    """
+    Create a span to be used as a context manager. Spans started while another is
+    active, including in tasks created inside it, become its children.
+    """
+
+    if _tracer is None:
+        return _NOOP_SPAN
+
+    return Span(_tracer, name, attrs)
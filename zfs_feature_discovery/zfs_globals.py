@@ -5,25 +5,39 @@ from pathlib import Path
 from subprocess import CalledProcessError
 from typing import Optional
 
+from zfs_feature_discovery.host import HostNamespace
 from zfs_feature_discovery.zfs_props import CommandHarness
 
 log = logging.getLogger(__name__)
 
 
+# First version supporting `zfs get -j` and `zpool get -j`
+JSON_OUTPUT_VERSION = (2, 3)
+
+
 @dataclass
 class ZfsVersion:
     main: Optional[str]
     kernel: Optional[str]
 
+    @property
+    def supports_json(self) -> bool:
+        match = re.match(r"(\d+)\.(\d+)", self.main or "")
+        if not match:
+            return False
+
+        return (int(match.group(1)), int(match.group(2))) >= JSON_OUTPUT_VERSION
+
 
 class ZfsGlobals:
     def __init__(
         self,
         zfs_command: Path,
         hostid_command: Path,
+        host: Optional[HostNamespace] = None,
     ) -> None:
-        self._zfs_version_cmd = CommandHarness(str(zfs_command), "version")
-        self._hostid_cmd = CommandHarness(str(hostid_command))
+        self._zfs_version_cmd = CommandHarness(str(zfs_command), "version", host=host)
+        self._hostid_cmd = CommandHarness(str(hostid_command), host=host)
 
     async def zfs_version(self) -> ZfsVersion:
         try:
@@ -1,14 +1,34 @@
 import asyncio
 import asyncio.subprocess as subprocess
 import logging
-from asyncio import StreamReader
+import os
+from contextlib import asynccontextmanager
 from subprocess import CalledProcessError
-from typing import AsyncIterable, AsyncIterator, Literal, NamedTuple, Sequence, cast
+from typing import Any, AsyncIterator, Literal, NamedTuple, Optional, Sequence, cast
+
+from zfs_feature_discovery import tracing
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.json_stream import JsonObjectStream
+from zfs_feature_discovery.loops import YIELD_ROWS
+from zfs_feature_discovery.process import ManagedProcess
 
 log = logging.getLogger(__name__)
 
 Source = Literal["default", "local", "inherited", "temporary", "received"]
 
+# Parsing of `zfs get`/`zpool get` output: tab-separated (`-H`) or JSON (`-j`, from
+# OpenZFS 2.3)
+OutputFormat = Literal["text", "json"]
+
+# Source types in JSON output. NONE is mapped to None, as "-" is in text output.
+JSON_SOURCES: dict[str, Source] = {
+    "DEFAULT": "default",
+    "LOCAL": "local",
+    "INHERITED": "inherited",
+    "TEMPORARY": "temporary",
+    "RECEIVED": "received",
+}
+
 
 class ZfsProperty(NamedTuple):
     dataset: str
@@ -22,6 +42,8 @@ class ZfsProperty(NamedTuple):
 
         if source in ("default", "local", "inherited", "temporary", "received"):
             prop_source = source
+        elif source.startswith("inherited from "):
+            prop_source = "inherited"
         else:
             prop_source = None
 
@@ -29,59 +51,82 @@ class ZfsProperty(NamedTuple):
             dataset=ds, name=name, value=prop_value, source=cast(Source, prop_source)
         )
 
+    @classmethod
+    def from_json(cls, dataset: str, name: str, value: Any) -> "ZfsProperty":
+        """
+        Convert a property from JSON output, such as
+        `{"value": "lz4", "source": {"type": "INHERITED", "data": "rpool"}}`
+        """
 
-class CommandHarness:
-    def __init__(self, command: str, *args: str) -> None:
-        self.command = [command, *args]
-
-    async def handle_stdout(self, proc: subprocess.Process) -> AsyncIterable[str]:
-        assert proc.stdout
-        while True:
-            line = (await proc.stdout.readline()).decode()
-            if not line:
-                break
-
-            yield line
-
-    async def handle_stderr(self, proc: subprocess.Process) -> int:
-        cmd_name = self.command[0]
-
-        assert proc.stderr
-        while True:
-            line = (await proc.stderr.readline()).decode()
-            if not line:
-                break
+        source = value.get("source") or {}
+        return cls(
+            dataset=dataset,
+            name=name,
+            value=str(value["value"]),
+            source=JSON_SOURCES.get(source.get("type", "NONE")),
+        )
 
-            log.warning(f"{cmd_name}: {line.rstrip()}")
 
-        exit_code = await proc.wait()
-        log.info(f"{cmd_name}: finished with exit code {exit_code}")
+class CommandHarness:
+    def __init__(
+        self, command: str, *args: str, host: Optional[HostNamespace] = None
+    ) -> None:
+        """
+        With `host`, the command is run in the host's filesystem, and its path is
+        resolved there
+        """
 
-        return exit_code
+        self.command = [command, *args]
+        self.host = host
 
     async def _run(self, cmd: Sequence[str]) -> subprocess.Process:
         log.info(f"Running {list(cmd)}")
+        if self.host:
+            return cast(subprocess.Process, await self.host.spawn(cmd))
+
+        # In its own process group, so anything it spawns can be killed with it
         return await subprocess.create_subprocess_exec(
-            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            *cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
         )
 
-    async def stream_output(
-        self, *args: str
-    ) -> tuple[AsyncIterable[str], asyncio.Future[int]]:
+    async def _spawn(self, *args: str) -> subprocess.Process:
         cmd = [*self.command, *args]
-        proc = await self._run(cmd)
+        with tracing.span("command.spawn", command=cmd[0], args=cmd[1:]):
+            return await self._run(cmd)
+
+    @asynccontextmanager
+    async def run(self, *args: str) -> AsyncIterator[ManagedProcess]:
+        """
+        Spawn the command. It is killed and reaped when leaving the context, unless
+        it was waited for.
+        """
 
-        assert proc.stdout
-        fut = asyncio.create_task(self.handle_stderr(proc))
+        proc = await self._spawn(*args)
+        cmd_name = self.command[0]
+
+        with tracing.span("command.run", command=cmd_name, pid=proc.pid) as span:
+            try:
+                process_group = os.getpgid(proc.pid) == proc.pid
+            except ProcessLookupError:
+                process_group = False
 
-        return self.handle_stdout(proc), fut
+            async with ManagedProcess(
+                proc, cmd_name, process_group=process_group
+            ) as managed:
+                yield managed
+
+            span.set(exit_code=proc.returncode)
+
+        log.info(f"{cmd_name}: finished with exit code {proc.returncode}")
 
     async def check_output(self, *args: str) -> str:
-        stream, fut = await self.stream_output(*args)
-        lines = [line async for line in stream]
-        output = "".join(lines)
+        async with self.run(*args) as proc:
+            output = await proc.read_output()
+            exit_code = await proc.wait()
 
-        exit_code = await fut
         if exit_code != 0:
             raise CalledProcessError(exit_code, self.command[0], output=output)
 
@@ -91,29 +136,57 @@ class CommandHarness:
 class ZfsCommandHarness(CommandHarness):
     @classmethod
     async def stream_properties(
-        cls, stream: StreamReader
+        cls, proc: ManagedProcess, yield_rows: int = YIELD_ROWS
     ) -> AsyncIterator[ZfsProperty]:
-        while True:
-            line = (await stream.readline()).decode()
-            if not line:
-                break
+        """
+        Parse tab-separated output. Reads return immediately while output is
+        buffered, so the event loop is yielded to every `yield_rows` lines.
+        """
+
+        rows = 0
+        async for lines in proc.line_batches():
+            for line in lines:
+                rows += 1
+                if rows >= yield_rows:
+                    rows = 0
+                    await asyncio.sleep(0)
+
+                try:
+                    prop = ZfsProperty.parse(line)
+                except ValueError:
+                    log.warning(f"Failed to parse zfs line, ignoring: {line}")
+                    continue
+
+                yield prop
 
+    @classmethod
+    async def stream_json_properties(
+        cls, proc: ManagedProcess, key: str, yield_rows: int = YIELD_ROWS
+    ) -> AsyncIterator[ZfsProperty]:
+        """
+        Parse JSON output incrementally, one dataset or pool at a time. `key` is the
+        top-level member holding them: "datasets" for zfs, or "pools" for zpool. The
+        event loop is yielded to every `yield_rows` properties.
+        """
+
+        rows = 0
+        async for name, obj in JsonObjectStream(proc.chunks()).members(key):
             try:
-                prop = ZfsProperty.parse(line.rstrip())
-            except ValueError:
-                log.warning(f"Failed to parse zpool line, ignoring: {line}")
+                props = obj["properties"]
+            except (KeyError, TypeError):
+                log.warning(f"No properties for {name} in JSON output, ignoring")
                 continue
 
-            yield prop
-
-    async def get_properties(
-        self, *args: str
-    ) -> tuple[AsyncIterable[ZfsProperty], asyncio.Future[int]]:
-        cmd = [*self.command, *args]
-        proc = await self._run(cmd)
+            for prop_name, value in props.items():
+                rows += 1
+                if rows >= yield_rows:
+                    rows = 0
+                    await asyncio.sleep(0)
 
-        assert proc.stdout
-        props = self.stream_properties(proc.stdout)
-        fut = asyncio.create_task(self.handle_stderr(proc))
+                try:
+                    prop = ZfsProperty.from_json(name, prop_name, value)
+                except (KeyError, AttributeError):
+                    log.warning(f"Failed to parse property {prop_name} of {name}")
+                    continue
 
-        return props, fut
+                yield prop
@@ -1,10 +1,15 @@
 import logging
 from pathlib import Path
-from typing import Collection, Mapping, Optional
+from typing import AsyncIterator, Collection, Mapping, Optional
 
 from aioitertools.itertools import groupby
 
+from zfs_feature_discovery import tracing
+from zfs_feature_discovery.host import HostNamespace
+from zfs_feature_discovery.loops import YIELD_ROWS
+from zfs_feature_discovery.process import ManagedProcess
 from zfs_feature_discovery.zfs_props import (
+    OutputFormat,
     ZfsCommandHarness,
     ZfsProperty,
 )
@@ -12,6 +17,13 @@ from zfs_feature_discovery.zfs_props import (
 log = logging.getLogger(__name__)
 
 
+def props_arg(props: Optional[Collection[str]]) -> str:
+    if not props:
+        return "all"
+
+    return ",".join(sorted(props))
+
+
 class ZpoolManager:
     def __init__(
         self,
@@ -20,71 +32,200 @@ class ZpoolManager:
         datasets: Collection[str],
         zpool_command: Path,
         zfs_command: Path,
+        zpool_props: Optional[Collection[str]] = None,
+        zfs_dataset_props: Optional[Collection[str]] = None,
+        zfs_dataset_sources: Collection[str] = (),
+        zpool_static_props: Optional[Collection[str]] = None,
+        zfs_dataset_static_props: Optional[Collection[str]] = None,
+        output_format: OutputFormat = "text",
+        yield_rows: int = YIELD_ROWS,
+        host: Optional[HostNamespace] = None,
     ) -> None:
+        """
+        `zpool_props` and `zfs_dataset_props` limit which properties are requested,
+        instead of all of them. `zfs_dataset_sources` is passed to `zfs get -s`;
+        `zpool get` has no equivalent, so pool properties can only be filtered after
+        the fact. With `host`, commands are run in the host's filesystem.
+
+        `zpool_static_props` and `zfs_dataset_static_props` are requested by separate
+        commands, with `static=True`, so they can be fetched less often than the
+        rest. They should not overlap with `zpool_props` and `zfs_dataset_props`.
+
+        Parsing yields to the event loop every `yield_rows` properties.
+        """
+
         self.pool_name = pool_name
         self.datasets = frozenset(datasets)
-
-        self._zpool_cmd = ZfsCommandHarness(
-            str(zpool_command), "get", "-Hp", "all", pool_name
+        self.full_datasets = frozenset(f"{pool_name}/{ds}" for ds in self.datasets)
+
+        self._zpool_command = str(zpool_command)
+        self._zfs_command = str(zfs_command)
+        self._zpool_props = props_arg(zpool_props)
+        self._zfs_dataset_props = props_arg(zfs_dataset_props)
+        self._zfs_dataset_sources = sorted(zfs_dataset_sources)
+        self._zpool_static_props = (
+            props_arg(zpool_static_props) if zpool_static_props else None
+        )
+        self._zfs_dataset_static_props = (
+            props_arg(zfs_dataset_static_props) if zfs_dataset_static_props else None
         )
+        self._host = host
+        self._yield_rows = yield_rows
+
+        self.output_format = output_format
+        self._build_commands()
+
+    def set_output_format(self, output_format: OutputFormat) -> None:
+        if output_format != self.output_format:
+            self.output_format = output_format
+            self._build_commands()
+
+    @property
+    def zpool_tiered(self) -> bool:
+        return self._zpool_static_props is not None
 
-        self._zfs_cmd = ZfsCommandHarness(
-            str(zfs_command),
+    @property
+    def datasets_tiered(self) -> bool:
+        return bool(self.datasets) and self._zfs_dataset_static_props is not None
+
+    @property
+    def tiered(self) -> bool:
+        """
+        Whether some properties are fetched separately, as a static tier
+        """
+
+        return self.zpool_tiered or self.datasets_tiered
+
+    def _zpool_get(self, props: str) -> ZfsCommandHarness:
+        format_args = ["-jp"] if self.output_format == "json" else ["-Hp"]
+        return ZfsCommandHarness(
+            self._zpool_command,
             "get",
-            "-Hp",
-            "all",
+            *format_args,
+            props,
+            self.pool_name,
+            host=self._host,
         )
 
-    @property
-    def full_datasets(self) -> frozenset[str]:
-        return frozenset([f"{self.pool_name}/{ds}" for ds in self.datasets])
+    def _zfs_get(self, props: str) -> ZfsCommandHarness:
+        zfs_args = ["get", "-jp" if self.output_format == "json" else "-Hp"]
+        if self._zfs_dataset_sources:
+            zfs_args += ["-s", ",".join(self._zfs_dataset_sources)]
+
+        return ZfsCommandHarness(self._zfs_command, *zfs_args, props, host=self._host)
+
+    def _build_commands(self) -> None:
+        self._zpool_cmd = self._zpool_get(self._zpool_props)
+        self._zfs_cmd = self._zfs_get(self._zfs_dataset_props)
+
+        # Argument lists for each tier are built once, like the regular ones
+        self._zpool_static_cmd: Optional[ZfsCommandHarness] = None
+        if self._zpool_static_props:
+            self._zpool_static_cmd = self._zpool_get(self._zpool_static_props)
+
+        self._zfs_static_cmd: Optional[ZfsCommandHarness] = None
+        if self._zfs_dataset_static_props:
+            self._zfs_static_cmd = self._zfs_get(self._zfs_dataset_static_props)
+
+    def _stream_properties(
+        self, cmd: ZfsCommandHarness, proc: ManagedProcess, key: str
+    ) -> AsyncIterator[ZfsProperty]:
+        if self.output_format == "json":
+            return cmd.stream_json_properties(proc, key, self._yield_rows)
+
+        return cmd.stream_properties(proc, self._yield_rows)
+
+    async def get_properties(
+        self, static: bool = False
+    ) -> Optional[Mapping[str, ZfsProperty]]:
+        """
+        Get the pool's properties, or only its static ones with `static`
+        """
+
+        cmd = self._zpool_static_cmd if static else self._zpool_cmd
+        if cmd is None:
+            return {}
 
-    async def get_properties(self) -> Optional[Mapping[str, ZfsProperty]]:
         try:
-            props, exit_fut = await self._zpool_cmd.get_properties()
+            async with cmd.run() as proc:
+                with tracing.span("zpool.parse", pool=self.pool_name) as span:
+                    prop_map = {
+                        prop.name: prop
+                        async for prop in self._stream_properties(cmd, proc, "pools")
+                    }
+                    span.set(properties=len(prop_map))
+
+                exit_code = await proc.wait()
         except OSError:
             log.warning("Failed to run zpool")
             return None
+        except ValueError as e:
+            log.warning(f"Failed to parse zpool output: {e}")
+            return None
 
-        prop_map = {prop.name: prop async for prop in props}
-
-        exit_code = await exit_fut
         if exit_code != 0:
             return None
 
         return prop_map
 
     async def dataset_properties(
-        self,
+        self, static: bool = False
     ) -> Mapping[str, Mapping[str, ZfsProperty]]:
-        if not self.datasets:
+        """
+        Get the properties of the pool's datasets, or only their static ones with
+        `static`. If the command fails, every dataset has no properties.
+        """
+
+        result = await self.get_dataset_properties(static)
+        if result is None:
+            return {ds: {} for ds in self.full_datasets}
+
+        return result
+
+    async def get_dataset_properties(
+        self, static: bool = False
+    ) -> Optional[Mapping[str, Mapping[str, ZfsProperty]]]:
+        """
+        Like `dataset_properties`, but None if the command fails. Datasets without
+        any properties, such as when filtering by source, are left out.
+        """
+
+        cmd = self._zfs_static_cmd if static else self._zfs_cmd
+        if not self.datasets or cmd is None:
             return {}
 
+        prefix = f"{self.pool_name}/"
+        result: dict[str, Mapping[str, ZfsProperty]] = {}
         try:
-            all_props, exit_fut = await self._zfs_cmd.get_properties(
-                *self.full_datasets
-            )
+            async with cmd.run(*self.full_datasets) as proc:
+                all_props = self._stream_properties(cmd, proc, "datasets")
+                with tracing.span("zfs.parse", pool=self.pool_name) as span:
+                    async for dataset, props in groupby(
+                        all_props, lambda prop: prop.dataset
+                    ):
+                        relative_dataset = dataset.removeprefix(prefix)
+                        if relative_dataset == dataset:
+                            log.warning(
+                                f"Received unexpected dataset {dataset} outside of "
+                                f"{prefix}, skipping"
+                            )
+                            continue
+
+                        prop_map = {prop.name: prop for prop in props}
+                        result[dataset] = prop_map
+
+                    span.set(datasets=len(result))
+
+                exit_code = await proc.wait()
         except OSError:
             log.warning("Failed to run zfs")
-            return {ds: {} for ds in self.full_datasets}
+            return None
+        except ValueError as e:
+            log.warning(f"Failed to parse zfs output: {e}")
+            return None
 
-        prefix = f"{self.pool_name}/"
-        result: dict[str, Mapping[str, ZfsProperty]] = {}
-        async for dataset, props in groupby(all_props, lambda prop: prop.dataset):
-            relative_dataset = dataset.removeprefix(prefix)
-            if relative_dataset == dataset:
-                log.warning(
-                    f"Received unexpected dataset {dataset} outside of {prefix}, "
-                    f"skipping"
-                )
-                continue
-
-            prop_map = {prop.name: prop for prop in props}
-            result[dataset] = prop_map
-
-        exit_code = await exit_fut
         if exit_code != 0:
             log.warning("Failed to run zfs")
-            return {ds: {} for ds in self.full_datasets}
+            return None
 
         return result